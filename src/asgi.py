@@ -0,0 +1,102 @@
+"""ASGI application initialization and configuration.
+
+Contains the code that creates the ASGI application, an alternative to
+the WSGI application in `main.py` for serving many concurrent,
+mostly-idle connections from a single process.
+
+The follow and like endpoints are served by the async versions in
+`controllers.async_controller`, using an `AsyncSession`. Every other
+request is passed to the Flask application, which runs in a thread pool.
+
+The feeds stay synchronous. Their comment previews, relevance ranking,
+view counts and caches run on the sharded, synchronous session, so each
+feed request still holds a thread of the pool while it queries the
+database, as it would under a WSGI server. Only the follow and like
+endpoints hold no thread while they wait.
+
+Run it with an ASGI server, for example:
+
+    uvicorn asgi:app --port 5555
+
+The async database URL is read from `ASYNC_DATABASE_URL`. If it is not
+set, it is derived from `DATABASE_URL` by swapping in an async driver.
+
+The async endpoints read posts from a single database, so when posts
+are sharded every request is passed to the Flask application instead.
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from main import create_app
+from controllers.async_controller import routes
+from services import sharding, startup
+
+
+# The async driver used for each database backend
+ASYNC_DRIVERS = {
+    'postgresql': 'asyncpg',
+    'sqlite': 'aiosqlite',
+}
+
+
+def async_database_url(url):
+    """Return the async driver version of a database URL.
+
+    Parameters
+    ----------
+    url : str
+        The database URL, using any driver.
+
+    Returns
+    -------
+    str
+        The database URL using the async driver for its backend.
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver is configured for {backend}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}") \
+        .render_as_string(hide_password=False)
+
+
+def create_asgi_app():
+    """Create and configure an instance of the ASGI application.
+
+    Returns
+    -------
+    Starlette
+        The configured ASGI application.
+    """
+    # Create the Flask application for the endpoints that are not async,
+    # and set it up straight away, as the async endpoints use its JSON
+    # provider and JWT settings before it serves its first request
+    flask_app = startup.finish(create_app())
+
+    # Create the async engine, sized by the environment
+    url = os.environ.get('ASYNC_DATABASE_URL') or async_database_url(
+        flask_app.config['SQLALCHEMY_DATABASE_URI'])
+    options = {}
+    if make_url(url).get_backend_name() != 'sqlite':
+        options['pool_size'] = int(os.environ.get('ASYNC_POOL_SIZE', 20))
+        options['max_overflow'] = int(
+            os.environ.get('ASYNC_MAX_OVERFLOW', 20))
+    engine = create_async_engine(url, **options)
+
+    # Serve the async endpoints first, then everything else from Flask
+    async_routes = [] if sharding.is_sharded(flask_app) else routes
+    app = Starlette(
+        routes=async_routes + [Mount('/', app=WsgiToAsgi(flask_app))])
+    app.state.flask_app = flask_app
+    app.state.async_session = async_sessionmaker(
+        engine, expire_on_commit=False)
+    return app
+
+
+app = create_asgi_app()
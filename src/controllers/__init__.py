@@ -11,11 +11,40 @@ The controllers are:
 - `like_controller`: Handles like-related operations.
 - `feed_controller`: Handles feed-related operations.
 - `follow_controller`: Handles follow-related operations.
+- `search_controller`: Handles search-related operations.
+- `admin_controller`: Handles administration operations.
+- `notification_controller`: Handles the notification inbox.
+- `batch_controller`: Runs many requests in one round trip and transaction.
+- `async_controller`: Async follow and like operations for `asgi.py`.
+
+The blueprints are imported when they are first used, so that a CLI
+command only imports the CLI controller, and not the whole API.
 
 """
+from importlib import import_module
+
+
+# The module of each blueprint exported by this package
+BLUEPRINTS = {
+    'auth': 'auth_controller',
+    'user': 'user_controller',
+    'cli': 'cli_controller',
+    'post': 'post_controller',
+    'feed': 'feed_controller',
+    'search': 'search_controller',
+    'admin': 'admin_controller',
+    'notification': 'notification_controller',
+    'batch': 'batch_controller',
+}
+
 
-from .auth_controller import auth_controller as auth
-from .user_controller import user_controller as user
-from .cli_controller import cli_controller as cli
-from .post_controller import post_controller as post
-from .feed_controller import feed_controller as feed
\ No newline at end of file
+def __getattr__(name):
+    """
+    Imports a blueprint when it is first used.
+    """
+    if name not in BLUEPRINTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = BLUEPRINTS[name]
+    blueprint = getattr(import_module(f'.{module}', __name__), module)
+    globals()[name] = blueprint
+    return blueprint
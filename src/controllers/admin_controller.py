@@ -0,0 +1,47 @@
+"""
+This module contains the API endpoints for administration.
+
+The endpoints are:
+
+- **GET /admin/hot_keys**: Get the most requested posts and users of the serving process.
+"""
+from flask import Blueprint, current_app
+from flask_jwt_extended import jwt_required
+
+from utils import admin_required
+from services import hotkeys
+
+admin_controller = Blueprint(
+    'admin_controller', __name__, url_prefix='/admin')
+
+
+@admin_controller.route('/hot_keys', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_hot_keys():
+    """
+    Gets the most requested posts and users of the serving process.
+
+    Counts are halved every `HOT_KEY_WINDOW` seconds, so they follow
+    recent traffic. Keys counted at least `HOT_KEY_THRESHOLD` times are
+    hot, and served from the hot cache tier.
+
+    Returns
+    -------
+    dict
+        The keys, most requested first, with their recent counts and if
+        they are hot.
+    """
+    threshold = current_app.config['HOT_KEY_THRESHOLD']
+    keys = []
+    for key, count in hotkeys.tracker().hottest():
+        kind, key_id = key.split(':', 1)
+        keys.append({"kind": kind, "id": key_id, "count": count,
+                     "hot": count >= threshold})
+
+    return {
+        "message": "Hot keys retrieved successfully",
+        "threshold": threshold,
+        "window": current_app.config['HOT_KEY_WINDOW'],
+        "data": keys
+    }
@@ -0,0 +1,383 @@
+"""
+This module contains the async versions of the follow and like
+endpoints, served by the ASGI entry point in `asgi.py`.
+
+Each endpoint returns the same response as its Flask counterpart, but
+awaits the database through an `AsyncSession` instead of blocking a
+worker thread, so one process can hold thousands of mostly-idle
+connections open.
+
+The post endpoints count their requests towards the post being hot, as
+the Flask endpoints do, but `GET /posts/<post_id>/likes` is always
+answered from the database, never from the hot cache or the response
+cache of the Flask application. None of the endpoints counts views, as
+their Flask counterparts don't either: only reading a post, or seeing it
+in a feed or timeline, counts as a view.
+
+The endpoints are:
+
+- **GET /users/<user_id>/following**: Get all users that the user is following.
+- **GET /users/<user_id>/followers**: Get all followers for a user.
+- **POST /users/<user_id>/follow**: Follow a user.
+- **DELETE /users/<user_id>/follow**: Unfollow a user.
+- **POST /posts/<post_id>/like**: Like a post.
+- **DELETE /posts/<post_id>/like**: Unlike a post.
+- **GET /posts/<post_id>/likes**: Get a list of users who have liked a post.
+
+"""
+from flask_jwt_extended import decode_token
+from jwt import ExpiredSignatureError, PyJWTError
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+from starlette.responses import HTMLResponse, Response
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from models.follow import Follow, follow_schema, follows_schema
+from models.like import Like, likes_schema
+from models.post import Post, post_schema
+from models.user import User
+from services import events, hotkeys, negotiation, serializers, versions
+
+
+# The relationships dumped by PostSchema, loaded up front because
+# lazy loading is not possible with an AsyncSession
+POST_OPTIONS = (joinedload(Post.author), selectinload(Post.likes),
+                selectinload(Post.comments))
+
+
+class Unauthorized(Exception):
+    """
+    Raised when a request has a missing or invalid access token.
+
+    Attributes
+    ----------
+    status : int
+        The status code of the error response.
+    message : str
+        The error message.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def get_identity(request):
+    """
+    Returns the identity in the request's access token.
+
+    The token is checked the same way `jwt_required` checks it.
+
+    Parameters
+    ----------
+    request : Request
+        The request.
+
+    Returns
+    -------
+    int
+        The ID of the current user.
+
+    Raises
+    ------
+    Unauthorized
+        If the token is missing or invalid.
+    """
+    header = request.headers.get('Authorization', '')
+    if not header:
+        raise Unauthorized(401, "Missing Authorization Header")
+    scheme, _, token = header.partition(' ')
+    if scheme != 'Bearer' or not token:
+        raise Unauthorized(
+            422, "Bad Authorization header. Expected 'Authorization: Bearer <JWT>'")
+
+    flask_app = request.app.state.flask_app
+    try:
+        with flask_app.app_context():
+            claims = decode_token(token)
+    except ExpiredSignatureError as e:
+        raise Unauthorized(401, "Token has expired") from e
+    except PyJWTError as e:
+        raise Unauthorized(422, str(e)) from e
+    return claims[flask_app.config['JWT_IDENTITY_CLAIM']]
+
+
+def record_hot(request, kind, key_id):
+    """
+    Counts a request for a post or user towards it being hot, in the
+    Flask application's heavy-hitter tracker.
+    """
+    with request.app.state.flask_app.app_context():
+        hotkeys.record(kind, key_id)
+
+
+def wants_msgpack(request):
+    """
+    Returns if the request should be answered with MessagePack.
+    """
+    accept = parse_accept_header(request.headers.get('Accept'), MIMEAccept)
+    return negotiation.prefers_msgpack(accept)
+
+
+def render(request, data, status=200, headers=None):
+    """
+    Renders data as JSON or MessagePack, as the client prefers.
+
+    JSON is encoded by the Flask application's JSON provider, so the
+    bytes match those of the Flask endpoints.
+
+    Parameters
+    ----------
+    request : Request
+        The request.
+    data : object
+        The data to render.
+    status : int
+        The response status code.
+    headers : dict, optional
+        Extra response headers.
+
+    Returns
+    -------
+    Response
+        The response.
+    """
+    if wants_msgpack(request):
+        return Response(negotiation.packb(data), status_code=status,
+                        headers=headers,
+                        media_type=negotiation.MSGPACK_MIMETYPE)
+    body = request.app.state.flask_app.json.dumps(
+        data, separators=(',', ':')) + '\n'
+    return Response(body, status_code=status, headers=headers,
+                    media_type=negotiation.JSON_MIMETYPE)
+
+
+def dump(request, schema, obj):
+    """
+    Dumps an object with a compiled schema for the response format.
+    """
+    return serializers.dump(schema, obj, native=wants_msgpack(request))
+
+
+def etag_matches(request, etag):
+    """
+    Returns the ETag of the response, and if it matches `If-None-Match`.
+
+    Parameters
+    ----------
+    request : Request
+        The request.
+    etag : str
+        The ETag of the resource.
+
+    Returns
+    -------
+    tuple
+        The quoted weak ETag header value, and if the client already
+        has this representation.
+    """
+    value = versions.representation_etag(
+        etag, 'msgpack' if wants_msgpack(request) else 'json',
+        request.url.query)
+    header = f'W/"{value}"'
+    if_none_match = request.headers.get('If-None-Match', '')
+    candidates = {candidate.strip() for candidate in if_none_match.split(',')}
+    matches = header in candidates or f'"{value}"' in candidates \
+        or '*' in candidates
+    return header, matches
+
+
+def endpoint(handler):
+    """
+    Wraps an async endpoint with authentication and a database session.
+
+    The wrapped handler is called with the request, an `AsyncSession`
+    and the ID of the current user.
+    """
+    async def wrapper(request):
+        try:
+            identity = get_identity(request)
+        except Unauthorized as e:
+            return render(request, {"msg": e.message}, e.status)
+        async with request.app.state.async_session() as session:
+            return await handler(request, session, identity)
+    wrapper.__name__ = handler.__name__
+    wrapper.__doc__ = handler.__doc__
+    return wrapper
+
+
+@endpoint
+async def get_follows(request, session, _identity):
+    """
+    Gets all follows where the user is the follower.
+    """
+    user_id = request.path_params['user_id']
+    result = await session.execute(
+        select(Follow).where(Follow.follower_id == user_id))
+    return render(request, dump(request, follows_schema, result.scalars().all()))
+
+
+@endpoint
+async def get_followers(request, session, _identity):
+    """
+    Gets all follows where the user is the one being followed.
+    """
+    user_id = request.path_params['user_id']
+    result = await session.execute(
+        select(Follow).where(Follow.followed_id == user_id))
+    return render(request, dump(request, follows_schema, result.scalars().all()))
+
+
+@endpoint
+async def create_follow(request, session, identity):
+    """
+    Follows a user.
+    """
+    user_id = request.path_params['user_id']
+    if await session.get(User, user_id) is None:
+        return HTMLResponse('User not found', 404)
+
+    # Check if the current user is trying to follow themselves
+    if identity == user_id:
+        return HTMLResponse('Cannot follow yourself', 400)
+
+    new_follow = Follow(follower_id=identity, followed_id=user_id)
+    session.add(new_follow)
+    session.add(events.make_event(
+        events.USER_FOLLOWED, follower_id=identity, followed_id=user_id))
+
+    # Both users' profiles and the follower's feed have changed
+    await session.execute(versions.bump_users_statement(identity, user_id))
+    await session.commit()
+
+    return render(request, dump(request, follow_schema, new_follow))
+
+
+@endpoint
+async def unfollow(request, session, identity):
+    """
+    Unfollows a user.
+    """
+    user_id = request.path_params['user_id']
+    result = await session.execute(
+        select(Follow).where(Follow.follower_id == identity,
+                             Follow.followed_id == user_id))
+    follow = result.scalars().first()
+    if follow is None:
+        return HTMLResponse('Follow not found', 404)
+
+    # Dump the follow before it is deleted
+    data = dump(request, follow_schema, follow)
+    await session.delete(follow)
+    session.add(events.make_event(
+        events.USER_UNFOLLOWED, follower_id=identity, followed_id=user_id))
+
+    # Both users' profiles and the follower's feed have changed
+    await session.execute(versions.bump_users_statement(identity, user_id))
+    await session.commit()
+
+    return render(request, data)
+
+
+@endpoint
+async def like_post(request, session, identity):
+    """
+    Likes a post.
+    """
+    post_id = request.path_params['post_id']
+    record_hot(request, 'post', post_id)
+    post = await session.get(Post, post_id, options=POST_OPTIONS)
+    if post is None:
+        return render(request, {"message": "Post not found"}, 404)
+
+    if identity == post.author_id:
+        return render(request, {"message": "Cannot like own post"}, 400)
+
+    if any(like.user_id == identity for like in post.likes):
+        return render(request, {"message": "Post already liked"}, 400)
+
+    post.likes.append(Like(user_id=identity))
+    session.add(events.make_event(
+        events.POST_LIKED, post_id=post_id, author_id=post.author_id,
+        user_id=identity))
+
+    # The post, its author and the liking user have changed
+    await session.execute(versions.bump_post_statement(post_id))
+    await session.execute(
+        versions.bump_users_statement(post.author_id, identity))
+    await session.commit()
+
+    return render(request, dump(request, post_schema, post))
+
+
+@endpoint
+async def unlike_post(request, session, identity):
+    """
+    Unlikes a post.
+    """
+    post_id = request.path_params['post_id']
+    record_hot(request, 'post', post_id)
+    post = await session.get(Post, post_id, options=POST_OPTIONS)
+    if post is None:
+        return render(request, {"message": "Post not found"}, 404)
+
+    like = next((like for like in post.likes if like.user_id == identity),
+                None)
+    if like is None:
+        return render(request, {"message": "Post not liked"}, 400)
+
+    # Removing the like from the post deletes it
+    post.likes.remove(like)
+    session.add(events.make_event(
+        events.POST_UNLIKED, post_id=post_id, author_id=post.author_id,
+        user_id=identity))
+
+    # The post, its author and the unliking user have changed
+    await session.execute(versions.bump_post_statement(post_id))
+    await session.execute(
+        versions.bump_users_statement(post.author_id, identity))
+    await session.commit()
+
+    return render(request, dump(request, post_schema, post))
+
+
+@endpoint
+async def get_likes(request, session, _identity):
+    """
+    Gets the likes on a post.
+    """
+    post_id = request.path_params['post_id']
+    record_hot(request, 'post', post_id)
+
+    # Answer with 304 before loading the likes if nothing has changed
+    version = (await session.execute(
+        versions.post_version_query(post_id))).scalar()
+    if version is None:
+        return render(request, {"message": "Post not found"}, 404)
+    etag, matches = etag_matches(
+        request, versions.make_etag('post', post_id, version))
+    if matches:
+        return Response(status_code=304, headers={'ETag': etag})
+
+    result = await session.execute(
+        select(Like).where(Like.post_id == post_id))
+    likes = dump(request, likes_schema, result.scalars().all())
+    return render(request,
+                  {"message": "Likes retrieved successfully", "data": likes},
+                  headers={'ETag': etag})
+
+
+# The feeds are served by Flask, as their comment previews, relevance
+# ranking and view counts run on the sharded, synchronous session
+routes = [
+    Route('/users/{user_id:int}/following', get_follows, methods=['GET']),
+    Route('/users/{user_id:int}/followers', get_followers, methods=['GET']),
+    Route('/users/{user_id:int}/follow', create_follow, methods=['POST']),
+    Route('/users/{user_id:int}/follow', unfollow, methods=['DELETE']),
+    Route('/posts/{post_id:int}/like', like_post, methods=['POST']),
+    Route('/posts/{post_id:int}/like', unlike_post, methods=['DELETE']),
+    Route('/posts/{post_id:int}/likes', get_likes, methods=['GET']),
+]
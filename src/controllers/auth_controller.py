@@ -15,6 +15,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_tok
 
 from init import db, bcrypt
 from models.user import User, user_schema, profile_schema
+from services import deletion, sharding, versions
 
 
 auth_controller = Blueprint('auth', __name__, url_prefix='/auth')
@@ -131,9 +132,12 @@ def delete_user():
 
     # Get the user from the database
     user = User.query.get(user_id)
+    if user is None:
+        return {"message": "User not found"}, 404
 
-    # Delete the user from the database
-    db.session.delete(user)
+    # Hide the user straight away, and leave the deletion of their posts,
+    # likes, comments and follows to a background job
+    deletion.delete_user(user)
     db.session.commit()
 
     # Return a JSON message indicating the status of the deletion
@@ -170,8 +174,12 @@ def confirm(token):
     # Set the `confirmed_on` attribute to the current datetime
     user.is_confirmed = True
     user.confirmed_on = datetime.now()
+    versions.bump_users(user.id)
     db.session.commit()
 
+    # Load the user's posts, likes and comments from every shard
+    sharding.load_collections(user, 'posts', 'likes', 'comments')
+
     # Return the confirmed user
     # Dump the `user` object to a JSON representation
     # Use the `profile_schema` to dump the user object
@@ -262,6 +270,9 @@ def reset_password(token):
     user.password_hash = hash_password
     db.session.commit()
 
+    # Load the user's posts, likes and comments from every shard
+    sharding.load_collections(user, 'posts', 'likes', 'comments')
+
     # Return the updated user
     # The `profile_schema.dump` function serializes the user
     # The `user` parameter is the user to serialize
@@ -308,6 +319,9 @@ def change_password():
     user.password_hash = hash_password
     db.session.commit()
 
+    # Load the user's posts, likes and comments from every shard
+    sharding.load_collections(user, 'posts', 'likes', 'comments')
+
     # Return the updated user
     return {
         "message": "Password changed successfully",
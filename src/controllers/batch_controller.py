@@ -0,0 +1,56 @@
+"""
+This module contains the API endpoint for running many requests at once.
+
+The endpoints are:
+
+- **POST /batch**: Run a list of requests in one round trip and one transaction.
+"""
+from flask import Blueprint, request
+from flask_jwt_extended import jwt_required
+
+from services import batch
+
+batch_controller = Blueprint('batch_controller', __name__, url_prefix='/batch')
+
+
+@batch_controller.route('/', methods=['POST'])
+@jwt_required()
+def run_batch():
+    """
+    Runs a list of requests to the other endpoints, such as several
+    likes, a comment and a follow, in one database transaction.
+
+    Request body must contain the following JSON keys:
+
+    - `operations`: The requests, at most `BATCH_MAX_OPERATIONS`, each
+      with its `method`, its `path`, including any query string, and an
+      optional JSON `body`.
+    - OPTIONAL: `atomic`: If `true`, the batch stops at the first
+      operation answered with an error status, and every operation is
+      rolled back. Otherwise only the failed operations are rolled back.
+      Defaults to `false`.
+
+    Returns
+    -------
+    dict
+        The status and body of each operation's response, in order, and
+        if the changes were committed.
+    """
+    body = request.get_json(silent=True) or {}
+    operations = body.get('operations')
+    atomic = body.get('atomic', False)
+
+    error = batch.validate(operations)
+    if error is None and not isinstance(atomic, bool):
+        error = "atomic must be true or false"
+    if error is not None:
+        return {"message": error}, 400
+
+    # Run every operation, and commit their changes once
+    results, committed = batch.run(operations, atomic=atomic)
+
+    return {
+        "message": "Batch committed" if committed else "Batch rolled back",
+        "committed": committed,
+        "results": results
+    }
@@ -6,13 +6,20 @@ The commands are:
 - `db_create`: Create all tables in the database.
 - `db_drop`: Drop all tables in the database.
 - `create_user <username> <email> <password> <bio> [--admin]`: Create a user, use the --admin flag to create an admin user.
-- `delete_user <username>`: Delete the selected user from the database.
+- `import_users <path> [--format csv|ndjson] [--batch-size N] [--processes N]`: Create users in bulk from a CSV or NDJSON file.
+- `delete_user <username> [--background]`: Delete the selected user from the database.
+- `reindex_search [--background]`: Rebuild the full-text search index from scratch.
+- `run_worker [--threads N] [--lanes high,default,low] [--burst] [--no-events]`: Run queued background jobs and deliver outbox events.
+- `profile_startup [--limit N] [--json]`: Report where the time of a cold start goes.
 
 """
+import json
+import signal
+import threading
 from datetime import datetime
 
 import click
-from flask import Blueprint
+from flask import Blueprint, current_app
 from sqlalchemy.exc import IntegrityError, OperationalError, DatabaseError
 
 
@@ -22,47 +29,109 @@ from models.post import Post
 from models.like import Like
 from models.comment import Comment
 from models.follow import Follow
+from services import (deletion, events, jobs, notifications, provisioning,
+                      search, sharding, startup)
 
 
 
 cli_controller = Blueprint('cli', __name__)
 
 
+def hash_password(password):
+    """
+    Returns the bcrypt hash of a password, with the application's
+    bcrypt settings.
+
+    The bcrypt extension is only set up with the HTTP surface of the
+    application, so the commands creating users set it up themselves.
+    """
+    bcrypt.init_app(current_app)
+    return bcrypt.generate_password_hash(password).decode('utf-8')
+
+
 @cli_controller.cli.command("create_user")
 @click.argument("username", default="user")
 @click.argument("email", default="user@localhost")
 @click.argument("password", default="user")
 @click.argument("bio", default="This is a user.")
 @click.option("--admin", is_flag=True)
-def create_user(username, email, password, admin):
+def create_user(username, email, password, bio, admin):
     """
     Creates a user in the database.
 
     The user is created with the specified username, email address,
-    password, and admin status.
+    password, bio, and admin status.
     """
-    # Hash the password
-    hash_password = bcrypt.generate_password_hash(password).decode('utf-8')
-    # Create a new user with the given information
-    user = User(username=username, email=email, password_hash=hash_password, bio=bio,
+    # Create a new user with the given information, and their hashed
+    # password
+    user = User(username=username, email=email,
+                password_hash=hash_password(password), bio=bio,
                 is_admin=admin, is_confirmed=True, confirmed_on=datetime.now())
     # Add the new user to the database
     db.session.add(user)
     db.session.commit()
 
 
+@cli_controller.cli.command("import_users")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(provisioning.FORMATS),
+              help="The format of the file. Defaults to its extension's.")
+@click.option("--batch-size", default=provisioning.IMPORT_BATCH_SIZE,
+              show_default=True, type=click.IntRange(min=1),
+              help="The number of users validated, hashed and inserted at once.")
+@click.option("--processes", type=click.IntRange(min=1),
+              help="The number of processes hashing passwords. "
+                   "Defaults to the number of cores.")
+def import_users(path, file_format, batch_size, processes):
+    """
+    Creates confirmed users from a CSV or NDJSON file.
+
+    Each row has a `username`, `email` and `password`, and optionally a
+    `bio` and an `is_admin` flag. Rows whose username or email address
+    is taken are skipped, so an interrupted import can be run again.
+    """
+    file_format = file_format or provisioning.format_of(path)
+    if file_format is None:
+        print("Unknown file format, use --format to set it.")
+        return
+
+    def report(result):
+        print(f"{result.read} rows read, {result.created} users created.")
+
+    with open(path, encoding='utf-8', newline='') as stream:
+        try:
+            result = provisioning.import_users(
+                provisioning.read_rows(stream, file_format),
+                batch_size=batch_size, processes=processes, on_batch=report)
+        except (IntegrityError, OperationalError, DatabaseError) as e:
+            db.session.rollback()
+            print(f"Database error: {e}")
+            return
+
+    for line_number, reason in result.invalid[:20]:
+        print(f"Line {line_number} skipped: {reason}.")
+    if len(result.invalid) > 20:
+        print(f"And {len(result.invalid) - 20} more invalid rows.")
+    print(f"Imported {result.created} users, skipped {result.existing} "
+          f"already taken and {len(result.invalid)} invalid.")
+
+
 @cli_controller.cli.command("db_create")
 def create_tables():
     """
     Creates all tables in the database.
     """
-    db.create_all()
+    # The models' tables live on the primary, the shards' are created
+    # from their own metadata, and the replica is never written to
+    db.create_all(bind_key=None)
+    sharding.create_all()
+    search.create_index()
     print("Tables created successfully.\n")
     users = [
-        User(username="admin", email="admin@localhost", password_hash=bcrypt.generate_password_hash(
-            "admin").decode('utf-8'), is_admin=True, is_confirmed=True, confirmed_on=datetime.now()),
-        User(username="user", email="user@localhost", password_hash=bcrypt.generate_password_hash(
-            "user").decode('utf-8'), is_admin=False, is_confirmed=True, confirmed_on=datetime.now())
+        User(username="admin", email="admin@localhost", password_hash=hash_password(
+            "admin"), is_admin=True, is_confirmed=True, confirmed_on=datetime.now()),
+        User(username="user", email="user@localhost", password_hash=hash_password(
+            "user"), is_admin=False, is_confirmed=True, confirmed_on=datetime.now())
     ]
     db.session.add_all(users)
 
@@ -93,6 +162,7 @@ def create_tables():
         Follow(follower=users[1], follows=users[0])
     ]
     db.session.add_all(follows)
+    search.rebuild_index(posts, comments)
     db.session.commit()
     print("User data added successfully.",
           "\n\nDefault users:\nadmin:admin\nuser:user\n\n",
@@ -106,26 +176,162 @@ def drop_tables():
     """
     Drops all tables in the database.
     """
-    db.drop_all()
+    search.drop_index()
+    sharding.drop_all()
+    db.drop_all(bind_key=None)
     print("Tables dropped successfully.")
 
 
 @cli_controller.cli.command("delete_user")
 @click.argument("username")
-def delete_user(username):
+@click.option("--background", is_flag=True,
+              help="Leave the purge of the user's data to a worker.")
+def delete_user(username, background):
     """
     Deletes a user from the database.
 
-    The user is deleted with the given username.
+    The user is deleted with the given username. Their posts, likes,
+    comments and follows are deleted in batches.
     """
     user = User.query.filter_by(username=username).first()
     if user is None:
         print(f"User '{username}' does not exist.")
         return
-    db.session.delete(user)
     try:
+        job = deletion.delete_user(user)
         db.session.commit()
-        print(f"User '{username}' deleted successfully.")
+        if background:
+            print(f"User '{username}' deleted, purge queued as job {job.id}.")
+            return
+        # The queued job finds nothing left to purge
+        count = deletion.purge_user(user.id)
+        print(f"User '{username}' deleted successfully, "
+              f"with {count} rows purged.")
     except (IntegrityError, OperationalError, DatabaseError) as e:
         db.session.rollback()
         print(f"Database error: {e}")
+
+
+@jobs.task(name='search.rebuild_index', lane='low', max_attempts=1)
+def rebuild_search_index():
+    """
+    Rebuilds the full-text search index from scratch.
+
+    Posts and comments are streamed from the database, one shard at a
+    time, in batches, so the whole table is never loaded into memory at
+    once.
+
+    Returns
+    -------
+    int
+        The number of documents indexed.
+    """
+    posts = sharding.scan(lambda: Post.query.order_by(Post.id),
+                          search.REINDEX_BATCH_SIZE)
+    comments = sharding.scan(lambda: Comment.query.order_by(Comment.id),
+                             search.REINDEX_BATCH_SIZE)
+    return search.rebuild_index(posts, comments)
+
+
+@cli_controller.cli.command("reindex_search")
+@click.option("--background", is_flag=True,
+              help="Queue the rebuild for a worker instead of waiting for it.")
+def reindex_search(background):
+    """
+    Rebuilds the full-text search index from scratch.
+    """
+    if background:
+        job = jobs.enqueue(rebuild_search_index)
+        db.session.commit()
+        print(f"Search index rebuild queued as job {job.id}.")
+        return
+    count = rebuild_search_index()
+    db.session.commit()
+    print(f"Search index rebuilt with {count} documents.")
+
+
+@cli_controller.cli.command("recount_notifications")
+def recount_notifications():
+    """
+    Recounts every user's unread notifications into their counters.
+    """
+    count = notifications.recount()
+    db.session.commit()
+    print(f"Unread notifications recounted for {count} users.")
+
+
+@cli_controller.cli.command("run_worker")
+@click.option("--threads", default=4, show_default=True,
+              help="The number of jobs run at the same time.")
+@click.option("--lanes", default=','.join(jobs.LANES), show_default=True,
+              help="The priority lanes to run jobs from, highest first.")
+@click.option("--burst", is_flag=True,
+              help="Stop once no job is due, instead of waiting for more.")
+@click.option("--no-events", is_flag=True,
+              help="Don't deliver outbox events to their consumers.")
+def run_worker(threads, lanes, burst, no_events):
+    """
+    Runs queued background jobs, and delivers outbox events to their
+    consumers, until interrupted.
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    worker = jobs.Worker(
+        app, lanes=[lane.strip() for lane in lanes.split(',') if lane.strip()],
+        threads=threads, burst=burst)
+    dispatcher = None if no_events else events.Dispatcher(app, burst=burst)
+
+    def stop(*_args):
+        worker.stop()
+        if dispatcher is not None:
+            dispatcher.stop()
+
+    # Finish the running jobs and batches before stopping
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"Worker {worker.name} running jobs from {', '.join(worker.lanes)}.")
+    if dispatcher is not None:
+        dispatcher_thread = threading.Thread(
+            target=dispatcher.run, name='dispatcher', daemon=True)
+        dispatcher_thread.start()
+    worker.run()
+    if dispatcher is not None:
+        if not burst:
+            dispatcher.stop()
+        dispatcher_thread.join()
+    print("Worker stopped.")
+
+
+@cli_controller.cli.command("profile_startup")
+@click.option("--limit", default=15, show_default=True,
+              help="The number of modules and packages reported.")
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the report as JSON, for tracking over time.")
+def profile_startup(limit, as_json):
+    """
+    Reports where the time of a cold start of the application goes.
+
+    The application is started in a new interpreter with `python -X
+    importtime`, and the time taken to import it, to create it and to
+    set up its API endpoints is reported, with the modules and packages
+    which took the longest to import.
+    """
+    try:
+        report = startup.profile(current_app.root_path, limit)
+    except RuntimeError as e:
+        print(f"Startup failed: {e}")
+        return
+    if as_json:
+        print(json.dumps(report))
+        return
+
+    steps = report['steps']
+    print(f"Cold start in {report['total']:.3f}s, importing "
+          f"{report['modules']} modules:",
+          f"\n  import main:      {steps['import']:.3f}s",
+          f"\n  create_app:       {steps['create']:.3f}s",
+          f"\n  API endpoints:    {steps['http']:.3f}s")
+    for title, key in (("modules", 'slowest_modules'),
+                       ("packages", 'slowest_packages')):
+        print(f"\nSlowest {title} to import:")
+        for item in report[key]:
+            print(f"  {item['ms']:8.1f}ms  {item['name']}")
@@ -4,19 +4,25 @@ This module contains the API endpoints for comment-related operations.
 The endpoints are:
 
 - **GET /posts/{post_id}/comments**: Get all comments for a post.
-- **POST /posts/{post_id}/comments**: Create a new comment for a post.
+- **GET /posts/{post_id}/comments/threads**: Get the newest threads on a post, with their first replies.
+- **POST /posts/{post_id}/comments**: Create a new comment for a post, or a reply to a comment.
 - **GET /comments/{comment_id}**: Get a comment by ID.
+- **GET /comments/{comment_id}/replies**: Get the replies to a comment, at every depth.
 - **PUT /comments/{comment_id}**: Update a comment.
-- **DELETE /comments/{comment_id}**: Delete a comment.
+- **DELETE /comments/{comment_id}**: Delete a comment and its replies.
 """
 from datetime import datetime
 
 from flask import Blueprint, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import delete
 
 from init import db
-from models.comment import Comment, comment_schema, comments_schema
+from models.comment import Comment, MAX_DEPTH, comment_schema, comments_schema
 from models.post import Post
+from services import events, serializers, threads, versions
+from services.cache import single_flight
+from services.versions import conditional, post_etag
 
 comment_controller = Blueprint(
     'comment_controller', __name__, url_prefix='/<int:post_id>/comments')
@@ -24,6 +30,8 @@ comment_controller = Blueprint(
 
 @comment_controller.route('/', methods=['GET'])
 @jwt_required()
+@conditional(post_etag)
+@single_flight()
 def get_comments(post_id):
     """
     Gets a list of all comments on a post.
@@ -55,12 +63,61 @@ def get_comments(post_id):
         page=page, per_page=per_page, error_out=False)
 
     # Dump the comments to a list of dictionaries
-    comment_arr = comments_schema.dump(paginated_comments.items)
+    comment_arr = serializers.dump(comments_schema, paginated_comments.items)
 
     # Return the comments
     return {"message": "Comments retrieved successfully", "data": comment_arr}
 
 
+@comment_controller.route('/threads', methods=['GET'])
+@jwt_required()
+@conditional(post_etag)
+def get_threads(post_id):
+    """
+    Gets the newest threads on a post, each with its first replies.
+
+    The threads and their replies are read with a single query.
+
+    Parameters
+    ----------
+    post_id : int
+        The ID of the post to get threads for.
+
+    Query parameters:
+
+    - `limit`: The number of threads, 10 by default.
+    - `replies`: The number of replies with each thread, 3 by default.
+    - `before`: The `next` cursor of the previous page.
+
+    Returns
+    -------
+    dict
+        The threads, and the cursor of the next page. Each thread has
+        the `next` cursor of its remaining replies, if it has more.
+    """
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    replies = min(max(request.args.get('replies', 3, type=int), 0), 100)
+    before = request.args.get('before', type=int)
+
+    # Get the threads and their first replies
+    rows = threads.get_threads(post_id, limit, replies, before=before)
+
+    # Dump each thread's root, with its replies nested inside it
+    thread_arr = []
+    for root, thread_replies, more in rows:
+        thread = serializers.dump(comment_schema, root)
+        thread['replies'] = serializers.dump(comments_schema, thread_replies)
+        thread['next'] = (thread_replies[-1] if thread_replies else root).path \
+            if more else None
+        thread_arr.append(thread)
+
+    return {
+        "message": "Threads retrieved successfully",
+        "data": thread_arr,
+        "next": rows[-1][0].id if len(rows) == limit else None
+    }
+
+
 @comment_controller.route('/', methods=['POST'])
 @jwt_required()
 def create_comment(post_id):
@@ -75,6 +132,7 @@ def create_comment(post_id):
     Request body must contain the following JSON keys:
 
     - `content`: The content of the comment.
+    - OPTIONAL: `parent_id`: The ID of the comment to reply to.
 
     Returns a JSON representation of the newly created comment.
     """
@@ -83,15 +141,41 @@ def create_comment(post_id):
         # If the post does not exist, return a 404 error
         return {"message": "Post not found"}, 404
 
+    # Get the comment being replied to, if any, from the same post
+    parent = None
+    parent_id = request.json.get('parent_id')
+    if parent_id is not None:
+        parent = Comment.query.get(parent_id)
+        if not parent or parent.post_id != post_id:
+            return {"message": "Parent comment not found"}, 404
+        if not threads.can_reply(parent):
+            return {"message": f"Threads cannot be more than {MAX_DEPTH} comments deep"}, 400
+
     content = request.json['content']
-    # Create a new comment with the given content and the current user
+    # Create a new comment with the given content and the current user.
+    # Its path is completed with its own ID when it is inserted.
     new_comment = Comment(
         user_id=get_jwt_identity(),
         post_id=post_id,
+        parent_id=parent.id if parent else None,
+        path=parent.path if parent else '',
         content=content,
         created_at=datetime.now()
     )
     db.session.add(new_comment)
+
+    # Flush the comment so that it has an ID, and record its creation in
+    # the same transaction
+    db.session.flush()
+    events.record(events.COMMENT_CREATED, comment_id=new_comment.id,
+                  post_id=post_id, user_id=new_comment.user_id,
+                  parent_id=new_comment.parent_id,
+                  content=new_comment.content, author_id=post.author_id,
+                  parent_user_id=parent.user_id if parent else None)
+
+    # The post, its author and the commenter have changed
+    versions.bump_post(post_id)
+    versions.bump_users(post.author_id, new_comment.user_id)
     db.session.commit()
 
     # Return the newly created comment in JSON format
@@ -102,7 +186,7 @@ def create_comment(post_id):
 @jwt_required()
 def delete_comment(post_id, comment_id):
     """
-    Deletes a comment.
+    Deletes a comment, with the replies to it at every depth.
 
     Parameters
     ----------
@@ -134,7 +218,29 @@ def delete_comment(post_id, comment_id):
         # If the user is not authorized, return a 401 error
         return {"message": "Unauthorized"}, 401
 
-    # Delete the comment
+    # Get the replies to the comment, which are deleted with it
+    replies = db.session.execute(
+        db.select(Comment.id, Comment.user_id)
+        .where(threads.subtree(post_id, comment.path, include_root=False))
+    ).all()
+
+    # Record the deletion in the same transaction
+    events.record(events.COMMENT_DELETED, comment_id=comment.id,
+                  post_id=post_id, user_id=comment.user_id)
+    if replies:
+        events.record(events.COMMENTS_PURGED,
+                      comment_ids=[reply.id for reply in replies],
+                      post_ids=[post_id] * len(replies))
+
+    # The post, its author, the commenter and the repliers have changed
+    versions.bump_post(post_id)
+    versions.bump_users(post.author_id, comment.user_id,
+                        *{reply.user_id for reply in replies})
+
+    # Delete the replies with a single range delete, then the comment
+    if replies:
+        db.session.execute(delete(Comment.__table__).where(
+            threads.subtree(post_id, comment.path, include_root=False)))
     db.session.delete(comment)
     db.session.commit()
 
@@ -188,6 +294,15 @@ def update_comment(post_id, comment_id):
 
     # Update the comment
     comment.content = data['content']
+
+    # Record the change in the same transaction
+    events.record(events.COMMENT_UPDATED, comment_id=comment.id,
+                  post_id=post_id, user_id=comment.user_id,
+                  content=comment.content)
+
+    # The post, its author and the commenter have changed
+    versions.bump_post(post_id)
+    versions.bump_users(post.author_id, comment.user_id)
     db.session.commit()
 
     # Return the updated comment in JSON format
@@ -227,3 +342,53 @@ def get_comment(post_id, comment_id):
 
     # Return the comment in JSON format
     return comment_schema.dump(comment)
+
+
+@comment_controller.route('/<comment_id>/replies', methods=['GET'])
+@jwt_required()
+@conditional(post_etag)
+def get_replies(post_id, comment_id):
+    """
+    Gets the replies to a comment, at every depth, in thread order.
+
+    Each reply comes after the comment it replies to, so that the client
+    can nest them using their `parent_id` and `depth`.
+
+    Parameters
+    ----------
+    post_id : int
+        The ID of the post the comment belongs to.
+
+    comment_id : int
+        The ID of the comment to get the replies to.
+
+    Query parameters:
+
+    - `limit`: The number of replies, 20 by default.
+    - `after`: The `next` cursor of the previous page.
+
+    Returns
+    -------
+    dict
+        The replies, and the cursor of the next page.
+    """
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    after = request.args.get('after')
+
+    # Get the comment to ensure it exists
+    comment = Comment.query.get(comment_id)
+    if not comment or comment.post_id != post_id:
+        # If the comment does not exist, return a 404 error
+        return {"message": "Comment not found"}, 404
+
+    if after is not None and not threads.is_cursor(after, comment.path):
+        return {"message": "Invalid cursor"}, 400
+
+    # Get the page of replies with a single range scan
+    replies = threads.get_replies(comment, limit, after=after)
+
+    return {
+        "message": "Replies retrieved successfully",
+        "data": serializers.dump(comments_schema, replies),
+        "next": replies[-1].path if len(replies) == limit else None
+    }
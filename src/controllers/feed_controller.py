@@ -10,18 +10,36 @@ The endpoints are:
 
 - **GET /feed**: Get a list of all posts in the database in chronological order.
 - **GET /feed/following**: Get a list of all posts from users the current user is following.
+- **GET /feed/trending**: Get the posts with the most recent likes and comments.
+- **GET /feed/stream**: Stream the IDs of new posts from followed users as server-sent events.
+
+Every endpoint accepts a `comments` query parameter, which replaces the
+likes and comments of each post with a preview of its latest comments.
+
+The following feed also accepts `rank=relevance`, which orders its
+recent posts by recency, engagement and the user's affinity with their
+authors instead of by date.
 
 """
-from flask import Blueprint, request
+from flask import (Blueprint, Response, current_app, g, jsonify, request,
+                   stream_with_context)
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from models.post import Post, posts_schema
+from init import db
+from models.follow import Follow
+from models.post import Post, post_previews_schema, posts_schema
+from services import (previews, ranking, serializers, sharding, streams,
+                      trending, views)
+from services.cache import cached_response
+from services.versions import conditional, following_feed_etag
 
 feed_controller = Blueprint('feed_controller', __name__, url_prefix='/feed')
 
 
 @feed_controller.route('/', methods=['GET'])
 @jwt_required()
+@views.track_views()
+@cached_response()
 def get_feed():
     """
     Retrieves a list of all posts in the database.
@@ -31,6 +49,8 @@ def get_feed():
 
     - `page`: The page to retrieve. Defaults to 1.
     - `per_page`: The number of posts to retrieve per page. Defaults to 10.
+    - `comments`: The number of latest comments to preview on each post.
+      Defaults to every like and comment.
 
     Returns
     -------
@@ -44,15 +64,23 @@ def get_feed():
     # parameters, default to 10
     per_page = request.args.get('per_page', 10, type=int)
 
-    # Retrieve all posts from the database
-    posts = Post.query.order_by(Post.created_at.desc())
+    # Get the number of comments to preview on each post, if any
+    preview_size = previews.preview_size()
+
+    # Retrieve the page of posts, newest first, gathered from every shard
+    posts = sharding.gather_page(
+        lambda: Post.query, [Post.created_at, Post.id], page, per_page,
+        options=None if preview_size is None else previews.post_options())
 
-    # Paginate the posts
-    paginated_posts = posts.paginate(
-        page=page, per_page=per_page, error_out=False)
+    # Count an impression of each post on the page
+    g.post_ids = [post.id for post in posts]
 
-    # Serialize the paginated posts
-    post_arr = posts_schema.jsonify(paginated_posts.items)
+    # Serialize the paginated posts, with their previews if asked for
+    if preview_size is not None:
+        previews.attach_previews(posts, preview_size)
+        post_arr = jsonify(serializers.dump(post_previews_schema, posts))
+    else:
+        post_arr = jsonify(serializers.dump(posts_schema, posts))
 
     # Return the serialized posts
     return post_arr
@@ -60,10 +88,19 @@ def get_feed():
 
 @feed_controller.route('/following', methods=['GET'])
 @jwt_required()
+@views.track_views()
+@conditional(following_feed_etag)
+@cached_response(per_user=True)
 def get_following_feed():
     """
     Gets a list of all posts from users the current user is following.
 
+    Accepts the same query parameters as `get_feed`, and:
+
+    - `rank`: `recent` to order the posts newest first, or `relevance`
+      to rank the newest `RANKING_CANDIDATES` posts by their relevance
+      to the user. Defaults to `recent`.
+
     Returns
     -------
     list of Post
@@ -81,6 +118,11 @@ def get_following_feed():
     # parameters, default to 10
     per_page = request.args.get('per_page', 10, type=int)
 
+    # Get the order of the posts, default to newest first
+    rank = request.args.get('rank', 'recent')
+    if rank not in ('recent', 'relevance'):
+        return {"message": "rank must be 'recent' or 'relevance'"}, 400
+
     # Create a list of all the user IDs the current user is following
     followed_ids = [follow.followed_id for follow in follows]
 
@@ -88,16 +130,138 @@ def get_following_feed():
     if not followed_ids:
         return {"message": "No posts found from followed users"}, 200
 
-    # Retrieve all posts from users in the followed list
-    posts = Post.query.filter(Post.user_id.in_(
-        followed_ids)).order_by(Post.created_at.desc())
+    # Get the number of comments to preview on each post, if any
+    preview_size = previews.preview_size()
+
+    if rank == 'relevance':
+        # Rank the recent posts from followed users, or slice the page
+        # from the user's cached ranking, then retrieve them from their
+        # shards in that order
+        post_ids = ranking.get_ranked_page(user_id, followed_ids, page,
+                                           per_page)
+        posts_by_id = {post.id: post
+                       for post in sharding.get_many(Post, post_ids)}
+        posts = [posts_by_id[post_id] for post_id in post_ids
+                 if post_id in posts_by_id]
+    else:
+        # Retrieve the page of posts from users in the followed list,
+        # gathered from the shards holding their posts
+        posts = sharding.gather_page(
+            lambda: Post.query.filter(Post.author_id.in_(followed_ids)),
+            [Post.created_at, Post.id], page, per_page,
+            shards=sharding.shards_for_authors(followed_ids),
+            options=None if preview_size is None else previews.post_options())
+
+    # Count an impression of each post on the page
+    g.post_ids = [post.id for post in posts]
+
+    # Serialize the paginated posts, with their previews if asked for
+    if preview_size is not None:
+        previews.attach_previews(posts, preview_size)
+        post_arr = jsonify(serializers.dump(post_previews_schema, posts))
+    else:
+        post_arr = jsonify(serializers.dump(posts_schema, posts))
+
+    # Return the serialized posts
+    return post_arr
+
+
+@feed_controller.route('/trending', methods=['GET'])
+@jwt_required()
+@views.track_views()
+@cached_response()
+def get_trending_feed():
+    """
+    Gets the posts with the most likes and comments over the last few
+    hours, recent engagement counting more than older engagement.
+
+    Query parameters:
+
+    - `hours`: The number of hours of engagement counted. Defaults to,
+      and is at most, `TRENDING_HOURS`.
+    - `limit`: The number of posts to retrieve. Defaults to 10.
+    - `comments`: The number of latest comments to preview on each post.
+      Defaults to every like and comment.
+
+    Returns
+    -------
+    list of Post
+        The trending posts, best first.
+    """
+    ring = current_app.config['TRENDING_HOURS']
+    hours = min(max(request.args.get('hours', ring, type=int), 1), ring)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+
+    # Get the number of comments to preview on each post, if any
+    preview_size = previews.preview_size()
+
+    # Rank the posts by their recent engagement, then retrieve them from
+    # their shards in that order
+    post_ids = trending.get_trending(limit, hours)
+    posts_by_id = {post.id: post for post in sharding.get_many(Post, post_ids)}
+    posts = [posts_by_id[post_id] for post_id in post_ids
+             if post_id in posts_by_id]
 
-    # Paginate the posts
-    paginated_posts = posts.paginate(
-        page=page, per_page=per_page, error_out=False)
+    # Count an impression of each post on the page
+    g.post_ids = [post.id for post in posts]
 
-    # Serialize the paginated posts
-    post_arr = posts_schema.jsonify(paginated_posts.items)
+    # Serialize the posts, with their previews if asked for
+    if preview_size is not None:
+        previews.attach_previews(posts, preview_size)
+        post_arr = jsonify(serializers.dump(post_previews_schema, posts))
+    else:
+        post_arr = jsonify(serializers.dump(posts_schema, posts))
 
     # Return the serialized posts
     return post_arr
+
+
+@feed_controller.route('/stream', methods=['GET'])
+@jwt_required()
+def stream_feed():
+    """
+    Streams the new posts from users the current user is following, as
+    server-sent events.
+
+    Each `post` event has the ID of the post and of its author, and the
+    ID of the event. A client reconnecting with the ID of the last event
+    it received, in the `Last-Event-ID` header or the `last_event_id`
+    query parameter, is first sent the events it missed. If it missed
+    too many, it is sent a `reset` event instead, and should reload its
+    feed.
+
+    Returns
+    -------
+    Response
+        The stream of events.
+    """
+    user_id = get_jwt_identity()
+
+    # Get the ID of the last event the client received, if it is
+    # reconnecting
+    last_event_id = request.headers.get(
+        'Last-Event-ID', request.args.get('last_event_id'))
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            return {"message": "Invalid last event ID"}, 400
+
+    # Get the IDs of the users the current user is following
+    followed_ids = {follow.followed_id for follow in
+                    Follow.query.filter_by(follower_id=user_id)}
+
+    # Subscribe to the posts created after the latest event, and find
+    # the ones the client missed before it
+    until = streams.head()
+    missed = [] if last_event_id is None \
+        else streams.replay(followed_ids, last_event_id, until)
+    subscription = streams.subscribe(followed_ids, until)
+
+    # Don't hold a database connection for as long as the stream is open
+    db.session.close()
+
+    return Response(
+        stream_with_context(streams.stream(subscription, missed, until)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -6,18 +6,28 @@ The endpoints are:
 - **GET /users/<user_id>/follows**: Get all users that the user is following.
 - **POST /users/<user_id>/follow**: Follow a user.
 - **DELETE /users/<user_id>/follow**: Unfollow a user.
+- **POST /users/follow/bulk**: Follow many users at once.
+- **DELETE /users/follow/bulk**: Unfollow many users at once.
 """
-from flask import Blueprint
+from flask import Blueprint, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import delete, insert
 
 from init import db
 from models.follow import Follow, follow_schema, follows_schema
 from models.user import User, users_schema
+from services import events, versions
 
 
 follow_controller = Blueprint(
     'follow_controller', __name__, url_prefix='/<int:user_id>')
 
+bulk_follow_controller = Blueprint(
+    'bulk_follow_controller', __name__, url_prefix='/follow')
+
+# The largest number of users followed or unfollowed in one request
+MAX_BULK_FOLLOWS = 500
+
 
 @follow_controller.route('/following', methods=['GET'], endpoint='get_following')
 @jwt_required()
@@ -101,8 +111,17 @@ def create_follow(user_id):
     # Create a new follow
     new_follow = Follow(follower_id=current_user_id, followed_id=user_id)
 
-    # Add the follow to the database and commit the changes
+    # Add the follow to the database
     db.session.add(new_follow)
+
+    # Record the follow in the same transaction
+    events.record(events.USER_FOLLOWED, follower_id=current_user_id,
+                  followed_id=user_id)
+
+    # Both users' profiles and the follower's feed have changed
+    versions.bump_users(current_user_id, user_id)
+
+    # Commit the changes
     db.session.commit()
 
     # Return the follow as JSON
@@ -110,7 +129,7 @@ def create_follow(user_id):
 
 
 @follow_controller.route('/follow', methods=['DELETE'], endpoint='unfollow')
-@jwt_required
+@jwt_required()
 def unfollow(user_id):
     """
     Unfollow a user.
@@ -138,6 +157,13 @@ def unfollow(user_id):
 
     # Delete the follow
     db.session.delete(new_follow)
+
+    # Record the unfollow in the same transaction
+    events.record(events.USER_UNFOLLOWED, follower_id=current_user_id,
+                  followed_id=user_id)
+
+    # Both users' profiles and the follower's feed have changed
+    versions.bump_users(current_user_id, user_id)
     db.session.commit()
 
     # Return the deleted follow as JSON
@@ -217,3 +243,141 @@ def get_suggested_friends(user_id):
 
     # Return the serialized suggested friends
     return suggested_friends_arr
+
+
+def _bulk_user_ids():
+    """
+    Returns the distinct user IDs of a bulk follow or unfollow request,
+    in the order given, or `None` if they are invalid.
+    """
+    user_ids = (request.get_json(silent=True) or {}).get('user_ids')
+    if not isinstance(user_ids, list) \
+            or not 0 < len(user_ids) <= MAX_BULK_FOLLOWS \
+            or not all(type(user_id) is int for user_id in user_ids):
+        return None
+    return list(dict.fromkeys(user_ids))
+
+
+@bulk_follow_controller.route('/bulk', methods=['POST'])
+@jwt_required()
+def bulk_follow():
+    """
+    Follow many users at once, such as the suggestions of an onboarding
+    flow.
+
+    The users are looked up with one query, and the new follows are
+    inserted with one statement, in a single transaction. Users already
+    followed, and the current user, are skipped.
+
+    Request body must contain the following JSON keys:
+
+    - `user_ids`: The IDs of the users to follow, at most
+      `MAX_BULK_FOLLOWS` of them.
+
+    Returns
+    -------
+    dict
+        The IDs of the users followed, of those skipped, and of those
+        not found.
+    """
+    user_ids = _bulk_user_ids()
+    if user_ids is None:
+        return {"message": f"user_ids must be a list of 1 to {MAX_BULK_FOLLOWS} user IDs"}, 400
+
+    # Get the current user's ID
+    current_user_id = get_jwt_identity()
+
+    # Find which of the users exist, and which are already followed
+    found = set(db.session.execute(
+        db.select(User.id).where(User.id.in_(user_ids))).scalars())
+    followed = set(db.session.execute(
+        db.select(Follow.followed_id)
+        .where(Follow.follower_id == current_user_id,
+               Follow.followed_id.in_(user_ids))).scalars())
+    new_ids = [user_id for user_id in user_ids if user_id in found
+               and user_id not in followed and user_id != current_user_id]
+    skipped = found.difference(new_ids)
+
+    if new_ids:
+        # Insert every new follow with a single statement
+        db.session.execute(insert(Follow.__table__).values([
+            {'follower_id': current_user_id, 'followed_id': user_id}
+            for user_id in new_ids]))
+
+        # Record the follows in the same transaction
+        events.record_many(events.USER_FOLLOWED, [
+            {'follower_id': current_user_id, 'followed_id': user_id}
+            for user_id in new_ids])
+
+        # Every user's profile and the follower's feed have changed
+        versions.bump_users(current_user_id, *new_ids)
+
+        # Commit the changes
+        db.session.commit()
+
+    return {
+        "message": f"Followed {len(new_ids)} users",
+        "followed": new_ids,
+        "skipped": [user_id for user_id in user_ids if user_id in skipped],
+        "not_found": [user_id for user_id in user_ids if user_id not in found]
+    }
+
+
+@bulk_follow_controller.route('/bulk', methods=['DELETE'],
+                              endpoint='bulk_unfollow')
+@jwt_required()
+def bulk_unfollow():
+    """
+    Unfollow many users at once.
+
+    The follows are found with one query and deleted with one statement,
+    in a single transaction.
+
+    Request body must contain the following JSON keys:
+
+    - `user_ids`: The IDs of the users to unfollow, at most
+      `MAX_BULK_FOLLOWS` of them.
+
+    Returns
+    -------
+    dict
+        The IDs of the users unfollowed, and of those not followed.
+    """
+    user_ids = _bulk_user_ids()
+    if user_ids is None:
+        return {"message": f"user_ids must be a list of 1 to {MAX_BULK_FOLLOWS} user IDs"}, 400
+
+    # Get the current user's ID
+    current_user_id = get_jwt_identity()
+
+    # Find which of the users are followed
+    followed = set(db.session.execute(
+        db.select(Follow.followed_id)
+        .where(Follow.follower_id == current_user_id,
+               Follow.followed_id.in_(user_ids))).scalars())
+    removed_ids = [user_id for user_id in user_ids if user_id in followed]
+
+    if removed_ids:
+        # Delete every follow with a single statement
+        table = Follow.__table__
+        db.session.execute(delete(table).where(
+            table.c.follower_id == current_user_id,
+            table.c.followed_id.in_(removed_ids)))
+
+        # Record the unfollows in the same transaction
+        events.record_many(events.USER_UNFOLLOWED, [
+            {'follower_id': current_user_id, 'followed_id': user_id}
+            for user_id in removed_ids])
+
+        # Every user's profile and the follower's feed have changed
+        versions.bump_users(current_user_id, *removed_ids)
+
+        # Commit the changes
+        db.session.commit()
+
+    return {
+        "message": f"Unfollowed {len(removed_ids)} users",
+        "unfollowed": removed_ids,
+        "not_following": [user_id for user_id in user_ids
+                          if user_id not in followed]
+    }
@@ -13,6 +13,9 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from init import db
 from models.post import Post, post_schema
 from models.like import Like, likes_schema
+from services import events, hotkeys, serializers, versions
+from services.cache import single_flight
+from services.versions import conditional, post_etag
 
 
 like_controller = Blueprint(
@@ -36,6 +39,9 @@ def like_post(post_id):
         The post that was liked.
     """
 
+    # Count the like towards the post being hot
+    hotkeys.record('post', post_id)
+
     # Get the post with the specified ID
     post = Post.query.get(post_id)
     if not post:
@@ -55,6 +61,14 @@ def like_post(post_id):
     # Create a new Like object and add it to the post's likes
     like = Like(user_id=user_id, post_id=post_id)
     db.session.add(like)
+
+    # Record the like in the same transaction
+    events.record(events.POST_LIKED, post_id=post_id,
+                  author_id=post.author_id, user_id=user_id)
+
+    # The post, its author and the liking user have changed
+    versions.bump_post(post_id)
+    versions.bump_users(post.author_id, user_id)
     db.session.commit()
 
     # Return the post in JSON format
@@ -79,6 +93,9 @@ def unlike_post(post_id):
     Post
         The post that was unliked.
     """
+    # Count the unlike towards the post being hot
+    hotkeys.record('post', post_id)
+
     # Get the post with the specified ID
     post = Post.query.get(post_id)
     if not post:
@@ -98,6 +115,14 @@ def unlike_post(post_id):
 
     # Delete the Like object
     db.session.delete(like)
+
+    # Record the unlike in the same transaction
+    events.record(events.POST_UNLIKED, post_id=post_id,
+                  author_id=post.author_id, user_id=user_id)
+
+    # The post, its author and the unliking user have changed
+    versions.bump_post(post_id)
+    versions.bump_users(post.author_id, user_id)
     db.session.commit()
 
     # Return the post in JSON format
@@ -106,6 +131,9 @@ def unlike_post(post_id):
 
 @like_controller.route('/likes', methods=['GET'])
 @jwt_required()
+@conditional(post_etag)
+@hotkeys.hot_cached('post', 'post_id')
+@single_flight()
 def get_likes(post_id):
     """
     Gets a list of users who have liked a post.
@@ -127,7 +155,7 @@ def get_likes(post_id):
         return {"message": "Post not found"}, 404
 
     # Get all the likes for the post
-    likes = likes_schema.dump(post.likes)
+    likes = serializers.dump(likes_schema, post.likes)
 
     # Return the likes in JSON format
     return {"message": "Likes retrieved successfully", "data": likes}
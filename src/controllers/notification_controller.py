@@ -0,0 +1,113 @@
+"""
+This module contains the API endpoints for the current user's
+notifications.
+
+Likes, comments, replies and follows are aggregated into one
+notification per post, comment or user they were on, such as "admin
+and 412 others liked your post", by the `notifications` outbox consumer.
+
+The endpoints are:
+
+- **GET /notifications**: Get a page of notifications, newest first.
+- **GET /notifications/unread**: Get the number of unread notifications.
+- **POST /notifications/read**: Mark some, or all, notifications as read.
+"""
+from flask import Blueprint, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from init import db
+from models.notification import notifications_schema
+from services import notifications, serializers
+
+notification_controller = Blueprint(
+    'notification_controller', __name__, url_prefix='/notifications')
+
+
+@notification_controller.route('/', methods=['GET'])
+@jwt_required()
+def get_notifications():
+    """
+    Gets a page of the current user's notifications, the one with the
+    latest action first.
+
+    Query parameters:
+
+    - `limit`: The number of notifications, 20 by default.
+    - `after`: The `next` cursor of the previous page.
+
+    Returns
+    -------
+    dict
+        The notifications, the number of unread notifications, and the
+        cursor of the next page.
+    """
+    user_id = get_jwt_identity()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    after = request.args.get('after')
+    if after is not None:
+        try:
+            after = notifications.parse_cursor(after)
+        except ValueError:
+            return {"message": "Invalid cursor"}, 400
+
+    # Get the page with a single range scan of the user's notifications
+    page = notifications.get_page(user_id, limit, after=after)
+
+    return {
+        "message": "Notifications retrieved successfully",
+        "data": serializers.dump(notifications_schema, page),
+        "unread": notifications.unread_count(user_id),
+        "next": notifications.cursor(page[-1]) if len(page) == limit
+        else None
+    }
+
+
+@notification_controller.route('/unread', methods=['GET'])
+@jwt_required()
+def get_unread_count():
+    """
+    Gets the number of the current user's unread notifications.
+
+    Returns
+    -------
+    dict
+        The number of unread notifications.
+    """
+    return {
+        "message": "Unread notifications counted successfully",
+        "unread": notifications.unread_count(get_jwt_identity())
+    }
+
+
+@notification_controller.route('/read', methods=['POST'])
+@jwt_required()
+def mark_notifications_read():
+    """
+    Marks some, or all, of the current user's notifications as read.
+
+    The request body may contain the following JSON keys:
+
+    - OPTIONAL: `ids`: The IDs of the notifications to mark as read.
+      Defaults to every notification.
+
+    Returns
+    -------
+    dict
+        The number of notifications marked as read, and the number
+        left unread.
+    """
+    user_id = get_jwt_identity()
+    body = request.get_json(silent=True) or {}
+    ids = body.get('ids')
+    if ids is not None and (not isinstance(ids, list) or not all(
+            isinstance(notification_id, int) for notification_id in ids)):
+        return {"message": "ids must be a list of notification IDs"}, 400
+
+    count = notifications.mark_read(user_id, ids)
+    db.session.commit()
+
+    return {
+        "message": "Notifications marked as read",
+        "read": count,
+        "unread": notifications.unread_count(user_id)
+    }
@@ -19,6 +19,10 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from init import db
 from utils import admin_required
 from models.post import Post, post_schema, posts_schema
+from services import (deletion, events, hotkeys, serializers, sharding,
+                      versions, views)
+from services.cache import single_flight
+from services.versions import conditional, post_etag
 from .comment_controller import comment_controller
 from .like_controller import like_controller
 
@@ -28,6 +32,9 @@ post_controller = Blueprint('post_controller', __name__, url_prefix='/posts')
 post_controller.register_blueprint(comment_controller)
 post_controller.register_blueprint(like_controller)
 
+# Read and write each post, with its likes and comments, on its shard
+post_controller.before_request(sharding.select_post_shard)
+
 
 @post_controller.route('/', methods=['GET'])
 @jwt_required()
@@ -41,14 +48,18 @@ def get_all_posts():
     list of Post
         A list of all posts in the database.
     """
-    posts = Post.query.all()
-    post_arr = posts_schema.dump(posts)
+    posts = sharding.gather_all(lambda: Post.query)
+    post_arr = serializers.dump(posts_schema, posts)
     return {"message": "Posts retrieved successfully", "data": post_arr}
 
 
 @post_controller.route('/<int:post_id>', methods=['GET'])
 @jwt_required()
 @admin_required
+@views.track_views('post_id')
+@conditional(post_etag)
+@hotkeys.hot_cached('post', 'post_id')
+@single_flight()
 def get_post(post_id):
     """
     Gets a post by ID.
@@ -66,7 +77,7 @@ def get_post(post_id):
     post = Post.query.get(post_id)
     if not post:
         return {"message": "Post not found"}, 404
-    post_arr = post_schema.dump(post)
+    post_arr = serializers.dump(post_schema, post)
     return {"message": "Post retrieved successfully", "data": post_arr}
 
 
@@ -86,9 +97,22 @@ def create_post():
     title = request.json['title']
     content = request.json['content']
 
+    # The post is stored on its author's shard
+    sharding.select_author_shard(get_jwt_identity())
+
     new_post = Post(title=title, content=content,
                     created_at=datetime.now(), author_id=get_jwt_identity())
     db.session.add(new_post)
+
+    # Flush the post so that it has an ID, and record its creation in
+    # the same transaction
+    db.session.flush()
+    events.record(events.POST_CREATED, post_id=new_post.id,
+                  author_id=new_post.author_id, title=new_post.title,
+                  content=new_post.content)
+
+    # The author's profile and timeline have changed
+    versions.bump_users(new_post.author_id)
     db.session.commit()
 
     return post_schema.dump(new_post)
@@ -123,6 +147,14 @@ def update_post(post_id):
     post.content = data['content'] or post.content
     post.updated_at = datetime.now()
 
+    # Record the change in the same transaction
+    events.record(events.POST_UPDATED, post_id=post.id,
+                  author_id=post.author_id, title=post.title,
+                  content=post.content)
+
+    # The post and its author's profile and timeline have changed
+    versions.bump_post(post.id)
+    versions.bump_users(post.author_id)
     db.session.commit()
 
     return post_schema.dump(post)
@@ -151,7 +183,9 @@ def delete_post(post_id):
     if post.author_id != get_jwt_identity():
         return {"message": "Unauthorized"}, 401
 
-    db.session.delete(post)
+    # Hide the post straight away, and leave the deletion of its likes
+    # and comments to a background job
+    deletion.delete_post(post)
     db.session.commit()
 
     return {"message": "Post deleted successfully"}
@@ -0,0 +1,58 @@
+"""
+This module contains the API endpoints for search-related operations.
+
+The endpoints are:
+
+- **GET /search/posts?q=<query>**: Search posts by title, content and comments.
+
+"""
+from flask import Blueprint, request
+from flask_jwt_extended import jwt_required
+
+from models.post import Post, posts_schema
+from services import search, serializers, sharding
+
+search_controller = Blueprint(
+    'search_controller', __name__, url_prefix='/search')
+
+
+@search_controller.route('/posts', methods=['GET'])
+@jwt_required()
+def search_posts():
+    """
+    Searches posts by their title, content and comments.
+
+    The results are ranked by relevance and can be navigated using the
+    following query parameters:
+
+    - `q`: The search query. Required.
+    - `page`: The page to retrieve. Defaults to 1.
+    - `per_page`: The number of posts to retrieve per page. Defaults to 10.
+
+    Returns
+    -------
+    list of Post
+        The matching posts, best match first.
+    """
+    # Get the search query from the request query parameters
+    query = request.args.get('q', '').strip()
+    if not query:
+        return {"message": "Missing search query"}, 400
+
+    # Get the page number and page size from the request query parameters
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 10, type=int), 1), 100)
+
+    # Get the IDs of the matching posts from the search index
+    post_ids = search.search_posts(
+        query, limit=per_page, offset=(page - 1) * per_page)
+
+    # Load the posts from their shards and put them back in relevance order
+    posts = sharding.get_many(Post, post_ids)
+    posts_by_id = {post.id: post for post in posts}
+    ranked = [posts_by_id[post_id]
+              for post_id in post_ids if post_id in posts_by_id]
+
+    # Return the serialized posts
+    return {"message": "Posts retrieved successfully",
+            "data": serializers.dump(posts_schema, ranked)}
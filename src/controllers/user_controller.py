@@ -11,17 +11,22 @@ The endpoints are:
 
 """
 
-from flask import Blueprint, request
+from flask import Blueprint, g, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from init import db
 
 from models.user import User, user_schema, users_schema, profile_schema
-from models.post import Post, posts_schema
-from .follow_controller import follow_controller
+from models.post import Post, post_previews_schema, posts_schema
+from services import (hotkeys, previews, serializers, sharding, versions,
+                      views)
+from services.cache import cached_response, single_flight
+from services.versions import conditional, user_etag
+from .follow_controller import bulk_follow_controller, follow_controller
 user_controller = Blueprint('user_controller', __name__, url_prefix='/users')
 
 user_controller.register_blueprint(follow_controller)
+user_controller.register_blueprint(bulk_follow_controller)
 
 
 @user_controller.route('/', methods=['GET'])
@@ -51,6 +56,10 @@ def get_users():
 
 @user_controller.route('/<user_id>/profile', methods=['GET'])
 @jwt_required()
+@conditional(user_etag)
+@hotkeys.hot_cached('user', 'user_id')
+@cached_response()
+@single_flight()
 def get_user(user_id):
     """
     Gets a specific user in the database.
@@ -69,7 +78,10 @@ def get_user(user_id):
     if not user:
         return 'User not found', 404
 
-    return profile_schema.jsonify(user)
+    # Load the user's posts, likes and comments from every shard
+    sharding.load_collections(user, 'posts', 'likes', 'comments')
+
+    return jsonify(serializers.dump(profile_schema, user))
 
 
 @user_controller.route('/<user_id>/profile', methods=['PUT', 'PATCH'])
@@ -103,8 +115,11 @@ def update_user(user_id):
     user.email = data['email'] or user.email
     user.bio = data['bio'] or user.bio
 
+    # The user's profile has changed
+    versions.bump_users(user.id)
     db.session.commit()
 
+    sharding.load_collections(user, 'posts', 'likes', 'comments')
     profile = profile_schema.dump(user)
     message = f"User {user.username} updated successfully."
     return {"message": message, "user": profile}
@@ -112,6 +127,9 @@ def update_user(user_id):
 
 @user_controller.route('/<user_id>/timeline', methods=['GET'])
 @jwt_required()
+@views.track_views()
+@conditional(user_etag)
+@cached_response()
 def get_user_timeline(user_id):
     """
     Gets a user's timeline.
@@ -121,6 +139,11 @@ def get_user_timeline(user_id):
     user_id : int
         The ID of the user whose timeline to get.
 
+    Query parameters:
+
+    - `comments`: The number of latest comments to preview on each post.
+      Defaults to every like and comment.
+
     Returns
     -------
     list of Post
@@ -130,7 +153,20 @@ def get_user_timeline(user_id):
     if not user:
         return 'User not found', 404
 
+    # The user's posts are all on their shard
+    sharding.select_author_shard(user_id)
+
     posts = Post.query.filter_by(author_id=user_id).order_by(
         Post.created_at.desc()).all()
-    post_arr = posts_schema.dump(posts)
+
+    # Count an impression of each post on the timeline
+    g.post_ids = [post.id for post in posts]
+
+    # Replace the posts' likes and comments with previews, if asked for
+    preview_size = previews.preview_size()
+    if preview_size is not None:
+        previews.attach_previews(posts, preview_size)
+        return serializers.dump(post_previews_schema, posts)
+
+    post_arr = serializers.dump(posts_schema, posts)
     return post_arr
@@ -0,0 +1,47 @@
+"""Gunicorn configuration for `wsgi.py`.
+
+The application is imported once by the master process, and its workers
+are forked from it. Each worker replaces the database connection pools
+it inherits, and optionally opens its connections, before accepting
+traffic.
+"""
+
+import multiprocessing
+import os
+
+
+# The WSGI application
+wsgi_app = 'wsgi:app'
+
+# Import the application once, before forking the workers
+preload_app = True
+
+# Load the address to listen on from the environment
+bind = os.environ.get('BIND', '0.0.0.0:5555')
+
+# Load the number of worker processes from the environment
+workers = int(os.environ.get(
+    'WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Load the number of threads of each worker from the environment. Each
+# open event stream holds a thread, so serving them needs more than one
+threads = int(os.environ.get('WEB_THREADS', 1))
+
+
+def post_fork(_server, _worker):
+    """Give a new worker its own database connections."""
+    from wsgi import app
+    from services import startup
+
+    startup.after_fork(app)
+
+
+def post_worker_init(worker):
+    """Open a worker's database connections before it accepts traffic."""
+    from wsgi import app
+    from services import startup
+
+    connections = app.config['WARM_UP_CONNECTIONS']
+    if connections:
+        opened = startup.warm_up(app, connections)
+        worker.log.info("Worker warmed up with %d connections", opened)
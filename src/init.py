@@ -4,20 +4,48 @@ application.
 
 The extensions used in the application are:
 
-- `flask_sqlalchemy.SQLAlchemy` for interacting with the database.
+- `flask_sqlalchemy.SQLAlchemy` for interacting with the database, with
+  reads routed to a replica by `services.replicas.RoutingSession`.
 - `flask_marshmallow.Marshmallow` for serializing and deserializing data.
 - `flask_bcrypt.Bcrypt` for hashing passwords.
 - `flask_jwt_extended.JWTManager` for managing JWT tokens.
 
+The database and Marshmallow extensions are used by every process, by
+the models. `bcrypt` and `jwt` are proxies to extensions which are only
+created, and their packages imported, when they are first used, as only
+a process serving requests, or a command creating users, needs them.
 """
 
+from functools import cache
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
-from flask_bcrypt import Bcrypt
-from flask_jwt_extended import JWTManager
+from werkzeug.local import LocalProxy
+
+from services.replicas import RoutingSession
+
+
+@cache
+def _bcrypt():
+    """
+    Returns the Flask-Bcrypt extension, created when it is first used.
+    """
+    from flask_bcrypt import Bcrypt  # pylint: disable=import-outside-toplevel
+    return Bcrypt()
+
+
+@cache
+def _jwt():
+    """
+    Returns the Flask-JWT-Extended extension, created when it is first
+    used.
+    """
+    # pylint: disable=import-outside-toplevel
+    from flask_jwt_extended import JWTManager
+    return JWTManager()
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 ma = Marshmallow()
-bcrypt = Bcrypt()
-jwt = JWTManager()
+bcrypt = LocalProxy(_bcrypt)
+jwt = LocalProxy(_jwt)
@@ -1,6 +1,14 @@
 """Main application initialization and configuration.
 
 Contains the code that creates and configures the Flask application.
+
+The application is only created when `app` is first used, so that
+importing this module stays cheap. Only what every process needs, the
+database, the models and the CLI commands, is set up when it is
+created. The HTTP surface, the response formats and compression, the
+authentication extensions and the API endpoints, is set up just before
+the first request, so that `flask` CLI commands and background workers
+never import it.
 """
 
 import os
@@ -9,7 +17,7 @@ from flask import Flask
 from marshmallow import ValidationError
 
 from init import db, ma, bcrypt, jwt
-from controllers import cli, auth, user, post, feed
+from controllers.cli_controller import cli_controller
 
 
 
@@ -25,44 +33,240 @@ def create_app():
     Flask
         The configured Flask application.
     """
+    # Import the services set up with every application
+    from services import (deletion, ranking, replicas, sharding, startup,
+                          streams, threads, trending)
+
     # Create the Flask application
     app = Flask(__name__)
 
-    # Disable sorting of JSON keys
-    app.json.sort_keys = False
-
     # Load the database URI from the environment
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 
+    # Load the read replica database URI and settings from the environment
+    if os.environ.get('REPLICA_DATABASE_URL'):
+        app.config['SQLALCHEMY_BINDS'] = {
+            replicas.REPLICA_BIND_KEY: os.environ.get('REPLICA_DATABASE_URL')}
+    app.config['REPLICA_MAX_LAG'] = float(
+        os.environ.get('REPLICA_MAX_LAG', 5))
+    app.config['REPLICA_STICKY_SECONDS'] = float(
+        os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+    # Load the database URIs of the post shards from the environment
+    if os.environ.get('SHARD_DATABASE_URLS'):
+        sharding.configure(app, os.environ['SHARD_DATABASE_URLS'].split(','))
+
     # Load the JWT secret key from the environment
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY')
 
+    # Load the response compression and caching settings from the environment
+    app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+    app.config['COMPRESS_MIN_SIZE'] = int(
+        os.environ.get('COMPRESS_MIN_SIZE', 500))
+    app.config['RESPONSE_CACHE_TIMEOUT'] = int(
+        os.environ.get('RESPONSE_CACHE_TIMEOUT', 5))
+
+    # Load the background job settings from the environment
+    app.config['JOB_POLL_INTERVAL'] = float(
+        os.environ.get('JOB_POLL_INTERVAL', 1))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    app.config['JOB_LOCK_TIMEOUT'] = float(
+        os.environ.get('JOB_LOCK_TIMEOUT', 300))
+    app.config['JOB_RETENTION'] = float(os.environ.get('JOB_RETENTION', 86400))
+
+    # Load the outbox dispatcher settings from the environment
+    app.config['OUTBOX_POLL_INTERVAL'] = float(
+        os.environ.get('OUTBOX_POLL_INTERVAL', 1))
+    app.config['OUTBOX_BATCH_SIZE'] = int(
+        os.environ.get('OUTBOX_BATCH_SIZE', 500))
+    app.config['OUTBOX_GAP_TIMEOUT'] = float(
+        os.environ.get('OUTBOX_GAP_TIMEOUT', 30))
+    app.config['OUTBOX_RETENTION'] = float(
+        os.environ.get('OUTBOX_RETENTION', 86400))
+
+    # Load the number of rows deleted per batch from the environment
+    app.config['DELETION_BATCH_SIZE'] = int(
+        os.environ.get('DELETION_BATCH_SIZE', 500))
+
+    # Load the number of connections each worker opens before accepting
+    # traffic from the environment
+    app.config['WARM_UP_CONNECTIONS'] = int(
+        os.environ.get('WARM_UP_CONNECTIONS', 0))
+
+    # Load the hot key detection and caching settings from the environment
+    app.config['HOT_KEY_THRESHOLD'] = int(
+        os.environ.get('HOT_KEY_THRESHOLD', 100))
+    app.config['HOT_KEY_WINDOW'] = float(os.environ.get('HOT_KEY_WINDOW', 60))
+    app.config['HOT_KEY_TTL'] = float(os.environ.get('HOT_KEY_TTL', 60))
+    app.config['HOT_KEY_CAPACITY'] = int(
+        os.environ.get('HOT_KEY_CAPACITY', 100))
+
+    # Load the number of seconds between flushes of post views from the
+    # environment
+    app.config['VIEW_FLUSH_INTERVAL'] = float(
+        os.environ.get('VIEW_FLUSH_INTERVAL', 10))
+
+    # Load the trending window and half-life, in hours, from the environment
+    app.config['TRENDING_HOURS'] = int(os.environ.get('TRENDING_HOURS', 24))
+    app.config['TRENDING_HALF_LIFE'] = float(
+        os.environ.get('TRENDING_HALF_LIFE', 6))
+
+    # Load the number of posts ranked in a relevance ranked feed, their
+    # half-life in hours, and how long a ranking is cached, in seconds,
+    # from the environment
+    app.config['RANKING_CANDIDATES'] = int(
+        os.environ.get('RANKING_CANDIDATES', 200))
+    app.config['RANKING_HALF_LIFE'] = float(
+        os.environ.get('RANKING_HALF_LIFE', 12))
+    app.config['RANKING_CACHE_TIMEOUT'] = float(
+        os.environ.get('RANKING_CACHE_TIMEOUT', 60))
+
+    # Load the event stream heartbeat interval, lifetime and relay poll
+    # interval, in seconds, and the number of events a reconnecting
+    # stream can catch up on, from the environment
+    app.config['STREAM_HEARTBEAT'] = float(
+        os.environ.get('STREAM_HEARTBEAT', 15))
+    app.config['STREAM_TIMEOUT'] = float(os.environ.get('STREAM_TIMEOUT', 300))
+    app.config['STREAM_POLL_INTERVAL'] = float(
+        os.environ.get('STREAM_POLL_INTERVAL', 1))
+    app.config['STREAM_REPLAY_LIMIT'] = int(
+        os.environ.get('STREAM_REPLAY_LIMIT', 1000))
+
+    # Load the maximum number of operations in a batch from the environment
+    app.config['BATCH_MAX_OPERATIONS'] = int(
+        os.environ.get('BATCH_MAX_OPERATIONS', 20))
+
     # Initialize the Flask-SQLAlchemy extension
     db.init_app(app)
 
+    # Send reads to the replica, if there is one
+    replicas.init_app(app)
+
+    # Give sharded posts, likes and comments IDs, if there are shards
+    sharding.init_app(app)
+
+    # Hide soft deleted users and posts from every query
+    deletion.init_app(app)
+
+    # Give new comments their place in their thread
+    threads.init_app(app)
+
+    # Rank posts by their recent likes and comments
+    trending.init_app(app)
+
+    # Rank followed users' posts by their relevance to each user
+    ranking.init_app(app)
+
+    # Stream new posts to the users following their authors
+    streams.init_app(app)
+
     # Initialize the Flask-Marshmallow extension
     ma.init_app(app)
 
+    # Register the CLI blueprint
+    app.register_blueprint(cli_controller)
+
+    # Set up the HTTP surface and the API endpoints just before the
+    # first request
+    startup.defer(app, init_http)
+    startup.defer(app, register_endpoints)
+
+    # Return the configured Flask application
+    return app
+
+
+def init_http(app):
+    """Set up the handling of requests and responses of the application.
+
+    This function sets up the response formats, compression and caching
+    of the Flask application, and its authentication extensions. It is
+    deferred by `create_app` until just before the first request, as
+    only a process serving requests needs them.
+
+    Parameters
+    ----------
+    app : Flask
+        The Flask application.
+    """
+    # Import the services only used by requests
+    from services import batch, compression, hotkeys, negotiation
+    from services.json_provider import OrjsonProvider, orjson
+
+    # Answer with JSON or MessagePack, depending on the Accept header,
+    # encoding JSON with orjson when it is installed
+    app.json = OrjsonProvider(app) if orjson is not None \
+        else negotiation.NegotiatingProvider(app)
+
+    # Disable sorting of JSON keys
+    app.json.sort_keys = False
+
+    # Run batches of requests in a single transaction
+    batch.init_app(app)
+
     # Initialize the Flask-Bcrypt extension
     bcrypt.init_app(app)
 
     # Initialize the Flask-JWT-Extended extension
     jwt.init_app(app)
 
-    # Register the CLI blueprint
-    app.register_blueprint(cli)
+    # Accept MessagePack request bodies as well as JSON
+    negotiation.init_app(app)
+
+    # Compress responses for clients that accept it
+    compression.init_app(app)
+
+    # Count the requests for posts and users, to cache the hot ones
+    hotkeys.init_app(app)
+
+
+def register_endpoints(app):
+    """Register the API endpoints of the Flask application.
+
+    This function registers the blueprints of the API endpoints, and
+    the error handlers of their responses. It is deferred by
+    `create_app` until just before the first request, as only a process
+    serving requests needs them.
+
+    Parameters
+    ----------
+    app : Flask
+        The Flask application.
+    """
+    # Import the API controllers only when they are needed, from their
+    # own modules, as the names of the `controllers` package are only
+    # resolved when they are first used
+    from controllers.auth_controller import auth_controller
+    from controllers.user_controller import user_controller
+    from controllers.post_controller import post_controller
+    from controllers.feed_controller import feed_controller
+    from controllers.search_controller import search_controller
+    from controllers.admin_controller import admin_controller
+    from controllers.notification_controller import notification_controller
+    from controllers.batch_controller import batch_controller
 
     # Register the user blueprint
-    app.register_blueprint(user)
+    app.register_blueprint(user_controller)
 
     # Register the auth blueprint
-    app.register_blueprint(auth)
+    app.register_blueprint(auth_controller)
 
     # Register the post blueprint
-    app.register_blueprint(post)
+    app.register_blueprint(post_controller)
 
     # Register the feed blueprint
-    app.register_blueprint(feed)
+    app.register_blueprint(feed_controller)
+
+    # Register the search blueprint
+    app.register_blueprint(search_controller)
+
+    # Register the admin blueprint
+    app.register_blueprint(admin_controller)
+
+    # Register the notification blueprint
+    app.register_blueprint(notification_controller)
+
+    # Register the batch blueprint
+    app.register_blueprint(batch_controller)
 
 
     @app.errorhandler(ValidationError)
@@ -107,9 +311,23 @@ def create_app():
             message.
         """
         return {"error": str(error)}, 500
-        
-    # Return the configured Flask application
-    return app
 
-app = create_app()
+
+def __getattr__(name):
+    """Create the Flask application when `app` is first used.
+
+    Parameters
+    ----------
+    name : str
+        The name of the module attribute.
+
+    Returns
+    -------
+    Flask
+        The configured Flask application.
+    """
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()['app'] = create_app()
+    return globals()['app']
 
@@ -1,14 +1,24 @@
 """
 This module contains the Comment model and its associated schema.
 
-The Comment model represents a comment in the database.
+The Comment model represents a comment in the database. Comments can
+reply to other comments on the same post, forming threads.
 """
 from marshmallow import fields
 from marshmallow.validate import Regexp
 
 from init import db, ma
+from models.post import ID_TYPE
 
 
+# A comment's path is the IDs of its thread's root, its ancestors and
+# itself, each as this many hexadecimal digits, so that ordering by path
+# lists a thread depth first, with replies after the comment they reply to
+PATH_SEGMENT_LENGTH = 16
+
+# The number of levels a thread can have, including its root
+MAX_DEPTH = 10
+
 
 class Comment(db.Model):
     """
@@ -22,6 +32,12 @@ class Comment(db.Model):
         ID of the user who wrote the comment.
     post_id : int
         ID of the post the comment belongs to.
+    parent_id : int
+        ID of the comment this comment replies to, if any.
+    path : str
+        The materialized path of the comment in its thread. Before the
+        comment is inserted, this is the path of its parent, and its
+        own ID is appended once it has one.
     content : str
         Content of the comment.
     created_at : datetime
@@ -37,10 +53,23 @@ class Comment(db.Model):
         The post the comment belongs to.
     """
     __tablename__ = 'comments'
-
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    __table_args__ = (
+        # Whole threads and subtrees are ranges of paths within a post
+        db.Index('ix_comments_post_id_path', 'post_id', 'path'),
+        # The roots of a post's threads, newest first
+        db.Index('ix_comments_post_id_parent_id_id',
+                 'post_id', 'parent_id', 'id'),
+    )
+
+    id = db.Column(ID_TYPE, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'),
+                        nullable=False, index=True)
+    post_id = db.Column(ID_TYPE, db.ForeignKey('posts.id', ondelete='CASCADE'),
+                        nullable=False)
+    parent_id = db.Column(ID_TYPE, db.ForeignKey('comments.id', ondelete='CASCADE'),
+                          nullable=True)
+    path = db.Column(db.String(PATH_SEGMENT_LENGTH * MAX_DEPTH),
+                     nullable=False, default='')
     content = db.Column(db.String(500), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
     updated_at = db.Column(db.DateTime, nullable=True)
@@ -61,6 +90,10 @@ class CommentSchema(ma.Schema):
         ID of the user who wrote the comment.
     post_id : int
         ID of the post the comment belongs to.
+    parent_id : int
+        ID of the comment this comment replies to, if any.
+    depth : int
+        The number of comments above this comment in its thread.
     content : str
         Content of the comment.
     created_at : datetime
@@ -71,6 +104,8 @@ class CommentSchema(ma.Schema):
     id = fields.Integer(dump_only=True)
     user_id = fields.Integer(required=True)
     post_id = fields.Integer(required=True)
+    parent_id = fields.Integer(allow_none=True)
+    depth = fields.Method(serialize="get_depth")
     content = fields.String(required=True, validate=Regexp(r'^.{1,500}$'))
     created_at = fields.DateTime()
     updated_at = fields.DateTime()
@@ -84,9 +119,25 @@ class CommentSchema(ma.Schema):
         model : Comment
             The model to serialize.
         """
-        fields = ('id', 'user_id', 'post_id',
+        fields = ('id', 'user_id', 'post_id', 'parent_id', 'depth',
                   'content', 'created_at', 'updated_at')
 
+    def get_depth(self, comment):
+        """
+        Returns the number of comments above a comment in its thread.
+
+        Parameters
+        ----------
+        comment : Comment
+            The comment to get the depth of.
+
+        Returns
+        -------
+        int
+            The depth of the comment, 0 for the root of a thread.
+        """
+        return max(len(comment.path) // PATH_SEGMENT_LENGTH - 1, 0)
+
 
 comment_schema = CommentSchema()
 comments_schema = CommentSchema(many=True)
@@ -36,9 +36,11 @@ class Follow(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     follower_id = db.Column(
-        db.Integer, db.ForeignKey('users.id'), nullable=False)
+        db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False, index=True)
     followed_id = db.Column(
-        db.Integer, db.ForeignKey('users.id'), nullable=False)
+        db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False, index=True)
 
     follower = db.relationship('User', foreign_keys=[follower_id])
     follows = db.relationship('User', foreign_keys=[followed_id])
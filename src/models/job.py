@@ -0,0 +1,61 @@
+"""
+This module contains the Job model.
+
+The Job model represents a unit of background work in the database,
+waiting to be run, or already run, by a worker. Jobs are queued and
+run by `services.jobs`.
+"""
+from init import db
+
+
+class Job(db.Model):
+    """
+    Represents a background job in the database.
+
+    Attributes
+    ----------
+    id : int
+        Unique identifier for the job.
+    name : str
+        Name of the task the job runs.
+    payload : dict
+        Keyword arguments the task is called with.
+    lane : str
+        Priority lane of the job: `high`, `default` or `low`.
+    status : str
+        Either `queued`, `running`, `done` or `failed`.
+    attempts : int
+        Number of times the job has been started.
+    max_attempts : int
+        Number of times the job is started before it is failed.
+    run_at : datetime
+        Date and time the job can next be run.
+    locked_by : str
+        Name of the worker running the job.
+    locked_at : datetime
+        Date and time the running worker started the job.
+    last_error : str
+        The error raised by the last failed attempt.
+    created_at : datetime
+        Date and time the job was queued.
+    finished_at : datetime
+        Date and time the job was done or failed.
+    """
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_lane_run_at', 'status', 'lane', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    lane = db.Column(db.String(10), nullable=False, default='default')
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False)
+    locked_by = db.Column(db.String(80), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
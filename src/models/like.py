@@ -20,6 +20,7 @@ created_at : datetime
 from marshmallow import fields
 
 from init import db, ma
+from models.post import ID_TYPE
 
 class Like(db.Model):
     """
@@ -47,9 +48,11 @@ class Like(db.Model):
     """
     __tablename__ = 'likes'
 
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    id = db.Column(ID_TYPE, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'),
+                        nullable=False, index=True)
+    post_id = db.Column(ID_TYPE, db.ForeignKey('posts.id', ondelete='CASCADE'),
+                        nullable=False, index=True)
 
     user = db.relationship('User', back_populates='likes')
     post = db.relationship('Post', back_populates='likes')
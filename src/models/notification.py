@@ -0,0 +1,153 @@
+"""
+This module contains the Notification and NotificationCounter models,
+and the schema of notifications.
+
+The Notification model represents the likes, comments or follows a user
+got on one of their posts, comments or themselves, aggregated into a
+single row. The NotificationCounter model represents the number of a
+user's notifications they haven't read. Both are maintained by
+`services.notifications`.
+"""
+from marshmallow import fields
+
+from init import db, ma
+from models.outbox import EVENT_ID_TYPE
+from models.post import ID_TYPE
+
+
+# The types of notification, and what their actors did
+NOTIFICATION_VERBS = {
+    'like': 'liked your post',
+    'comment': 'commented on your post',
+    'reply': 'replied to your comment',
+    'follow': 'followed you',
+}
+
+
+class Notification(db.Model):
+    """
+    Represents the aggregated actions of other users on one target of a
+    user.
+
+    Each user has at most one notification per type and target, which
+    counts every action aggregated into it and remembers the latest
+    actor, so that a popular post costs one row however many likes it
+    gets.
+
+    Attributes
+    ----------
+    id : int
+        Unique identifier for the notification.
+    user_id : int
+        ID of the user notified.
+    type : str
+        Type of the notification, one of `NOTIFICATION_VERBS`.
+    target_id : int
+        ID of the post liked or commented on, of the comment replied
+        to, or of the user followed.
+    actor_id : int or None
+        ID of the latest user to act on the target, or `None` if they
+        have been deleted.
+    actor_count : int
+        Number of actions aggregated into the notification.
+    read : bool
+        If the user has read the notification since its latest action.
+    event_id : int
+        ID of the outbox event of the latest action, which orders the
+        user's notifications.
+    updated_at : datetime
+        Date and time of the latest action.
+
+    Relationships
+    -------------
+    actor : User
+        The latest user to act on the target.
+    """
+    __tablename__ = 'notifications'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'type', 'target_id'),
+        db.Index('ix_notifications_user_id_event_id', 'user_id', 'event_id'),
+    )
+
+    id = db.Column(EVENT_ID_TYPE, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'),
+                        nullable=False)
+    type = db.Column(db.String(20), nullable=False)
+    target_id = db.Column(ID_TYPE, nullable=False)
+    actor_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'),
+                         nullable=True)
+    actor_count = db.Column(db.Integer, nullable=False, default=0)
+    read = db.Column(db.Boolean, nullable=False, default=False)
+    event_id = db.Column(EVENT_ID_TYPE, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    actor = db.relationship('User', foreign_keys=[actor_id])
+
+
+class NotificationCounter(db.Model):
+    """
+    Represents the number of unread notifications of a user, so that it
+    can be read without counting them.
+
+    Attributes
+    ----------
+    user_id : int
+        ID of the user.
+    unread : int
+        Number of the user's notifications with `read` unset.
+    """
+    __tablename__ = 'notification_counters'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'),
+                        primary_key=True, autoincrement=False)
+    unread = db.Column(db.Integer, nullable=False, default=0)
+
+
+class NotificationSchema(ma.Schema):
+    """
+    Schema for serializing Notification objects.
+
+    Attributes
+    ----------
+    actor : User
+        The latest user to act on the target, with their ID and username.
+    others : int
+        The number of other actions aggregated into the notification.
+    text : str
+        The notification as a sentence, such as "admin and 412 others
+        liked your post".
+    """
+    actor = fields.Nested('UserSchema', only=['id', 'username'], allow_none=True)
+    others = fields.Method(serialize="get_others")
+    text = fields.Method(serialize="get_text")
+
+    def get_others(self, notification):
+        """
+        Returns the number of actions aggregated besides the latest.
+        """
+        return max(notification.actor_count - 1, 0)
+
+    def get_text(self, notification):
+        """
+        Returns the notification as a sentence.
+        """
+        name = notification.actor.username if notification.actor else 'Someone'
+        others = self.get_others(notification)
+        if others:
+            name += f" and {others} {'other' if others == 1 else 'others'}"
+        return f"{name} {NOTIFICATION_VERBS[notification.type]}"
+
+    class Meta:
+        """
+        Additional options for the schema.
+
+        Attributes
+        ----------
+        fields : tuple
+            The fields to serialize.
+        """
+        fields = ('id', 'type', 'target_id', 'actor', 'actor_count', 'others',
+                  'text', 'read', 'updated_at')
+
+
+notifications_schema = NotificationSchema(many=True)
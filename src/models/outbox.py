@@ -0,0 +1,58 @@
+"""
+This module contains the OutboxEvent and OutboxCursor models.
+
+The OutboxEvent model represents a change to the application's data,
+recorded in the same transaction as the change. The OutboxCursor model
+represents how far through the events each consumer has got. Both are
+used by `services.events`.
+"""
+from init import db
+
+
+# Events are numbered in the order they were recorded, which may exceed
+# 32 bits over the lifetime of the application
+EVENT_ID_TYPE = db.BigInteger().with_variant(db.Integer, 'sqlite')
+
+
+class OutboxEvent(db.Model):
+    """
+    Represents a domain event in the database.
+
+    Attributes
+    ----------
+    id : int
+        Unique identifier for the event, increasing in the order the
+        events were recorded.
+    type : str
+        Type of the event, such as `PostCreated`.
+    payload : dict
+        The data describing the change.
+    created_at : datetime
+        Date and time the event was recorded.
+    """
+    __tablename__ = 'outbox_events'
+
+    id = db.Column(EVENT_ID_TYPE, primary_key=True)
+    type = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class OutboxCursor(db.Model):
+    """
+    Represents the position of a consumer in the outbox.
+
+    Attributes
+    ----------
+    consumer : str
+        Name of the consumer.
+    last_id : int
+        ID of the last event the consumer has processed.
+    updated_at : datetime
+        Date and time the consumer last processed events.
+    """
+    __tablename__ = 'outbox_cursors'
+
+    consumer = db.Column(db.String(120), primary_key=True)
+    last_id = db.Column(EVENT_ID_TYPE, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
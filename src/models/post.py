@@ -12,6 +12,12 @@ from marshmallow import fields
 from marshmallow.validate import Regexp
 
 from init import db, ma
+from services import views
+
+
+# The type of post, like and comment IDs. Sharded IDs need 64 bits, and
+# SQLite only generates IDs for INTEGER primary keys.
+ID_TYPE = db.BigInteger().with_variant(db.Integer, 'sqlite')
 
 
 class Post(db.Model):
@@ -32,6 +38,12 @@ class Post(db.Model):
         Date and time the post was created.
     updated_at : datetime
         Date and time the post was last updated.
+    version : int
+        Incremented whenever the post, its likes or its comments change.
+    deleted_at : datetime
+        Date and time the post was deleted, until it is purged.
+    views_sketch : bytes
+        The compressed HyperLogLog sketch of the post's viewers.
 
     Relationships
     -------------
@@ -44,17 +56,21 @@ class Post(db.Model):
     """
     __tablename__ = 'posts'
 
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(ID_TYPE, primary_key=True)
     title = db.Column(db.String(80), nullable=False)
     content = db.Column(db.String(500), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
     updated_at = db.Column(db.DateTime, nullable=True)
     author_id = db.Column(
-        db.Integer, db.ForeignKey('users.id'), nullable=False)
+        db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    views_sketch = db.Column(db.LargeBinary, nullable=True)
 
     author = db.relationship('User', back_populates='posts')
-    comments = db.relationship('Comment', back_populates='post', cascade='all, delete-orphan')
-    likes = db.relationship('Like', back_populates='post', cascade='all, delete-orphan')
+    comments = db.relationship('Comment', back_populates='post', cascade='all, delete-orphan', passive_deletes=True)
+    likes = db.relationship('Like', back_populates='post', cascade='all, delete-orphan', passive_deletes=True)
 
 
 class PostSchema(ma.Schema):
@@ -86,6 +102,7 @@ class PostSchema(ma.Schema):
 
     likes_count = fields.Method(serialize="get_likes_count")
     comments_count = fields.Method(serialize="get_comments_count")
+    views_count = fields.Method(serialize="get_views_count")
 
     class Meta:
         """
@@ -98,7 +115,8 @@ class PostSchema(ma.Schema):
         """
 
         fields = ('id', 'title', 'content', 'likes_count', 'comments_count',
-                  'created_at', 'updated_at', 'author', 'likes', 'comments')
+                  'views_count', 'created_at', 'updated_at', 'author',
+                  'likes', 'comments')
 
     def get_likes_count(self, post, **kwargs):
         """
@@ -132,6 +150,61 @@ class PostSchema(ma.Schema):
         """
         return len(post.comments)
 
+    def get_views_count(self, post):
+        """
+        Returns the approximate number of unique viewers of a post.
+
+        Parameters
+        ----------
+        post : Post
+            The post to get the viewer count for.
+
+        Returns
+        -------
+        int
+            The number of unique viewers of the post.
+        """
+        return views.count(post)
+
+
+class PostPreviewSchema(PostSchema):
+    """
+    Schema for serializing posts in feeds, with a preview of their latest
+    comments instead of all of their likes and comments.
+
+    The previews and counts are attached to the posts by
+    `services.previews.attach_previews`.
+    """
+    comments = fields.List(fields.Nested('CommentSchema', exclude=['post_id']),
+                           attribute='preview_comments')
+
+    class Meta:
+        """
+        Configuration for the PostPreviewSchema.
+
+        Attributes
+        ----------
+        fields : tuple
+            The fields to include in the serialized representation of the Post.
+        """
+
+        fields = ('id', 'title', 'content', 'likes_count', 'comments_count',
+                  'views_count', 'created_at', 'updated_at', 'author',
+                  'comments')
+
+    def get_likes_count(self, post, **kwargs):
+        """
+        Returns the number of likes a post has, counted with its preview.
+        """
+        return post.preview_likes_count
+
+    def get_comments_count(self, post, **kwargs):
+        """
+        Returns the number of comments a post has, counted with its preview.
+        """
+        return post.preview_comments_count
+
 
 post_schema = PostSchema()
 posts_schema = PostSchema(many=True)
+post_previews_schema = PostPreviewSchema(many=True)
@@ -0,0 +1,63 @@
+"""
+This module contains the EngagementBucket and TrendingPost models.
+
+The EngagementBucket model represents the likes and comments a post got
+in one hour, in a ring buffer of hourly buckets per post. The
+TrendingPost model represents the trending score of a post with recent
+engagement. Both are maintained by `services.trending`.
+"""
+from init import db
+from models.post import ID_TYPE
+
+
+class EngagementBucket(db.Model):
+    """
+    Represents the engagement of a post in one hour.
+
+    Each post has at most `TRENDING_HOURS` buckets, one per slot of its
+    ring buffer. A slot is reused, and its counts reset, when an hour
+    after the one it holds maps to it.
+
+    Attributes
+    ----------
+    post_id : int
+        ID of the post.
+    slot : int
+        Position of the bucket in the post's ring buffer.
+    hour : int
+        Hours since the epoch of the counted engagement.
+    likes : int
+        Number of likes of the post in the hour.
+    comments : int
+        Number of comments on the post in the hour.
+    """
+    __tablename__ = 'engagement_buckets'
+
+    post_id = db.Column(ID_TYPE, primary_key=True, autoincrement=False)
+    slot = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    hour = db.Column(db.Integer, nullable=False, index=True)
+    likes = db.Column(db.Integer, nullable=False, default=0)
+    comments = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TrendingPost(db.Model):
+    """
+    Represents the trending score of a post with recent engagement.
+
+    Attributes
+    ----------
+    post_id : int
+        ID of the post.
+    score : float
+        The base 2 logarithm of the post's forward decayed engagement.
+        Engagement is weighted by how recent its hour is, in a way that
+        doesn't change as time passes, so that scores only need to be
+        updated when there is new engagement.
+    last_hour : int
+        Hours since the epoch of the post's latest engagement.
+    """
+    __tablename__ = 'trending_posts'
+
+    post_id = db.Column(ID_TYPE, primary_key=True, autoincrement=False)
+    score = db.Column(db.Float, nullable=False, index=True)
+    last_hour = db.Column(db.Integer, nullable=False, index=True)
@@ -36,6 +36,11 @@ class User(db.Model):
         If the user has confirmed their email.
     confirmed_on : datetime
         The datetime the user confirmed their email.
+    version : int
+        Incremented whenever the user's profile or timeline changes.
+    deleted_at : datetime
+        The datetime the user deleted their account, until their data is
+        purged.
     posts : list[Post]
         The posts the user has made.
     likes : list[Like]
@@ -69,32 +74,44 @@ class User(db.Model):
     is_confirmed = db.Column(db.Boolean, nullable=False, default=False)
     confirmed_on = db.Column(db.DateTime, nullable=True)
 
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
+    # The dependent rows are purged in batches by `services.deletion`, and
+    # the database deletes any left behind, so they are never loaded
+    # just to be deleted
     posts = db.relationship(
         'Post',
         back_populates='author',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     likes = db.relationship(
         'Like',
         back_populates='user',
-        cascade='all, delete-orphan')
+        cascade='all, delete-orphan',
+        passive_deletes=True)
     comments = db.relationship(
         'Comment',
         back_populates='user',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
     follows = db.relationship(
         'Follow',
         foreign_keys='Follow.followed_id',
         back_populates='follows',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     followers = db.relationship(
         'Follow',
         foreign_keys='Follow.follower_id',
         back_populates='follower',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
 
@@ -0,0 +1,34 @@
+"""
+This package contains the services used by the controllers.
+
+Services hold the logic that is shared between several controllers or
+CLI commands, but which is not an endpoint itself.
+
+The services are:
+
+- `search`: Maintains the full-text search index for posts and comments.
+- `cache`: Caches responses in memory for a short time.
+- `compression`: Compresses responses with the encoding the client accepts.
+- `versions`: Maintains version stamps and ETags for conditional requests.
+- `serializers`: Compiles marshmallow schemas into fast dump functions.
+- `json_provider`: Encodes JSON responses with `orjson`.
+- `negotiation`: Negotiates between JSON and MessagePack bodies.
+- `replicas`: Routes reads to a read replica and writes to the primary.
+- `sharding`: Spreads posts, likes and comments over several databases.
+- `jobs`: Queues slow work in the database for background workers.
+- `events`: Records domain events in an outbox and delivers them to consumers.
+- `deletion`: Soft deletes users and posts, and purges their data in batches.
+- `threads`: Reads comment threads and subtrees by their materialized paths.
+- `previews`: Loads the latest comments of a page of posts in one query.
+- `hotkeys`: Detects the most requested posts and users, and caches them longer.
+- `hyperloglog`: Estimates the number of distinct items in fixed memory.
+- `views`: Counts the unique viewers of posts, and flushes the counts periodically.
+- `trending`: Ranks posts by their recent likes and comments.
+- `ranking`: Ranks the posts of followed users by their relevance to the viewer.
+- `streams`: Publishes new posts to the event streams of their authors' followers.
+- `notifications`: Aggregates likes, comments and follows into notification inboxes.
+- `batch`: Runs batches of API requests in-process, in a single transaction.
+- `provisioning`: Imports users in bulk, hashing their passwords on every core.
+- `startup`: Defers the setup of the API, prepares pre-fork workers, and profiles cold starts.
+
+"""
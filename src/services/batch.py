@@ -0,0 +1,275 @@
+"""
+This module contains the running of batches of API requests.
+
+A batch is a list of operations, each a method, a path and an optional
+JSON body, run one after the other in the process handling the batch.
+Each operation is dispatched to its route as a request of its own, with
+the batch's `Authorization` header, so it is validated and authorized
+exactly as if it had been sent on its own, but without a round trip.
+
+Every operation runs in the same database transaction, which is
+committed once when the batch ends. While the batch is running, the
+views' own commits only flush their changes, and each operation runs in
+a savepoint, so a failed operation, one answered with an error status,
+is rolled back on its own. An atomic batch stops at the first failed
+operation and rolls every operation back instead.
+
+If a statement of an operation fails, such as an insert breaking a
+constraint, its savepoint is rolled back whatever the view answered,
+and the operation is answered with a 500 status.
+
+The operations share the batch's application context, so `g` is
+cleared before each one, and restored after it, so that nothing one
+operation stores there, such as its ETag, leaks into the next. While an
+operation runs, `g` holds the batch under `BATCH_KEY`, so that its
+responses, which may be rolled back, are kept out of the caches shared
+with other requests.
+
+pysqlite only begins a transaction before the statements changing rows,
+so a savepoint taken before them would be a transaction of its own, and
+releasing it would commit it. The SQLite connections of a batch begin
+their transaction as soon as SQLAlchemy does instead, so savepoints nest
+in it as they do on the other databases. Only batches do, as read
+transactions would otherwise keep other processes from writing.
+"""
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.test import EnvironBuilder
+
+from init import db
+from services.replicas import BATCH_KEY
+
+
+# The methods an operation can use
+METHODS = frozenset({'GET', 'POST', 'PUT', 'PATCH', 'DELETE'})
+
+# The status of the operations not run because an atomic batch failed
+NOT_RUN_STATUS = 424
+
+# The result of an operation which raised an error
+INTERNAL_ERROR = {"status": 500, "body": {"message": "Internal server error"}}
+
+
+class Batch:
+    """
+    The running batch of a session, which holds the savepoint of its
+    current operation.
+
+    Parameters
+    ----------
+    session : RoutingSession
+        The session the batch runs in.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.savepoint = None
+
+    def begin_operation(self):
+        """
+        Starts the savepoint of the next operation.
+        """
+        self.savepoint = self.session.begin_nested()
+
+    def statement_failed(self):
+        """
+        Returns if a statement of the current operation failed, which
+        leaves its savepoint open but unusable until it is rolled back.
+        """
+        return not self.savepoint.is_active \
+            and self.session.get_nested_transaction() is self.savepoint
+
+    def _rollback_savepoint(self):
+        """
+        Rolls back to the savepoint of the current operation, unless it
+        has already been closed.
+        """
+        if self.session.get_nested_transaction() is self.savepoint:
+            self.savepoint.rollback()
+
+    def rollback_operation(self):
+        """
+        Rolls the current operation back to its savepoint, and starts a
+        new one for the rest of the operation.
+        """
+        self._rollback_savepoint()
+        self.savepoint = self.session.begin_nested()
+
+    def end_operation(self, succeeded):
+        """
+        Releases the savepoint of the current operation, or rolls back
+        to it if the operation failed.
+        """
+        if succeeded:
+            self.savepoint.commit()
+        else:
+            self._rollback_savepoint()
+
+
+def _begin_sqlite(session, transaction, connection):
+    """
+    Begins the transaction of the SQLite connections of a batch, before
+    its first savepoint.
+    """
+    if BATCH_KEY in session.info and not transaction.nested \
+            and connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql('BEGIN')
+
+
+def validate(operations):
+    """
+    Returns the error message for an invalid list of operations, or
+    `None` if it is valid.
+
+    Parameters
+    ----------
+    operations : object
+        The `operations` of the request body.
+
+    Returns
+    -------
+    str or None
+        The error message.
+    """
+    limit = current_app.config['BATCH_MAX_OPERATIONS']
+    if not isinstance(operations, list) or not 0 < len(operations) <= limit:
+        return f"operations must be a list of 1 to {limit} operations"
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) \
+                or operation.get('method') not in METHODS \
+                or not isinstance(operation.get('path'), str) \
+                or not operation['path'].startswith('/'):
+            return (f"Operation {index} must have a method, one of "
+                    f"{', '.join(sorted(METHODS))}, and a path")
+        path = operation['path'].partition('?')[0]
+        if path.rstrip('/') == request.path.rstrip('/'):
+            return f"Operation {index} cannot be a batch"
+    return None
+
+
+def _result(response):
+    """
+    Returns the result of an operation from its response.
+    """
+    if response.is_streamed:
+        # Streams never end, so they can't be part of a batch
+        response.close()
+        return {"status": 400,
+                "body": {"message": "Streaming endpoints cannot be batched"}}
+    body = response.get_json(silent=True)
+    if body is None and response.data:
+        body = response.get_data(as_text=True)
+    return {"status": response.status_code, "body": body}
+
+
+def dispatch(operation):
+    """
+    Runs one operation as a request to its route, in the current
+    application context.
+
+    Parameters
+    ----------
+    operation : dict
+        The operation, with its `method`, `path` and optional `body`.
+
+    Returns
+    -------
+    dict
+        The status and body of the operation's response.
+    """
+    path, _, query_string = operation['path'].partition('?')
+    headers = {'Accept': 'application/json'}
+    if 'Authorization' in request.headers:
+        headers['Authorization'] = request.headers['Authorization']
+    builder = EnvironBuilder(
+        path=path, query_string=query_string, method=operation['method'],
+        headers=headers, json=operation.get('body'),
+        base_url=request.host_url)
+    environ = builder.get_environ()
+    builder.close()
+
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    with app.request_context(environ):
+        return _result(app.full_dispatch_request())
+
+
+def run(operations, atomic=False):
+    """
+    Runs a batch of operations in a single transaction, and commits it.
+
+    Parameters
+    ----------
+    operations : list of dict
+        The operations, each with its `method`, `path` and optional
+        `body`.
+    atomic : bool
+        If the batch stops at the first failed operation, and rolls
+        every operation back.
+
+    Returns
+    -------
+    tuple of (list of dict, bool)
+        The status and body of each operation, and if the transaction
+        was committed.
+    """
+    # End the request's own transaction, so that the batch's begins
+    # with its first operation
+    db.session.commit()
+    session = db.session()
+    batch = session.info[BATCH_KEY] = Batch(session)
+    saved = dict(vars(g))
+
+    results = []
+    failed = False
+    try:
+        for operation in operations:
+            if failed:
+                results.append({"status": NOT_RUN_STATUS, "body": None})
+                continue
+            vars(g).clear()
+            setattr(g, BATCH_KEY, batch)
+            batch.begin_operation()
+            try:
+                result = dispatch(operation)
+            except Exception:  # pylint: disable=broad-except
+                current_app.logger.exception(
+                    "Batch operation %s %s failed",
+                    operation['method'], operation['path'])
+                result = INTERNAL_ERROR
+            if batch.statement_failed():
+                # The operation's changes can't be kept, whatever it
+                # answered, and its error may hold the failed statement
+                current_app.logger.error(
+                    "A statement of batch operation %s %s failed",
+                    operation['method'], operation['path'])
+                result = INTERNAL_ERROR
+            succeeded = result['status'] < 400
+            batch.end_operation(succeeded)
+            results.append(result)
+            failed = atomic and not succeeded
+    finally:
+        del session.info[BATCH_KEY]
+        vars(g).clear()
+        vars(g).update(saved)
+
+    if failed:
+        db.session.rollback()
+        return results, False
+    db.session.commit()
+    return results, True
+
+
+def init_app(app):
+    """
+    Sets the defaults of the batch settings of an application, and
+    makes SQLite connections support savepoints.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    """
+    app.config.setdefault('BATCH_MAX_OPERATIONS', 20)
+    if not event.contains(Session, 'after_begin', _begin_sqlite):
+        event.listen(Session, 'after_begin', _begin_sqlite)
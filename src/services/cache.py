@@ -0,0 +1,367 @@
+"""
+This module contains the in-process response cache.
+
+Views decorated with `cached_response` have their responses stored in
+the cache for a short time, so that repeated requests for the same URL
+are answered without running any queries. When the view is also
+decorated with `versions.conditional`, entries are keyed by the ETag,
+so a cached response is never served after the data behind it changes.
+
+The compression service stores the compressed versions of each cached
+body alongside it, so each response is only ever compressed once per
+encoding.
+
+The cache timeout is set with the `RESPONSE_CACHE_TIMEOUT` config value,
+in seconds. A timeout of 0 disables the cache.
+
+Views decorated with `single_flight` coalesce concurrent identical
+requests: while one request for a URL is running the view, the others
+for the same URL and ETag wait for it and are answered with a copy of
+its response, instead of each running the same queries. Unlike the
+cache, nothing is kept once the running request has finished, so it is
+never stale, and it works even when the cache is disabled.
+
+The operations of a batch, see `services.batch`, read changes which
+aren't committed yet, and may be rolled back, so they bypass the cache
+and are never coalesced with other requests.
+"""
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Event, Lock
+
+from flask import current_app, g, make_response, request
+
+from services.negotiation import response_format
+from services.replicas import BATCH_KEY
+
+
+# Maximum number of responses held in the cache at once
+MAX_ENTRIES = 1024
+
+# Maximum number of seconds a request waits for an identical request's
+# response, before running the view itself
+MAX_FLIGHT_WAIT = 10
+
+# The response headers not stored with a response: those describing the
+# body, which are set again when it is served, and cookies, which belong
+# to the client of the request that set them
+UNSHARED_HEADERS = frozenset({'content-type', 'content-length', 'set-cookie'})
+
+
+class CacheEntry:
+    """
+    A cached response.
+
+    Attributes
+    ----------
+    body : bytes
+        The uncompressed response body.
+    status : int
+        The response status code.
+    mimetype : str
+        The response mimetype.
+    expires : float
+        The monotonic time the entry expires at.
+    headers : list of tuple
+        The other response headers set by the view, such as `ETag`,
+        `Vary` or `Cache-Control`, as `(name, value)` pairs.
+    variants : dict
+        The compressed response bodies, keyed by content encoding.
+    post_ids : list of int or None
+        The IDs of the posts shown in the response, for counting their
+        views when it is served from the cache.
+    """
+
+    def __init__(self, body, status, mimetype, expires, headers=()):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.expires = expires
+        self.headers = list(headers)
+        self.variants = {}
+        self.post_ids = g.get('post_ids')
+
+    @classmethod
+    def from_response(cls, response, expires):
+        """
+        Stores a response returned by a view.
+
+        Parameters
+        ----------
+        response : Response
+            The response.
+        expires : float
+            The monotonic time the entry expires at.
+
+        Returns
+        -------
+        CacheEntry
+            The entry.
+        """
+        headers = [(name, value) for name, value in response.headers
+                   if name.lower() not in UNSHARED_HEADERS]
+        return cls(response.get_data(), response.status_code,
+                   response.mimetype, expires, headers)
+
+    def to_response(self):
+        """
+        Builds a new response from the cached entry.
+
+        Returns
+        -------
+        Response
+            The response.
+        """
+        return current_app.response_class(
+            self.body, status=self.status, headers=self.headers,
+            mimetype=self.mimetype)
+
+
+class ResponseCache:
+    """
+    A thread-safe, size-bounded cache of responses with expiry.
+
+    The least recently used entry is evicted when the cache is full.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        """
+        Gets an entry from the cache.
+
+        Parameters
+        ----------
+        key : hashable
+            The cache key.
+
+        Returns
+        -------
+        CacheEntry or None
+            The entry, or `None` if it is missing or has expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        """
+        Adds an entry to the cache, evicting the oldest entry if full.
+
+        Parameters
+        ----------
+        key : hashable
+            The cache key.
+        entry : CacheEntry
+            The entry to add.
+        """
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        with self.lock:
+            self.entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+class Flight:
+    """
+    A view running for a request which identical requests wait for.
+
+    Attributes
+    ----------
+    done : Event
+        Set once the response, or the error, is known.
+    entry : CacheEntry or None
+        The response, if the view returned one.
+    error : Exception or None
+        The error, if the view raised one.
+    """
+
+    def __init__(self):
+        self.done = Event()
+        self.entry = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    A thread-safe registry of the views running for requests, keyed by
+    request.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = Lock()
+
+    def run(self, key, fn):
+        """
+        Runs a function, unless it is already running for the same key,
+        in which case its result is waited for instead.
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the request.
+        fn : callable
+            Returns the `CacheEntry` of the response.
+
+        Returns
+        -------
+        CacheEntry
+            The entry, shared by every request waiting for it.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            if not flight.done.wait(MAX_FLIGHT_WAIT):
+                return fn()
+            if flight.error is not None:
+                raise flight.error
+            return flight.entry
+
+        try:
+            flight.entry = fn()
+            return flight.entry
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+
+flights = SingleFlight()
+
+
+def in_batch():
+    """
+    Returns if the current request is an operation of a batch, whose
+    responses must not be shared with other requests.
+    """
+    return g.get(BATCH_KEY) is not None
+
+
+def cached_response(per_user=False):
+    """
+    Caches the successful responses of the decorated view.
+
+    Must be applied below `jwt_required` so that only authenticated
+    requests reach the cache.
+
+    Parameters
+    ----------
+    per_user : bool, optional
+        If the response depends on the current user, and must be cached
+        separately for each user.
+
+    Returns
+    -------
+    callable
+        The decorator.
+    """
+    def decorator(fn):
+        # pylint: disable=import-outside-toplevel
+        from flask_jwt_extended import get_jwt_identity
+
+        @wraps(fn)
+        def decorated_function(*args, **kwargs):
+            timeout = current_app.config.get('RESPONSE_CACHE_TIMEOUT', 0)
+            if not timeout or in_batch():
+                return fn(*args, **kwargs)
+
+            key = (request.full_path, response_format(),
+                   get_jwt_identity() if per_user else None,
+                   g.get('etag'))
+            entry = response_cache.get(key)
+            if entry is not None:
+                # Let the compression service reuse the compressed bodies
+                g.cache_entry = entry
+                g.post_ids = entry.post_ids
+                return entry.to_response()
+
+            response = make_response(fn(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                entry = CacheEntry.from_response(
+                    response, time.monotonic() + timeout)
+                response_cache.set(key, entry)
+                g.cache_entry = entry
+            return response
+        return decorated_function
+    return decorator
+
+
+def single_flight(per_user=False):
+    """
+    Coalesces concurrent identical requests to the decorated view, so
+    that the view runs once and every request gets its response.
+
+    Must be applied below `jwt_required` so that only authenticated
+    requests wait, and below `versions.conditional` so that requests
+    are only coalesced with requests for the same version of the data.
+
+    The waiting requests get the status, body and headers of the
+    response, but not the cookies it sets.
+
+    Parameters
+    ----------
+    per_user : bool, optional
+        If the response depends on the current user, and must only be
+        shared with requests from the same user.
+
+    Returns
+    -------
+    callable
+        The decorator.
+    """
+    def decorator(fn):
+        # pylint: disable=import-outside-toplevel
+        from flask_jwt_extended import get_jwt_identity
+
+        @wraps(fn)
+        def decorated_function(*args, **kwargs):
+            if in_batch():
+                return fn(*args, **kwargs)
+
+            key = (request.endpoint, request.full_path, response_format(),
+                   get_jwt_identity() if per_user else None,
+                   g.get('etag'))
+
+            response = None
+
+            def run():
+                nonlocal response
+                response = make_response(fn(*args, **kwargs))
+                return CacheEntry.from_response(response, time.monotonic())
+
+            entry = flights.run(key, run)
+            # Let the compression service compress the body only once
+            g.cache_entry = entry
+            g.post_ids = entry.post_ids
+            # The request which ran the view keeps its own response
+            return response if response is not None else entry.to_response()
+        return decorated_function
+    return decorator
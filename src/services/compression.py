@@ -0,0 +1,146 @@
+"""
+This module contains the response compression service.
+
+Responses are compressed with the best encoding the client accepts,
+chosen from the `Accept-Encoding` request header. The supported
+encodings are, in order of preference:
+
+- `zstd`, if the optional `zstandard` package is installed.
+- `gzip`
+- `deflate`
+
+The service is configured with the following config values:
+
+- `COMPRESS_LEVEL`: The compression level to use. Defaults to 6.
+- `COMPRESS_MIN_SIZE`: The minimum response size in bytes that is
+  compressed. Smaller responses are sent as they are. Defaults to 500.
+
+When a response came from the response cache, the compressed body is
+stored on the cache entry, so later hits are sent without compressing
+them again.
+"""
+import gzip
+import zlib
+
+from flask import g, request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Mimetypes that are worth compressing
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/msgpack',
+                          'text/html', 'text/plain'}
+
+
+def compress_gzip(data, level):
+    """
+    Compresses data with gzip.
+
+    The modification time is left out of the header so that the same
+    data always compresses to the same bytes.
+    """
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_deflate(data, level):
+    """
+    Compresses data with zlib-wrapped deflate, as used by HTTP.
+    """
+    return zlib.compress(data, level)
+
+
+def compress_zstd(data, level):
+    """
+    Compresses data with Zstandard.
+    """
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+# The available encodings, most preferred first
+ENCODINGS = {}
+if zstandard is not None:
+    ENCODINGS['zstd'] = compress_zstd
+ENCODINGS['gzip'] = compress_gzip
+ENCODINGS['deflate'] = compress_deflate
+
+
+def choose_encoding():
+    """
+    Chooses the content encoding for the current request.
+
+    Returns
+    -------
+    str or None
+        The best encoding accepted by the client, or `None` if the
+        client does not accept any of the supported encodings.
+    """
+    return request.accept_encodings.best_match(list(ENCODINGS))
+
+
+def compress_response(response, level, min_size):
+    """
+    Compresses a response in place, if the client accepts it.
+
+    Parameters
+    ----------
+    response : Response
+        The response to compress.
+    level : int
+        The compression level.
+    min_size : int
+        The minimum body size to compress, in bytes.
+
+    Returns
+    -------
+    Response
+        The response.
+    """
+    # Only compress complete, successful, uncompressed bodies
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    # The body depends on the request headers, so caches must know
+    response.vary.add('Accept-Encoding')
+
+    if response.content_length is not None \
+            and response.content_length < min_size:
+        return response
+
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    # Use the compressed body stored on the cache entry, if there is one
+    entry = g.get('cache_entry')
+    body = entry.variants.get(encoding) if entry is not None else None
+    if body is None:
+        body = ENCODINGS[encoding](response.get_data(), level)
+        if entry is not None:
+            entry.variants[encoding] = body
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    """
+    Enables response compression for an application.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    """
+    level = app.config.setdefault('COMPRESS_LEVEL', 6)
+    min_size = app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, level, min_size)
@@ -0,0 +1,405 @@
+"""
+This module contains the deletion of users and posts.
+
+Deleting a user or a post through the ORM cascades loads every post,
+like, comment and follow depending on it into the session, and deletes
+them one row at a time in a single transaction, which holds locks for
+as long as that takes.
+
+Instead, `delete_user` and `delete_post` only soft delete the row, by
+setting its `deleted_at` column, and queue a job to purge it. A deleted
+user's posts are soft deleted with them. From then on the rows are
+hidden from every ORM query by `hide_deleted`, so the deletion is seen
+immediately. The job deletes the dependent rows in batches of
+`DELETION_BATCH_SIZE`, each in its own short transaction, and deletes
+the row itself last. A job that fails carries on from where
+it stopped when it is retried.
+
+The foreign keys of the dependent rows are declared `ON DELETE CASCADE`,
+so the database removes any row that the batches missed instead of
+refusing to delete its parent.
+"""
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, event, or_, update
+from sqlalchemy.orm import Session, with_loader_criteria
+
+from init import db
+from models.comment import Comment
+from models.follow import Follow
+from models.like import Like
+from models.post import Post
+from models.user import User
+from services import events, jobs, sharding, threads, versions
+
+
+# The criteria hiding soft deleted rows, added to every ORM query
+HIDE_DELETED = (
+    with_loader_criteria(User, lambda cls: cls.deleted_at.is_(None),
+                         include_aliases=True),
+    with_loader_criteria(Post, lambda cls: cls.deleted_at.is_(None),
+                         include_aliases=True),
+)
+
+
+def hide_deleted(execute_state):
+    """
+    Hides soft deleted users and posts from an ORM query.
+
+    Registered as a `do_orm_execute` listener. Queries executed with the
+    `include_deleted` execution option see every row, and refreshes of
+    rows already loaded are left alone.
+
+    Parameters
+    ----------
+    execute_state : ORMExecuteState
+        The query being executed.
+    """
+    if execute_state.is_select and not execute_state.is_column_load \
+            and not execute_state.execution_options.get('include_deleted'):
+        execute_state.statement = execute_state.statement.options(
+            *HIDE_DELETED)
+
+
+def _each_shard(shards=None):
+    """
+    Selects each of the given shards in turn, or none if sharding is
+    disabled.
+
+    Parameters
+    ----------
+    shards : iterable of int, optional
+        The shards. Defaults to every shard.
+
+    Yields
+    ------
+    int or None
+        The selected shard.
+    """
+    if not sharding.is_sharded():
+        yield None
+        return
+    for shard in range(sharding.shard_count()) if shards is None else shards:
+        with sharding.use_shard(shard):
+            yield shard
+
+
+def delete_in_batches(model, criteria, columns=(), order_by=None,
+                      on_batch=None):
+    """
+    Deletes the rows of a model matching some criteria, in batches.
+
+    Each batch is deleted and committed in its own transaction, so no
+    lock is held for long and no more than a batch of rows is ever
+    loaded.
+
+    Parameters
+    ----------
+    model : type
+        The model of the rows.
+    criteria : ColumnElement
+        The criteria of the rows to delete.
+    columns : tuple of Column, optional
+        The columns loaded with the IDs of each batch.
+    order_by : ColumnElement, optional
+        The order the rows are deleted in.
+    on_batch : callable, optional
+        Called with the rows of each batch before they are deleted, in
+        the same transaction. May return the number of other rows it
+        deleted.
+
+    Returns
+    -------
+    int
+        The number of rows deleted.
+    """
+    batch_size = current_app.config.get('DELETION_BATCH_SIZE', 500)
+    table = model.__table__
+    count = 0
+    while True:
+        query = db.select(model.id, *columns).where(criteria)
+        if order_by is not None:
+            query = query.order_by(order_by)
+        rows = db.session.execute(
+            query.limit(batch_size)
+            .execution_options(include_deleted=True)).all()
+        if not rows:
+            return count
+        if on_batch is not None:
+            count += on_batch(rows) or 0
+        db.session.execute(
+            delete(table).where(table.c.id.in_([row.id for row in rows])))
+        db.session.commit()
+        count += len(rows)
+
+
+def delete_comments(criteria, columns=(), on_batch=None):
+    """
+    Deletes the comments matching some criteria, in batches.
+
+    The comments are deleted in descending order of path, so that a
+    reply is always deleted before, or with, the comment it replies to,
+    and the database never cascades the deletion of a comment to an
+    unbounded number of replies.
+
+    Parameters
+    ----------
+    criteria : ColumnElement
+        The criteria of the comments to delete.
+    columns : tuple of Column, optional
+        The columns loaded with the IDs of each batch.
+    on_batch : callable, optional
+        Called with the rows of each batch before they are deleted.
+
+    Returns
+    -------
+    int
+        The number of comments deleted.
+    """
+    return delete_in_batches(Comment, criteria, columns=columns,
+                             order_by=Comment.path.desc(),
+                             on_batch=on_batch)
+
+
+def _bump_posts(rows):
+    """
+    Bumps the versions of the posts a batch of likes or comments were
+    on, and of their authors.
+    """
+    post_ids = {row.post_id for row in rows}
+    author_ids = db.session.execute(
+        db.select(Post.author_id).where(Post.id.in_(post_ids))
+        .distinct()).scalars().all()
+    versions.bump_posts(*post_ids)
+    versions.bump_users(*author_ids)
+
+
+def _likes_purged(rows):
+    """
+    Records the purge of a batch of likes, and bumps the posts they
+    were on.
+    """
+    events.record(events.LIKES_PURGED,
+                  post_ids=[row.post_id for row in rows])
+    _bump_posts(rows)
+
+
+def _comments_purged(rows):
+    """
+    Records the purge of a batch of comments.
+    """
+    events.record(events.COMMENTS_PURGED,
+                  comment_ids=[row.id for row in rows],
+                  post_ids=[row.post_id for row in rows])
+
+
+def _replies_purged(rows):
+    """
+    Records the purge of a batch of comments on other users' posts, and
+    bumps the posts they were on.
+    """
+    _comments_purged(rows)
+    _bump_posts(rows)
+
+
+def _user_comments_purged(rows):
+    """
+    Deletes the replies to a batch of a user's comments, then records
+    the purge of the batch.
+
+    Returns
+    -------
+    int
+        The number of replies deleted.
+    """
+    count = 0
+    for row in rows:
+        count += delete_comments(
+            threads.subtree(row.post_id, row.path, include_root=False),
+            columns=(Comment.post_id,), on_batch=_replies_purged)
+    _replies_purged(rows)
+    return count
+
+
+def _follows_purged(rows):
+    """
+    Bumps the users on both sides of a batch of follows, as they have
+    one less follower or follow one less user.
+    """
+    versions.bump_users(*{row.follower_id for row in rows},
+                        *{row.followed_id for row in rows})
+
+
+def _purge_posts(criteria):
+    """
+    Deletes the posts matching some criteria, with their likes and
+    comments, on the selected shard.
+
+    Returns
+    -------
+    int
+        The number of rows deleted.
+    """
+    return delete_in_batches(Post, criteria, on_batch=_purge_dependents)
+
+
+def _purge_dependents(rows):
+    """
+    Deletes the likes and comments on a batch of posts, then records the
+    purge of the batch.
+
+    Returns
+    -------
+    int
+        The number of likes and comments deleted.
+    """
+    post_ids = [row.id for row in rows]
+    count = delete_in_batches(Like, Like.post_id.in_(post_ids))
+    count += delete_comments(Comment.post_id.in_(post_ids),
+                             columns=(Comment.post_id,),
+                             on_batch=_comments_purged)
+    events.record(events.POSTS_PURGED, post_ids=post_ids)
+    return count
+
+
+def delete_user(user):
+    """
+    Soft deletes a user and their posts, and queues the purge of their
+    data, in the current transaction.
+
+    Parameters
+    ----------
+    user : User
+        The user to delete.
+
+    Returns
+    -------
+    Job
+        The job purging the user.
+    """
+    user.deleted_at = datetime.now()
+
+    # Hide the user's posts with them, with one update on their shard
+    table = Post.__table__
+    for _ in _each_shard(sharding.shards_for_authors([user.id])):
+        db.session.execute(update(table).where(
+            table.c.author_id == user.id, table.c.deleted_at.is_(None))
+            .values(deleted_at=user.deleted_at))
+    events.record(events.USER_DELETED, user_id=user.id)
+    return jobs.enqueue(purge_user, user_id=user.id)
+
+
+def delete_post(post):
+    """
+    Soft deletes a post, and queues its purge, in the current
+    transaction.
+
+    Parameters
+    ----------
+    post : Post
+        The post to delete.
+
+    Returns
+    -------
+    Job
+        The job purging the post.
+    """
+    post.deleted_at = datetime.now()
+    events.record(events.POST_DELETED, post_id=post.id,
+                  author_id=post.author_id)
+
+    # The author's profile and timeline have changed
+    versions.bump_users(post.author_id)
+    return jobs.enqueue(purge_post, post_id=post.id)
+
+
+@jobs.task(name='deletion.purge_user')
+def purge_user(user_id):
+    """
+    Deletes a soft deleted user with their posts, likes, comments and
+    follows, in batches.
+
+    The user's posts are purged first, as they are the most visible.
+    Does nothing if the user has not been soft deleted, or has already
+    been purged.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user.
+
+    Returns
+    -------
+    int
+        The number of rows deleted.
+    """
+    deleted_at = db.session.execute(
+        db.select(User.deleted_at).where(User.id == user_id)
+        .execution_options(include_deleted=True)).scalar()
+    if deleted_at is None:
+        return 0
+
+    count = 0
+    for _ in _each_shard(sharding.shards_for_authors([user_id])):
+        count += _purge_posts(Post.author_id == user_id)
+    for _ in _each_shard():
+        count += delete_in_batches(Like, Like.user_id == user_id,
+                                   columns=(Like.post_id,),
+                                   on_batch=_likes_purged)
+        count += delete_comments(Comment.user_id == user_id,
+                                 columns=(Comment.post_id, Comment.path),
+                                 on_batch=_user_comments_purged)
+    count += delete_in_batches(
+        Follow, or_(Follow.follower_id == user_id,
+                    Follow.followed_id == user_id),
+        columns=(Follow.follower_id, Follow.followed_id),
+        on_batch=_follows_purged)
+
+    db.session.execute(delete(User.__table__)
+                       .where(User.__table__.c.id == user_id))
+    db.session.commit()
+    return count + 1
+
+
+@jobs.task(name='deletion.purge_post')
+def purge_post(post_id):
+    """
+    Deletes a soft deleted post with its likes and comments, in batches.
+
+    Does nothing if the post has not been soft deleted, or has already
+    been purged.
+
+    Parameters
+    ----------
+    post_id : int
+        The ID of the post.
+
+    Returns
+    -------
+    int
+        The number of rows deleted.
+    """
+    shards = [sharding.shard_for_id(post_id)] if sharding.is_sharded() \
+        else None
+    count = 0
+    for _ in _each_shard(shards):
+        deleted_at = db.session.execute(
+            db.select(Post.deleted_at).where(Post.id == post_id)
+            .execution_options(include_deleted=True)).scalar()
+        if deleted_at is not None:
+            count += _purge_posts(Post.id == post_id)
+    return count
+
+
+def init_app(_app):
+    """
+    Hides soft deleted users and posts from the application's queries.
+
+    Parameters
+    ----------
+    _app : Flask
+        The application.
+    """
+    if not event.contains(Session, 'do_orm_execute', hide_deleted):
+        event.listen(Session, 'do_orm_execute', hide_deleted)
@@ -0,0 +1,325 @@
+"""
+This module contains the transactional outbox of domain events.
+
+Controllers call `record` to write an event, such as `PostCreated`, to
+the `outbox_events` table in the same transaction as the change it
+describes. An event exists exactly when its change was committed, and
+recording one costs a single insert in the request.
+
+Consumers are functions registered with the `consumer` decorator. The
+dispatcher started by `flask cli run_worker` tails the outbox and calls
+each consumer with batches of the events it subscribes to, so that
+consumers can process many changes with a few bulk statements.
+
+Each consumer has its own cursor in the `outbox_cursors` table, which is
+moved forward in the same transaction as the consumer's own changes. A
+consumer that raises gets the same batch again on the next poll, and
+doesn't hold up the other consumers. Delivery is at least once, so
+consumers with effects outside the database must be idempotent.
+
+Event IDs can be committed out of order by concurrent transactions. The
+dispatcher stops at a gap in the IDs until the missing event has
+committed, or until the gap is older than `OUTBOX_GAP_TIMEOUT` seconds
+and the transaction is presumed to have rolled back.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import insert
+
+from init import db
+from models.outbox import OutboxCursor, OutboxEvent
+
+
+logger = logging.getLogger(__name__)
+
+# The event types
+POST_CREATED = 'PostCreated'
+POST_UPDATED = 'PostUpdated'
+POST_DELETED = 'PostDeleted'
+POST_LIKED = 'PostLiked'
+POST_UNLIKED = 'PostUnliked'
+COMMENT_CREATED = 'CommentCreated'
+COMMENT_UPDATED = 'CommentUpdated'
+COMMENT_DELETED = 'CommentDeleted'
+USER_FOLLOWED = 'UserFollowed'
+USER_UNFOLLOWED = 'UserUnfollowed'
+USER_DELETED = 'UserDeleted'
+
+# The event types recorded when likes, comments and posts are deleted in
+# bulk, with a user, a post or the comment they reply to, one per batch
+# of rows
+POSTS_PURGED = 'PostsPurged'
+COMMENTS_PURGED = 'CommentsPurged'
+LIKES_PURGED = 'LikesPurged'
+
+EVENT_TYPES = frozenset({
+    POST_CREATED, POST_UPDATED, POST_DELETED, POST_LIKED, POST_UNLIKED,
+    COMMENT_CREATED, COMMENT_UPDATED, COMMENT_DELETED,
+    USER_FOLLOWED, USER_UNFOLLOWED, USER_DELETED,
+    POSTS_PURGED, COMMENTS_PURGED, LIKES_PURGED,
+})
+
+# Seconds between prunings of the events every consumer has processed
+PRUNE_INTERVAL = 60.0
+
+# The consumers, by name, with the event types they subscribe to
+_consumers = {}
+
+
+def consumer(*event_types, name=None):
+    """
+    Registers a function as a consumer of some types of event.
+
+    The function is called with a list of `OutboxEvent`, in the order
+    they were recorded, in an application context. Its changes to the
+    database are committed with its cursor.
+
+    Parameters
+    ----------
+    event_types : str
+        The types of event to receive.
+    name : str, optional
+        The name of the consumer's cursor. Defaults to the function's
+        module and name.
+
+    Returns
+    -------
+    function
+        The decorator.
+    """
+    unknown = set(event_types) - EVENT_TYPES
+    if unknown:
+        raise ValueError(f"Unknown event types {', '.join(sorted(unknown))}")
+
+    def decorator(fn):
+        _consumers[name or f'{fn.__module__}.{fn.__name__}'] = (
+            fn, frozenset(event_types))
+        return fn
+    return decorator
+
+
+def make_event(event_type, **payload):
+    """
+    Returns a new event, to be added to a session.
+
+    Parameters
+    ----------
+    event_type : str
+        The type of the event.
+    payload
+        The JSON serializable data describing the change.
+
+    Returns
+    -------
+    OutboxEvent
+        The event.
+    """
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Unknown event type {event_type}")
+    return OutboxEvent(type=event_type, payload=payload,
+                       created_at=datetime.now())
+
+
+def record(event_type, **payload):
+    """
+    Records an event in the current transaction.
+
+    Parameters
+    ----------
+    event_type : str
+        The type of the event.
+    payload
+        The JSON serializable data describing the change.
+    """
+    db.session.add(make_event(event_type, **payload))
+
+
+def record_many(event_type, payloads):
+    """
+    Records events of one type in the current transaction, with a single
+    multi-row insert.
+
+    Parameters
+    ----------
+    event_type : str
+        The type of the events.
+    payloads : list of dict
+        The JSON serializable data describing each change.
+    """
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Unknown event type {event_type}")
+    if not payloads:
+        return
+    created_at = datetime.now()
+    db.session.execute(insert(OutboxEvent.__table__).values([
+        {'type': event_type, 'payload': payload, 'created_at': created_at}
+        for payload in payloads]))
+
+
+def settled(events, last_id, gap_timeout):
+    """
+    Returns the leading events that can be delivered without skipping
+    an event that may still be committed.
+
+    Parameters
+    ----------
+    events : list of OutboxEvent
+        The events after the cursor, in ID order.
+    last_id : int
+        The ID of the last event delivered.
+    gap_timeout : float
+        The number of seconds after which a gap in the IDs is presumed
+        to be a rolled back transaction.
+
+    Returns
+    -------
+    list of OutboxEvent
+        The events that can be delivered.
+    """
+    oldest_gap = datetime.now() - timedelta(seconds=gap_timeout)
+    expected = last_id + 1
+    for index, event in enumerate(events):
+        if event.id != expected and event.created_at > oldest_gap:
+            return events[:index]
+        expected = event.id + 1
+    return events
+
+
+def dispatch(name, batch_size=None):
+    """
+    Delivers the next batch of events to a consumer.
+
+    Parameters
+    ----------
+    name : str
+        The name of the consumer.
+    batch_size : int, optional
+        The maximum number of events read. Defaults to
+        `OUTBOX_BATCH_SIZE`.
+
+    Returns
+    -------
+    int
+        The number of events the cursor moved past.
+    """
+    fn, event_types = _consumers[name]
+    config = current_app.config
+    batch_size = batch_size or config.get('OUTBOX_BATCH_SIZE', 500)
+
+    # Lock the cursor, so that only one dispatcher delivers to a consumer
+    cursor = db.session.execute(
+        db.select(OutboxCursor).where(OutboxCursor.consumer == name)
+        .with_for_update()).scalar()
+    if cursor is None:
+        cursor = OutboxCursor(consumer=name, last_id=0)
+        db.session.add(cursor)
+
+    events = db.session.execute(
+        db.select(OutboxEvent).where(OutboxEvent.id > cursor.last_id)
+        .order_by(OutboxEvent.id).limit(batch_size)).scalars().all()
+    events = settled(events, cursor.last_id,
+                     config.get('OUTBOX_GAP_TIMEOUT', 30))
+    if not events:
+        db.session.rollback()
+        return 0
+
+    matching = [event for event in events if event.type in event_types]
+    if matching:
+        fn(matching)
+    cursor.last_id = events[-1].id
+    cursor.updated_at = datetime.now()
+    db.session.commit()
+    return len(events)
+
+
+def dispatch_all():
+    """
+    Delivers the next batch of events to every consumer.
+
+    Returns
+    -------
+    int
+        The total number of events the cursors moved past.
+    """
+    count = 0
+    for name in list(_consumers):
+        try:
+            count += dispatch(name)
+        except Exception:  # pylint: disable=broad-except
+            db.session.rollback()
+            logger.exception("Consumer %s failed", name)
+    return count
+
+
+def prune(retention):
+    """
+    Deletes the events every consumer has processed, once they are more
+    than `retention` seconds old.
+
+    Returns
+    -------
+    int
+        The number of events deleted.
+    """
+    names = list(_consumers)
+    cursors = db.session.execute(
+        db.select(OutboxCursor.last_id)
+        .where(OutboxCursor.consumer.in_(names))).scalars().all()
+    if len(cursors) < len(names):
+        db.session.rollback()
+        return 0
+    count = db.session.execute(
+        db.delete(OutboxEvent)
+        .where(OutboxEvent.id <= min(cursors, default=0),
+               OutboxEvent.created_at
+               < datetime.now() - timedelta(seconds=retention))
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return count
+
+
+class Dispatcher:
+    """
+    A thread tailing the outbox and delivering events to consumers.
+
+    Attributes
+    ----------
+    app : Flask
+        The application the consumers run in.
+    burst : bool
+        If the dispatcher stops once every event has been delivered,
+        instead of waiting for more.
+    """
+
+    def __init__(self, app, burst=False):
+        self.app = app
+        self.burst = burst
+        self.stopping = threading.Event()
+        self._pruned = 0.0
+
+    def stop(self):
+        """
+        Stops the dispatcher once its current batch has been delivered.
+        """
+        self.stopping.set()
+
+    def run(self):
+        """
+        Delivers events until the dispatcher stops.
+        """
+        config = self.app.config
+        poll_interval = config.get('OUTBOX_POLL_INTERVAL', 1.0)
+        while not self.stopping.is_set():
+            with self.app.app_context():
+                if time.monotonic() - self._pruned > PRUNE_INTERVAL:
+                    self._pruned = time.monotonic()
+                    prune(config.get('OUTBOX_RETENTION', 86400))
+                if dispatch_all():
+                    continue
+            if self.burst:
+                return
+            self.stopping.wait(poll_interval)
@@ -0,0 +1,304 @@
+"""
+This module contains the detection and caching of hot posts and users.
+
+Every post, like and profile request is counted by a heavy-hitter
+tracker: a count-min sketch estimates how often each key was requested
+in fixed memory, however many keys there are, and the keys with the
+highest estimates are kept in a small top-K table. Every
+`HOT_KEY_WINDOW` seconds all counts are halved, so the counts follow
+recent traffic and a key stops being hot once its traffic dies down.
+
+Views decorated with `hot_cached` serve the requests for keys counted
+at least `HOT_KEY_THRESHOLD` times from a separate cache tier, whose
+entries live for `HOT_KEY_TTL` seconds instead of the few seconds of
+the response cache. The entries are keyed by ETag, so they are never
+stale. They are refreshed ahead of their expiry: the first request in
+the last quarter of an entry's life runs the view again while the
+others are still served the entry, so a hot key never misses.
+
+The counts are kept per process.
+"""
+import time
+from functools import wraps
+from threading import Lock
+
+from flask import current_app, g, make_response, request
+
+from services.cache import CacheEntry, ResponseCache, in_batch
+from services.negotiation import response_format
+
+
+# The number of counters in each row of the sketch
+SKETCH_WIDTH = 2048
+
+# The number of rows of the sketch, each hashing keys differently
+SKETCH_DEPTH = 4
+
+# The fraction of an entry's life after which it is refreshed
+REFRESH_AHEAD = 0.75
+
+# The cache of the responses for hot keys
+hot_cache = ResponseCache()
+
+
+class CountMinSketch:
+    """
+    Estimates how often each key was added, in fixed memory.
+
+    An estimate is never lower than the true count, and only higher
+    when other keys share all of its counters.
+
+    Parameters
+    ----------
+    width : int
+        The number of counters in each row.
+    depth : int
+        The number of rows.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def add(self, key):
+        """
+        Counts a key.
+
+        Parameters
+        ----------
+        key : str
+            The key.
+
+        Returns
+        -------
+        int
+            The estimated count of the key, including this one.
+        """
+        estimate = None
+        for seed, row in enumerate(self.rows):
+            index = hash((seed, key)) % self.width
+            row[index] += 1
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def halve(self):
+        """
+        Halves every count.
+        """
+        for row in self.rows:
+            for index, count in enumerate(row):
+                if count:
+                    row[index] = count >> 1
+
+
+class HeavyHitters:
+    """
+    A thread-safe tracker of the most requested keys.
+
+    Parameters
+    ----------
+    capacity : int
+        The number of keys in the top-K table.
+    window : float
+        The number of seconds after which every count is halved.
+    """
+
+    def __init__(self, capacity, window):
+        self.capacity = capacity
+        self.window = window
+        self.sketch = CountMinSketch()
+        self.top = {}
+        self.decayed = time.monotonic()
+        self.lock = Lock()
+
+    def _decay(self, now):
+        """
+        Halves every count once per window.
+        """
+        if now - self.decayed < self.window:
+            return
+        self.decayed = now
+        self.sketch.halve()
+        self.top = {key: count >> 1 for key, count in self.top.items()
+                    if count > 1}
+
+    def record(self, key):
+        """
+        Counts a request for a key.
+
+        Parameters
+        ----------
+        key : str
+            The key.
+
+        Returns
+        -------
+        int
+            The estimated recent count of the key.
+        """
+        with self.lock:
+            self._decay(time.monotonic())
+            count = self.sketch.add(key)
+            if key in self.top or len(self.top) < self.capacity:
+                self.top[key] = count
+                return count
+            # Replace the least requested key, if this one overtook it
+            coldest = min(self.top, key=self.top.get)
+            if count > self.top[coldest]:
+                del self.top[coldest]
+                self.top[key] = count
+            return count
+
+    def count(self, key):
+        """
+        Returns the recent count of a key in the top-K table, or 0.
+        """
+        return self.top.get(key, 0)
+
+    def hottest(self):
+        """
+        Returns the keys in the top-K table, with their recent counts,
+        most requested first.
+        """
+        with self.lock:
+            self._decay(time.monotonic())
+            return sorted(self.top.items(), key=lambda item: -item[1])
+
+
+def tracker():
+    """
+    Returns the heavy-hitter tracker of the current application.
+    """
+    return current_app.extensions['hot_keys']
+
+
+def is_hot(key):
+    """
+    Returns if a key was recently requested often enough to be hot.
+    """
+    return tracker().count(key) >= current_app.config['HOT_KEY_THRESHOLD']
+
+
+def record(kind, key_id):
+    """
+    Counts a request for a post or user.
+
+    Parameters
+    ----------
+    kind : str
+        `post` or `user`.
+    key_id : int or str
+        The ID of the post or user.
+
+    Returns
+    -------
+    str
+        The key counted.
+    """
+    key = f'{kind}:{key_id}'
+    tracker().record(key)
+    return key
+
+
+class _Refreshes:
+    """
+    The hot cache entries being refreshed, so that only one request
+    refreshes each.
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.lock = Lock()
+
+    def claim(self, key):
+        """
+        Claims the refresh of an entry, returning if it was claimed.
+        """
+        with self.lock:
+            if key in self.keys:
+                return False
+            self.keys.add(key)
+            return True
+
+    def release(self, key):
+        """
+        Releases the refresh of an entry.
+        """
+        with self.lock:
+            self.keys.discard(key)
+
+
+_refreshes = _Refreshes()
+
+
+def hot_cached(kind, arg):
+    """
+    Counts the requests to the decorated view by post or user, and
+    serves those for hot keys from the hot cache tier.
+
+    Must be applied below `versions.conditional`, so that entries are
+    keyed by the ETag, and above `cache.cached_response`, so that every
+    request is counted.
+
+    Parameters
+    ----------
+    kind : str
+        `post` or `user`.
+    arg : str
+        The name of the view argument holding the ID.
+
+    Returns
+    -------
+    function
+        The decorator.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def decorated_function(*args, **kwargs):
+            key = record(kind, kwargs[arg])
+            if not is_hot(key) or in_batch():
+                return fn(*args, **kwargs)
+
+            ttl = current_app.config['HOT_KEY_TTL']
+            cache_key = (request.full_path, response_format(), g.get('etag'))
+            entry = hot_cache.get(cache_key)
+            now = time.monotonic()
+            refresh = entry is not None \
+                and entry.expires - now < ttl * (1 - REFRESH_AHEAD) \
+                and _refreshes.claim(cache_key)
+            if entry is not None and not refresh:
+                # Let the compression service reuse the compressed bodies
+                g.cache_entry = entry
+                g.post_ids = entry.post_ids
+                return entry.to_response()
+
+            try:
+                response = make_response(fn(*args, **kwargs))
+            finally:
+                if refresh:
+                    _refreshes.release(cache_key)
+            if response.status_code == 200 and not response.is_streamed:
+                entry = CacheEntry.from_response(response, now + ttl)
+                hot_cache.set(cache_key, entry)
+                g.cache_entry = entry
+            return response
+        return decorated_function
+    return decorator
+
+
+def init_app(app):
+    """
+    Starts counting the requests for posts and users of an application.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    """
+    app.config.setdefault('HOT_KEY_THRESHOLD', 100)
+    app.config.setdefault('HOT_KEY_WINDOW', 60)
+    app.config.setdefault('HOT_KEY_TTL', 60)
+    app.config.setdefault('HOT_KEY_CAPACITY', 100)
+    app.extensions['hot_keys'] = HeavyHitters(
+        app.config['HOT_KEY_CAPACITY'], app.config['HOT_KEY_WINDOW'])
@@ -0,0 +1,135 @@
+"""
+This module contains a HyperLogLog sketch, which estimates the number of
+distinct items added to it in fixed memory.
+
+Each item is hashed to 64 bits. The first `PRECISION` bits pick one of
+the sketch's registers, which keeps the longest run of leading zeros
+seen in the rest of the hashes it was picked for. Long runs are rare,
+so the registers together estimate how many distinct hashes were seen,
+within about 3% with 1024 registers.
+
+Adding an item twice changes nothing, and two sketches are merged by
+keeping the largest of each of their registers, so a sketch can be
+built up in memory and merged into a stored one without ever counting
+the same item twice.
+"""
+import hashlib
+import math
+import zlib
+
+
+# The number of bits of a hash picking its register
+PRECISION = 10
+
+# The number of registers of a sketch
+REGISTERS = 1 << PRECISION
+
+# The number of bits of a hash after the register bits
+RANK_BITS = 64 - PRECISION
+
+# The bias correction of the estimate for `REGISTERS` registers
+ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+def hash_item(item):
+    """
+    Hashes an item to the register it picks and the rank stored in it.
+
+    Parameters
+    ----------
+    item : object
+        The item, hashed by its string representation, so that every
+        process hashes it the same way.
+
+    Returns
+    -------
+    tuple of int
+        The register and the rank.
+    """
+    value = int.from_bytes(
+        hashlib.blake2b(str(item).encode(), digest_size=8).digest(), 'big')
+    rest = value & ((1 << RANK_BITS) - 1)
+    return value >> RANK_BITS, RANK_BITS - rest.bit_length() + 1
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct items added to it.
+
+    Parameters
+    ----------
+    registers : bytes, optional
+        The registers of an existing sketch.
+    """
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers or REGISTERS)
+
+    def add_hash(self, hashed):
+        """
+        Adds an item already hashed with `hash_item`.
+
+        Parameters
+        ----------
+        hashed : tuple of int
+            The register and rank of the item.
+        """
+        index, rank = hashed
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add(self, item):
+        """
+        Adds an item.
+
+        Parameters
+        ----------
+        item : object
+            The item.
+        """
+        self.add_hash(hash_item(item))
+
+    def merge(self, other):
+        """
+        Adds every item of another sketch to this one.
+
+        Parameters
+        ----------
+        other : HyperLogLog
+            The other sketch.
+        """
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        """
+        Estimates the number of distinct items added.
+
+        Returns
+        -------
+        int
+            The estimate.
+        """
+        total = math.fsum(2.0 ** -rank for rank in self.registers)
+        estimate = ALPHA * REGISTERS * REGISTERS / total
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # Count the empty registers instead, which is more accurate
+            # for small numbers of items
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        """
+        Returns the sketch compressed for storage.
+
+        The registers of a sketch with few items are mostly empty, so it
+        compresses to a few bytes.
+        """
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Returns a sketch stored with `to_bytes`, or an empty one.
+        """
+        return cls(zlib.decompress(data) if data else None)
@@ -0,0 +1,384 @@
+"""
+This module contains the background job queue.
+
+Slow work is handed off to a worker with `enqueue`, which adds a row to
+the `jobs` table in the current transaction. The job exists exactly when
+the changes that asked for it are committed, and the request can
+respond without waiting for it. No broker is needed: workers started
+with `flask cli run_worker` poll the table.
+
+Functions are made into tasks with the `task` decorator, and must be
+imported by the application so that workers can find them by name.
+
+Jobs run in priority lanes, `high`, `default` and `low`. A worker always
+takes the oldest due job from the highest lane it serves. Start a
+worker with `--lanes low` to make sure low priority jobs progress while
+the higher lanes are busy.
+
+A job that raises is retried with exponential backoff, up to its
+`max_attempts`, and is then marked as failed with its last error. A job
+whose worker died while running it is queued again once its lock is
+older than `JOB_LOCK_TIMEOUT` seconds.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, update
+
+from init import db
+from models.job import Job
+
+
+logger = logging.getLogger(__name__)
+
+# The priority lanes, highest first
+LANES = ('high', 'default', 'low')
+
+# The delay before the first retry, and the longest delay, in seconds
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 600.0
+
+# Seconds between checks for stale locks and old finished jobs
+MAINTENANCE_INTERVAL = 60.0
+
+# The number of candidate jobs tried when claiming one
+CLAIM_ATTEMPTS = 5
+
+# The error of the jobs whose worker stopped while running them
+STALE_ERROR = "WorkerLost: the worker stopped while running the job"
+
+# The tasks, by name
+_tasks = {}
+
+
+def task(name=None, lane='default', max_attempts=None):
+    """
+    Registers a function as a task that can be run by a worker.
+
+    The function is called with the keyword arguments given to
+    `enqueue`, in an application context.
+
+    Parameters
+    ----------
+    name : str, optional
+        The name of the task. Defaults to the function's module and name.
+    lane : str, optional
+        The default priority lane of the task's jobs.
+    max_attempts : int, optional
+        The number of times a job is started before it is failed.
+        Defaults to `JOB_MAX_ATTEMPTS`.
+
+    Returns
+    -------
+    function
+        The decorator.
+    """
+    if lane not in LANES:
+        raise ValueError(f"Unknown lane {lane}")
+
+    def decorator(fn):
+        fn.task_name = name or f'{fn.__module__}.{fn.__name__}'
+        fn.task_lane = lane
+        fn.task_max_attempts = max_attempts
+        _tasks[fn.task_name] = fn
+        return fn
+    return decorator
+
+
+def enqueue(fn, lane=None, delay=0, **kwargs):
+    """
+    Queues a job running a task, in the current transaction.
+
+    The job is committed with the rest of the session, and can't be run
+    before then.
+
+    Parameters
+    ----------
+    fn : function
+        The task to run.
+    lane : str, optional
+        The priority lane. Defaults to the task's lane.
+    delay : float, optional
+        The number of seconds to wait before running the job.
+    kwargs
+        The JSON serializable keyword arguments to call the task with.
+
+    Returns
+    -------
+    Job
+        The queued job.
+    """
+    lane = lane or fn.task_lane
+    if lane not in LANES:
+        raise ValueError(f"Unknown lane {lane}")
+    now = datetime.now()
+    job = Job(name=fn.task_name, payload=kwargs, lane=lane,
+              max_attempts=fn.task_max_attempts
+              or current_app.config.get('JOB_MAX_ATTEMPTS', 5),
+              run_at=now + timedelta(seconds=delay), created_at=now)
+    db.session.add(job)
+    return job
+
+
+def backoff(attempts):
+    """
+    Returns the delay before retrying a job, in seconds.
+
+    The delay doubles with each attempt, with jitter so that jobs that
+    failed together are not all retried together.
+
+    Parameters
+    ----------
+    attempts : int
+        The number of times the job has been started.
+
+    Returns
+    -------
+    float
+        The delay in seconds.
+    """
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim(worker_name, lanes=LANES):
+    """
+    Claims the next due job for a worker.
+
+    The job is marked as running in its own transaction, so no other
+    worker can claim it.
+
+    Parameters
+    ----------
+    worker_name : str
+        The name of the claiming worker.
+    lanes : iterable of str
+        The lanes the worker serves.
+
+    Returns
+    -------
+    int or None
+        The ID of the claimed job, or `None` if no job is due.
+    """
+    lane_order = case({lane: index for index, lane in enumerate(LANES)},
+                      value=Job.lane)
+    for _ in range(CLAIM_ATTEMPTS):
+        now = datetime.now()
+        job_id = db.session.execute(
+            db.select(Job.id)
+            .where(Job.status == 'queued', Job.lane.in_(lanes),
+                   Job.run_at <= now)
+            .order_by(lane_order, Job.run_at, Job.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+
+        # Only one worker can move the job from queued to running
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', locked_by=worker_name, locked_at=now,
+                    attempts=Job.attempts + 1)
+            .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+    return None
+
+
+def run(job_id):
+    """
+    Runs a claimed job.
+
+    On success, the job is marked as done in the same transaction as
+    the task's own changes. On failure, the task's changes are rolled
+    back and the job is retried later, or failed.
+
+    Parameters
+    ----------
+    job_id : int
+        The ID of the claimed job.
+
+    Returns
+    -------
+    bool
+        If the job succeeded.
+    """
+    job = db.session.get(Job, job_id)
+    try:
+        fn = _tasks.get(job.name)
+        if fn is None:
+            raise LookupError(f"No task named {job.name}")
+        fn(**job.payload)
+        job.status = 'done'
+        job.locked_by = None
+        job.finished_at = datetime.now()
+        db.session.commit()
+        return True
+    except Exception as e:  # pylint: disable=broad-except
+        db.session.rollback()
+        logger.exception("Job %s (%s) failed", job_id, job.name)
+        job = db.session.get(Job, job_id)
+        job.last_error = f"{type(e).__name__}: {e}"
+        job.locked_by = None
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.now()
+        else:
+            job.status = 'queued'
+            job.run_at = datetime.now() + timedelta(
+                seconds=backoff(job.attempts))
+        db.session.commit()
+        return False
+
+
+def requeue_stale(lock_timeout):
+    """
+    Queues again the running jobs whose worker has stopped, or fails
+    those which have used up their attempts, so that a job which keeps
+    killing its worker isn't retried forever.
+
+    Parameters
+    ----------
+    lock_timeout : float
+        The number of seconds after which a running job's worker is
+        presumed dead.
+
+    Returns
+    -------
+    tuple of (int, int)
+        The number of jobs queued again, and the number failed.
+    """
+    now = datetime.now()
+    stale = (Job.status == 'running',
+             Job.locked_at < now - timedelta(seconds=lock_timeout))
+    failed = db.session.execute(
+        update(Job)
+        .where(*stale, Job.attempts >= Job.max_attempts)
+        .values(status='failed', locked_by=None, finished_at=now,
+                last_error=STALE_ERROR)
+        .execution_options(synchronize_session=False)).rowcount
+    requeued = db.session.execute(
+        update(Job)
+        .where(*stale)
+        .values(status='queued', locked_by=None, run_at=now)
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return requeued, failed
+
+
+def prune(retention):
+    """
+    Deletes the jobs that finished more than `retention` seconds ago.
+
+    Returns
+    -------
+    int
+        The number of jobs deleted.
+    """
+    count = db.session.execute(
+        db.delete(Job)
+        .where(Job.status.in_(('done', 'failed')),
+               Job.finished_at < datetime.now() - timedelta(seconds=retention))
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return count
+
+
+class Worker:
+    """
+    A pool of threads running queued jobs.
+
+    Attributes
+    ----------
+    app : Flask
+        The application the jobs run in.
+    lanes : tuple of str
+        The lanes the worker serves.
+    threads : int
+        The number of jobs run at the same time.
+    burst : bool
+        If the worker stops once no job is due, instead of waiting for
+        more.
+    name : str
+        The name of the worker, recorded on the jobs it claims.
+    """
+
+    def __init__(self, app, lanes=LANES, threads=4, burst=False):
+        unknown = set(lanes) - set(LANES)
+        if unknown:
+            raise ValueError(f"Unknown lanes {', '.join(sorted(unknown))}")
+        self.app = app
+        self.lanes = tuple(lanes)
+        self.threads = threads
+        self.burst = burst
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+        self._maintained = 0.0
+        self._lock = threading.Lock()
+
+    def stop(self):
+        """
+        Stops the worker once its running jobs have finished.
+        """
+        self.stopping.set()
+
+    def maintain(self):
+        """
+        Queues stale jobs again and prunes old ones, at most once every
+        `MAINTENANCE_INTERVAL` seconds across the worker's threads.
+        """
+        with self._lock:
+            if time.monotonic() - self._maintained < MAINTENANCE_INTERVAL:
+                return
+            self._maintained = time.monotonic()
+        config = self.app.config
+        requeued, failed = requeue_stale(config.get('JOB_LOCK_TIMEOUT', 300))
+        if requeued:
+            logger.warning("Queued %s stale jobs again", requeued)
+        if failed:
+            logger.error("Failed %s stale jobs out of attempts", failed)
+        prune(config.get('JOB_RETENTION', 86400))
+
+    def work(self, index):
+        """
+        Runs jobs in one thread until the worker stops.
+        """
+        name = f'{self.name}:{index}'
+        poll_interval = self.app.config.get('JOB_POLL_INTERVAL', 1.0)
+        while not self.stopping.is_set():
+            with self.app.app_context():
+                self.maintain()
+                job_id = claim(name, self.lanes)
+                if job_id is not None:
+                    run(job_id)
+                    continue
+            if self.burst:
+                return
+            self.stopping.wait(poll_interval)
+
+    def run(self):
+        """
+        Starts the worker's threads and waits for them to stop.
+        """
+        threads = [threading.Thread(target=self.work, args=(index,),
+                                    name=f'worker-{index}', daemon=True)
+                   for index in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,231 @@
+"""
+This module contains content negotiation between JSON and MessagePack.
+
+Clients that send `Accept: application/msgpack` receive MessagePack
+instead of JSON from every endpoint. Both formats are produced by
+`NegotiatingProvider.response`, which is the single path Flask uses to
+turn the dicts and lists returned by views into responses. Datetimes
+are encoded as MessagePack timestamps rather than ISO strings.
+
+Requests with `Content-Type: application/msgpack` are decoded by
+`NegotiatingRequest`, so `request.json` works the same for both formats.
+
+MessagePack support requires the optional `msgpack` package. Without
+it, every response is JSON.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from flask.wrappers import Request
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# Mimetypes accepted for MessagePack request bodies
+MSGPACK_MIMETYPES = {MSGPACK_MIMETYPE, 'application/x-msgpack'}
+
+
+def prefers_msgpack(accept_mimetypes):
+    """
+    Returns if a client prefers MessagePack to JSON.
+
+    JSON is preferred when the client accepts both equally.
+
+    Parameters
+    ----------
+    accept_mimetypes : MIMEAccept
+        The parsed `Accept` header of the request.
+
+    Returns
+    -------
+    bool
+        If the response should be MessagePack.
+    """
+    if msgpack is None:
+        return False
+    best = accept_mimetypes.best_match(
+        [JSON_MIMETYPE, MSGPACK_MIMETYPE, 'application/x-msgpack'])
+    return best in MSGPACK_MIMETYPES
+
+
+def wants_msgpack():
+    """
+    Returns if the current request should be answered with MessagePack.
+
+    The decision is made once per request, from the `Accept` header.
+
+    Returns
+    -------
+    bool
+        If the response should be MessagePack.
+    """
+    if msgpack is None or not has_request_context():
+        return False
+    if 'wants_msgpack' not in g:
+        g.wants_msgpack = prefers_msgpack(request.accept_mimetypes)
+    return g.wants_msgpack
+
+
+def response_format():
+    """
+    Returns the name of the format of the current response.
+
+    Returns
+    -------
+    str
+        Either `json` or `msgpack`.
+    """
+    return 'msgpack' if wants_msgpack() else 'json'
+
+
+def _default(value):
+    """
+    Encodes the values MessagePack does not support natively.
+    """
+    if isinstance(value, datetime):
+        # Naive datetimes are in local time, as created by datetime.now()
+        if value.tzinfo is None:
+            value = value.astimezone()
+        return msgpack.Timestamp.from_datetime(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} "
+                    f"is not MessagePack serializable")
+
+
+def packb(obj):
+    """
+    Encodes an object as MessagePack.
+
+    Parameters
+    ----------
+    obj : object
+        The object to encode.
+
+    Returns
+    -------
+    bytes
+        The encoded object.
+    """
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+
+def unpackb(data):
+    """
+    Decodes MessagePack data, with timestamps decoded as datetimes.
+
+    Parameters
+    ----------
+    data : bytes
+        The data to decode.
+
+    Returns
+    -------
+    object
+        The decoded object.
+    """
+    return msgpack.unpackb(data, raw=False, timestamp=3)
+
+
+class NegotiatingProvider(DefaultJSONProvider):
+    """
+    JSON provider that answers with MessagePack when the client asks.
+    """
+
+    def response(self, *args, **kwargs):
+        """
+        Serializes the given arguments as JSON or MessagePack, and
+        returns a response with the matching mimetype.
+
+        Returns
+        -------
+        Response
+            The response.
+        """
+        if not wants_msgpack():
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(packb(obj), mimetype=MSGPACK_MIMETYPE)
+
+
+class NegotiatingRequest(Request):
+    """
+    Request that decodes MessagePack bodies as well as JSON bodies.
+    """
+
+    @property
+    def is_msgpack(self):
+        """
+        If the request body is MessagePack.
+        """
+        return msgpack is not None and self.mimetype in MSGPACK_MIMETYPES
+
+    def get_json(self, force=False, silent=False, cache=True):
+        """
+        Parses the request body as JSON, or MessagePack if the mimetype
+        says so.
+
+        Parameters
+        ----------
+        force : bool
+            Ignore the mimetype and always try to parse JSON.
+        silent : bool
+            Return `None` instead of raising on errors.
+        cache : bool
+            Store the parsed body for subsequent calls.
+
+        Returns
+        -------
+        object
+            The parsed body.
+        """
+        if not self.is_msgpack:
+            return super().get_json(force=force, silent=silent, cache=cache)
+
+        if cache and self._cached_json[silent] is not Ellipsis:
+            return self._cached_json[silent]
+
+        try:
+            rv = unpackb(self.get_data(cache=cache))
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError,
+                msgpack.StackError) as e:
+            if silent:
+                return None
+            rv = self.on_json_loading_failed(e)
+
+        if cache:
+            self._cached_json = (rv, rv)
+        return rv
+
+
+def init_app(app):
+    """
+    Enables MessagePack request bodies for an application, and marks
+    its responses as varying with the `Accept` header.
+
+    The application's JSON provider must be a `NegotiatingProvider` for
+    MessagePack responses to be produced.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    """
+    app.request_class = NegotiatingRequest
+
+    @app.after_request
+    def vary_on_accept(response):
+        if msgpack is not None and response.mimetype in (
+                JSON_MIMETYPE, MSGPACK_MIMETYPE):
+            response.vary.add('Accept')
+        return response
@@ -0,0 +1,306 @@
+"""
+This module contains the notification inbox of each user.
+
+The like, comment and follow controllers record their outbox events,
+and the `notifications` consumer of the outbox turns them into
+notifications. The actions on one target, such as the likes of a post,
+are aggregated into a single row per user, type and target, which
+counts them and remembers the latest actor, so a post liked thousands
+of times costs one row. A batch of events updates each row it touches
+once, so a burst of likes on a popular post is a single write.
+
+Each user's number of unread notifications is kept in the
+`notification_counters` table, updated with the rows, so it is read
+with a single primary key lookup. A notification that gets a new action
+after it has been read becomes unread again, and counts once more.
+
+Notifications are listed newest action first, keyed by the ID of their
+latest event, so each page is a range scan from the previous one. One
+event can update several notifications of a user, such as a comment
+which is also a reply to them, so ties are broken by the notification's
+ID.
+"""
+from collections import Counter, defaultdict
+
+from sqlalchemy import delete, func, tuple_, update
+from sqlalchemy.orm import selectinload
+
+from init import db
+from models.notification import Notification, NotificationCounter
+from services import events
+
+
+def _actions(event):
+    """
+    Returns the notifications an event adds an action to, as
+    `(user_id, type, target_id, actor_id)` tuples.
+    """
+    payload = event.payload
+    actions = []
+    if event.type == events.POST_LIKED:
+        actions.append((payload["author_id"], 'like', payload["post_id"],
+                        payload["user_id"]))
+    elif event.type == events.COMMENT_CREATED:
+        # Events recorded before comments carried the post's author
+        # only notify of replies
+        if payload.get("author_id") is not None:
+            actions.append((payload["author_id"], 'comment',
+                            payload["post_id"], payload["user_id"]))
+        if payload.get("parent_user_id") is not None:
+            actions.append((payload["parent_user_id"], 'reply',
+                            payload["parent_id"], payload["user_id"]))
+    elif event.type == events.USER_FOLLOWED:
+        actions.append((payload["followed_id"], 'follow',
+                        payload["followed_id"], payload["follower_id"]))
+    # Nobody is notified of their own actions
+    return [action for action in actions if action[0] != action[3]]
+
+
+def _add_unread(deltas):
+    """
+    Adds to the unread counters of some users, creating the missing
+    ones.
+    """
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    counters = {counter.user_id: counter for counter in db.session.execute(
+        db.select(NotificationCounter)
+        .where(NotificationCounter.user_id.in_(deltas))
+        .with_for_update()).scalars()}
+    for user_id, delta in deltas.items():
+        counter = counters.get(user_id)
+        if counter is None:
+            counter = NotificationCounter(user_id=user_id, unread=0)
+            db.session.add(counter)
+        counter.unread = max(counter.unread + delta, 0)
+
+
+def _delete(condition):
+    """
+    Deletes the notifications matching a condition, and removes the
+    unread ones from their users' counters.
+    """
+    unread = db.session.execute(
+        db.select(Notification.user_id, func.count())
+        .where(condition, Notification.read.is_(False))
+        .group_by(Notification.user_id)).all()
+    db.session.execute(delete(Notification.__table__).where(condition))
+    _add_unread({user_id: -count for user_id, count in unread})
+
+
+@events.consumer(events.POST_LIKED, events.COMMENT_CREATED,
+                 events.USER_FOLLOWED, events.POST_DELETED,
+                 events.POSTS_PURGED, events.COMMENT_DELETED,
+                 events.COMMENTS_PURGED, events.USER_DELETED,
+                 name='notifications')
+def apply_events(batch):
+    """
+    Aggregates the likes, comments and follows of a batch of events into
+    notifications, and deletes those of deleted posts, comments and
+    users.
+
+    Parameters
+    ----------
+    batch : list of OutboxEvent
+        The events, in the order they were recorded.
+    """
+    # Aggregate the actions of the batch on each notification
+    counts = Counter()
+    latest = {}
+    removed_posts = set()
+    removed_comments = set()
+    removed_users = set()
+    for event in batch:
+        payload = event.payload
+        if event.type == events.POST_DELETED:
+            removed_posts.add(payload["post_id"])
+        elif event.type == events.POSTS_PURGED:
+            removed_posts.update(payload["post_ids"])
+        elif event.type == events.COMMENT_DELETED:
+            removed_comments.add(payload["comment_id"])
+        elif event.type == events.COMMENTS_PURGED:
+            removed_comments.update(payload["comment_ids"])
+        elif event.type == events.USER_DELETED:
+            removed_users.add(payload["user_id"])
+        else:
+            for user_id, kind, target_id, actor_id in _actions(event):
+                key = (user_id, kind, target_id)
+                counts[key] += 1
+                latest[key] = (actor_id, event.id, event.created_at)
+
+    if removed_posts:
+        counts = Counter({key: count for key, count in counts.items()
+                          if key[1] == 'reply' or key[2] not in removed_posts})
+        _delete(Notification.type.in_(('like', 'comment'))
+                & Notification.target_id.in_(removed_posts))
+    if removed_comments:
+        counts = Counter({key: count for key, count in counts.items()
+                          if key[1] != 'reply'
+                          or key[2] not in removed_comments})
+        _delete((Notification.type == 'reply')
+                & Notification.target_id.in_(removed_comments))
+    if removed_users:
+        counts = Counter({key: count for key, count in counts.items()
+                          if key[0] not in removed_users})
+        db.session.execute(delete(Notification.__table__).where(
+            Notification.__table__.c.user_id.in_(removed_users)))
+        db.session.execute(delete(NotificationCounter.__table__).where(
+            NotificationCounter.__table__.c.user_id.in_(removed_users)))
+    if not counts:
+        return
+
+    # Update each notification once, creating the missing ones
+    user_ids = {user_id for user_id, _, _ in counts}
+    target_ids = {target_id for _, _, target_id in counts}
+    notifications = {
+        (notification.user_id, notification.type, notification.target_id):
+            notification
+        for notification in db.session.execute(
+            db.select(Notification)
+            .where(Notification.user_id.in_(user_ids),
+                   Notification.target_id.in_(target_ids))
+            .with_for_update()).scalars()}
+    unread = defaultdict(int)
+    for key, count in counts.items():
+        actor_id, event_id, created_at = latest[key]
+        notification = notifications.get(key)
+        if notification is None:
+            user_id, kind, target_id = key
+            notification = Notification(
+                user_id=user_id, type=kind, target_id=target_id,
+                actor_count=0, read=False)
+            db.session.add(notification)
+            unread[user_id] += 1
+        elif notification.read:
+            notification.read = False
+            unread[notification.user_id] += 1
+        notification.actor_count += count
+        notification.actor_id = actor_id
+        notification.event_id = event_id
+        notification.updated_at = created_at
+    _add_unread(unread)
+
+
+def unread_count(user_id):
+    """
+    Returns the number of unread notifications of a user.
+    """
+    return db.session.execute(
+        db.select(NotificationCounter.unread)
+        .where(NotificationCounter.user_id == user_id)).scalar() or 0
+
+
+def get_page(user_id, limit, after=None):
+    """
+    Returns a page of a user's notifications, newest action first.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user.
+    limit : int
+        The maximum number of notifications returned.
+    after : tuple of (int, int or None), optional
+        The `event_id` and `id` of the last notification of the previous
+        page, or only its `event_id` to start after every notification
+        of that event.
+
+    Returns
+    -------
+    list of Notification
+        The notifications, with their latest actor loaded.
+    """
+    query = db.select(Notification).where(Notification.user_id == user_id)
+    if after is not None:
+        event_id, notification_id = after
+        if notification_id is None:
+            query = query.where(Notification.event_id < event_id)
+        else:
+            query = query.where(
+                tuple_(Notification.event_id, Notification.id)
+                < tuple_(event_id, notification_id))
+    return db.session.execute(
+        query.options(selectinload(Notification.actor))
+        .order_by(Notification.event_id.desc(), Notification.id.desc())
+        .limit(limit)).scalars().all()
+
+
+def cursor(notification):
+    """
+    Returns the cursor of the page after a notification.
+    """
+    return f"{notification.event_id}:{notification.id}"
+
+
+def parse_cursor(value):
+    """
+    Returns the `after` argument of `get_page` for a cursor.
+
+    Cursors from before notifications were ordered by their ID too only
+    hold an event ID.
+
+    Raises
+    ------
+    ValueError
+        If the cursor is invalid.
+    """
+    event_id, _, notification_id = value.partition(':')
+    return int(event_id), int(notification_id) if notification_id else None
+
+
+def mark_read(user_id, ids=None):
+    """
+    Marks some, or all, of a user's notifications as read, in the
+    current transaction.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user.
+    ids : list of int, optional
+        The IDs of the notifications. Defaults to all of them.
+
+    Returns
+    -------
+    int
+        The number of notifications which were unread.
+    """
+    table = Notification.__table__
+    statement = update(table).where(
+        table.c.user_id == user_id, table.c.read.is_(False))
+    if ids is not None:
+        statement = statement.where(table.c.id.in_(ids))
+    count = db.session.execute(statement.values(read=True)).rowcount
+    if ids is None:
+        # Reset the counter, in case it has drifted
+        db.session.execute(
+            update(NotificationCounter.__table__)
+            .where(NotificationCounter.__table__.c.user_id == user_id)
+            .values(unread=0))
+    else:
+        _add_unread({user_id: -count})
+    return count
+
+
+def recount():
+    """
+    Recounts the unread notifications of every user into their counters.
+
+    Returns
+    -------
+    int
+        The number of counters written.
+    """
+    counts = dict(db.session.execute(
+        db.select(Notification.user_id, func.count())
+        .where(Notification.read.is_(False))
+        .group_by(Notification.user_id)).all())
+    counters = db.session.execute(db.select(NotificationCounter)).scalars()
+    for counter in counters:
+        counter.unread = counts.pop(counter.user_id, 0)
+    for user_id, count in counts.items():
+        db.session.add(NotificationCounter(user_id=user_id, unread=count))
+    db.session.flush()
+    return db.session.execute(
+        db.select(func.count()).select_from(NotificationCounter)).scalar()
@@ -0,0 +1,139 @@
+"""
+This module contains the comment previews shown on posts in feeds.
+
+A feed card shows a post's latest few comments, with its like and
+comment counts. Dumping posts with `posts_schema` loads every like and
+comment of every post on the page, so a single viral post makes every
+page it is on slow.
+
+`attach_previews` instead loads the latest comments of every post on a
+page with a single query, numbering the comments of each post with
+`ROW_NUMBER() OVER (PARTITION BY post_id)` and keeping the first few,
+and counts the likes and comments with one grouped query each. No like
+or comment is loaded beyond the previews, so the size of a page stays
+the same however many comments its posts have.
+
+Only the roots of comment threads are previewed, as a reply shown
+without the comment it replies to makes little sense on a feed card.
+"""
+from collections import defaultdict
+
+from flask import request
+from sqlalchemy import func
+from sqlalchemy.orm import aliased, selectinload
+
+from init import db
+from models.comment import Comment
+from models.like import Like
+from models.post import Post
+from services import sharding
+
+
+# The largest number of comments previewed on each post
+MAX_PREVIEW_SIZE = 10
+
+
+
+def preview_size():
+    """
+    Returns the number of comments to preview on each post, from the
+    `comments` query parameter.
+
+    Returns
+    -------
+    int or None
+        The number of comments, or `None` if the full posts were asked
+        for.
+    """
+    size = request.args.get('comments', type=int)
+    if size is None:
+        return None
+    return min(max(size, 0), MAX_PREVIEW_SIZE)
+
+
+def post_options():
+    """
+    Returns the loader options of posts dumped with previews, which
+    don't need their likes and comments loaded.
+
+    Building them configures every mapper, so they are only built when
+    a feed is first read, rather than when this module is imported.
+    """
+    return (selectinload(Post.author),)
+
+
+def _load_previews(post_ids, size):
+    """
+    Returns the latest comments on some posts, and their like and
+    comment counts, from the selected shard.
+    """
+    comments = []
+    if size:
+        ranked = db.select(
+            Comment,
+            func.row_number().over(partition_by=Comment.post_id,
+                                   order_by=Comment.id.desc())
+            .label('position')
+        ).where(Comment.post_id.in_(post_ids),
+                Comment.parent_id.is_(None)).subquery()
+        comment = aliased(Comment, ranked)
+        comments = db.session.execute(
+            db.select(comment).where(ranked.c.position <= size)
+            .order_by(ranked.c.post_id, ranked.c.position)).scalars().all()
+
+    like_counts = db.session.execute(
+        db.select(Like.post_id, func.count())
+        .where(Like.post_id.in_(post_ids)).group_by(Like.post_id)).all()
+    comment_counts = db.session.execute(
+        db.select(Comment.post_id, func.count())
+        .where(Comment.post_id.in_(post_ids))
+        .group_by(Comment.post_id)).all()
+    return comments, dict(like_counts), dict(comment_counts)
+
+
+def attach_previews(posts, size):
+    """
+    Attaches the latest comments, and the like and comment counts, to
+    each of a page of posts, for `post_previews_schema`.
+
+    Parameters
+    ----------
+    posts : list of Post
+        The posts.
+    size : int
+        The number of comments to preview on each post.
+
+    Returns
+    -------
+    list of Post
+        The posts.
+    """
+    post_ids = [post.id for post in posts]
+    if not post_ids:
+        return posts
+
+    if sharding.is_sharded():
+        ids_by_shard = defaultdict(list)
+        for post_id in post_ids:
+            ids_by_shard[sharding.shard_for_id(post_id)].append(post_id)
+        results = sharding.gather(
+            lambda: _load_previews(ids_by_shard[sharding.current_shard()],
+                                   size),
+            ids_by_shard)
+    else:
+        results = [_load_previews(post_ids, size)]
+
+    comments_by_post = defaultdict(list)
+    like_counts = {}
+    comment_counts = {}
+    for comments, shard_like_counts, shard_comment_counts in results:
+        for comment in comments:
+            comments_by_post[comment.post_id].append(comment)
+        like_counts.update(shard_like_counts)
+        comment_counts.update(shard_comment_counts)
+
+    for post in posts:
+        post.preview_comments = comments_by_post[post.id]
+        post.preview_likes_count = like_counts.get(post.id, 0)
+        post.preview_comments_count = comment_counts.get(post.id, 0)
+    return posts
@@ -0,0 +1,280 @@
+"""
+This module contains the bulk import of users.
+
+Creating users one at a time hashes each password in the process
+creating them, and checks and inserts each user with queries of its
+own, so bcrypt keeps a single core busy while the others sit idle.
+
+`import_users` reads the users from a CSV or NDJSON file one batch at a
+time, so a file of any size is never loaded into memory at once. Each
+batch is validated, and the usernames and email addresses already taken
+are found with one query per column. The passwords of the remaining
+users are then hashed by a pool of processes, one per core by default,
+and the users are inserted with a single multi-row statement and
+committed, so an interrupted import keeps the batches it finished and
+skips them when it is run again.
+"""
+import csv
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from init import db
+from models.user import User
+
+
+# The formats users can be imported from
+FORMATS = ('csv', 'ndjson')
+
+# The format of each file extension
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+# The default number of users validated, hashed and inserted at once
+IMPORT_BATCH_SIZE = 1000
+
+# The values of the `is_admin` column of a CSV file read as true
+TRUE_VALUES = frozenset({'1', 'true', 'yes', 'y'})
+
+# The bcrypt settings of the hashing processes
+_hasher = None
+
+
+class ImportResult:
+    """
+    The outcome of an import.
+
+    Attributes
+    ----------
+    read : int
+        The number of rows read.
+    created : int
+        The number of users created.
+    existing : int
+        The number of rows skipped because their username or email
+        address was already taken.
+    invalid : list of tuple
+        The rows skipped because they were invalid, as `(line, reason)`
+        pairs.
+    """
+
+    def __init__(self):
+        self.read = 0
+        self.created = 0
+        self.existing = 0
+        self.invalid = []
+
+
+def format_of(filename):
+    """
+    Returns the format of a file from its extension, or `None` if it is
+    unknown.
+    """
+    return EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def read_rows(stream, file_format):
+    """
+    Reads the rows of a file of users one at a time.
+
+    CSV files must have a header row naming their columns. NDJSON files
+    have a JSON object per line.
+
+    Parameters
+    ----------
+    stream : file
+        The file, opened in text mode.
+    file_format : str
+        The format of the file, one of `FORMATS`.
+
+    Yields
+    ------
+    tuple of (int, dict or None)
+        The line number of each row, and the row, or `None` if it can't
+        be parsed.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def _user(row):
+    """
+    Returns the values of a row's user, or the reason it is invalid.
+    """
+    if row is None:
+        return None, "Row could not be parsed"
+    username, email, password = (
+        row.get('username'), row.get('email'), row.get('password'))
+    if not all(isinstance(value, str) and value.strip()
+               for value in (username, email, password)):
+        return None, "username, email and password are required"
+    username, email = username.strip(), email.strip()
+    bio = row.get('bio') or None
+    if len(username) > User.username.type.length:
+        return None, "username is too long"
+    if len(email) > User.email.type.length or '@' not in email:
+        return None, "email is invalid"
+    if bio is not None and (not isinstance(bio, str)
+                            or len(bio) > User.bio.type.length):
+        return None, "bio is too long"
+    is_admin = row.get('is_admin') or False
+    if isinstance(is_admin, str):
+        is_admin = is_admin.strip().lower() in TRUE_VALUES
+    return {'username': username, 'email': email, 'password': password,
+            'bio': bio, 'is_admin': bool(is_admin)}, None
+
+
+def _taken(column, values):
+    """
+    Returns the values of a unique column of `users` already taken,
+    deleted users included.
+    """
+    return set(db.session.execute(
+        db.select(column).where(column.in_(values))
+        .execution_options(include_deleted=True)).scalars())
+
+
+def _new_users(users):
+    """
+    Returns the users whose username and email address aren't taken.
+    """
+    usernames = _taken(User.username, [user['username'] for user in users])
+    emails = _taken(User.email, [user['email'] for user in users])
+    return [user for user in users if user['username'] not in usernames
+            and user['email'] not in emails]
+
+
+def _init_hasher(config):
+    """
+    Sets up the bcrypt settings of a hashing process.
+    """
+    global _hasher  # pylint: disable=global-statement
+    from flask_bcrypt import Bcrypt  # pylint: disable=import-outside-toplevel
+    _hasher = Bcrypt(SimpleNamespace(config=config))
+
+
+def _hash(password):
+    """
+    Returns the bcrypt hash of a password, in a hashing process.
+    """
+    return _hasher.generate_password_hash(password).decode('utf-8')
+
+
+def _insert(users, hashes, confirmed_on):
+    """
+    Inserts a batch of users and commits them, leaving out those whose
+    username or email address was taken while they were hashed.
+
+    Returns
+    -------
+    int
+        The number of users inserted.
+    """
+    rows = [
+        {'username': user['username'], 'email': user['email'],
+         'password_hash': password_hash, 'bio': user['bio'],
+         'is_admin': user['is_admin'], 'is_confirmed': True,
+         'confirmed_on': confirmed_on}
+        for user, password_hash in zip(users, hashes)]
+    while rows:
+        try:
+            db.session.execute(insert(User.__table__), rows)
+            db.session.commit()
+            return len(rows)
+        except IntegrityError:
+            db.session.rollback()
+            remaining = _new_users(rows)
+            if len(remaining) == len(rows):
+                raise
+            rows = remaining
+    return 0
+
+
+def import_users(rows, batch_size=IMPORT_BATCH_SIZE, processes=None,
+                 on_batch=None):
+    """
+    Creates confirmed users from rows of a file, in batches.
+
+    Rows with the username or email address of an existing user, or of
+    an earlier row, are skipped, as are invalid rows.
+
+    Parameters
+    ----------
+    rows : iterable of tuple
+        The line numbers and rows of the file, from `read_rows`.
+    batch_size : int
+        The number of rows validated, hashed and inserted at once.
+    processes : int, optional
+        The number of processes hashing passwords. Defaults to the
+        number of cores.
+    on_batch : callable, optional
+        Called with the result so far after each batch is committed.
+
+    Returns
+    -------
+    ImportResult
+        The numbers of rows read and users created, and the rows
+        skipped.
+    """
+    result = ImportResult()
+    seen_usernames = set()
+    seen_emails = set()
+    config = {key: value for key, value in current_app.config.items()
+              if key.startswith('BCRYPT_')}
+
+    processes = processes or os.cpu_count()
+    rows = iter(rows)
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_hasher,
+                             initargs=(config,)) as pool:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return result
+            result.read += len(batch)
+
+            # Validate the rows, and skip the usernames and email
+            # addresses already in the file
+            users = []
+            for line_number, row in batch:
+                user, reason = _user(row)
+                if user is None:
+                    result.invalid.append((line_number, reason))
+                elif user['username'] in seen_usernames \
+                        or user['email'] in seen_emails:
+                    result.existing += 1
+                else:
+                    seen_usernames.add(user['username'])
+                    seen_emails.add(user['email'])
+                    users.append(user)
+
+            # Only hash the passwords of the users not already created
+            new_users = _new_users(users) if users else []
+            result.existing += len(users) - len(new_users)
+            if new_users:
+                hashes = pool.map(
+                    _hash, [user['password'] for user in new_users],
+                    chunksize=max(len(new_users) // (4 * processes), 1))
+                created = _insert(new_users, list(hashes), datetime.now())
+                result.existing += len(new_users) - created
+                result.created += created
+            if on_batch is not None:
+                on_batch(result)
+
@@ -0,0 +1,244 @@
+"""
+This module contains the relevance ranking of the following feed.
+
+The candidates are the `RANKING_CANDIDATES` newest posts of the users
+the viewer follows, so ranking costs the same however many posts they
+have. Each candidate is scored from three signals, read with a few
+grouped queries on the shards holding the followed users' posts:
+
+- its recency, which halves every `RANKING_HALF_LIFE` hours,
+- its likes and comments, weighted as for trending posts,
+- the viewer's affinity with its author, from how many of the author's
+  posts the viewer has liked and commented on.
+
+The signals are gathered into one column per signal and the whole
+candidate set is scored in a single pass over the columns, instead of
+post by post. The ranked IDs are cached per viewer and ETag for
+`RANKING_CACHE_TIMEOUT` seconds, so every page of a ranked feed is
+sliced from the same ranking, and a new post from a followed user,
+which changes the ETag, is ranked straight away.
+"""
+import heapq
+import math
+import time
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+
+from flask import current_app, g
+from sqlalchemy import func
+
+from init import db
+from models.comment import Comment
+from models.like import Like
+from models.post import Post
+from services import sharding
+from services.cache import ResponseCache, in_batch
+from services.trending import COMMENT_WEIGHT, LIKE_WEIGHT
+
+
+# How much the viewer's affinity with an author counts, relative to the
+# post's own engagement
+AFFINITY_WEIGHT = 2
+
+# The cache of the ranked post IDs of each viewer
+rankings = ResponseCache()
+
+
+class Ranking:
+    """
+    The ranked candidate posts of a viewer's feed.
+
+    Attributes
+    ----------
+    post_ids : list of int
+        The IDs of the candidate posts, most relevant first.
+    expires : float
+        The monotonic time the ranking expires at.
+    """
+
+    def __init__(self, post_ids, expires):
+        self.post_ids = post_ids
+        self.expires = expires
+
+
+def _load_candidates(viewer_id, author_ids, limit):
+    """
+    Returns the newest posts of some authors, with their like and
+    comment counts, and the viewer's likes and comments on each author's
+    posts, from the selected shard.
+    """
+    candidates = db.session.execute(
+        db.select(Post.id, Post.author_id, Post.created_at)
+        .where(Post.author_id.in_(author_ids))
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(limit)).all()
+    post_ids = [post_id for post_id, _, _ in candidates]
+    if not post_ids:
+        return [], {}, {}, {}
+
+    like_counts = db.session.execute(
+        db.select(Like.post_id, func.count())
+        .where(Like.post_id.in_(post_ids)).group_by(Like.post_id)).all()
+    comment_counts = db.session.execute(
+        db.select(Comment.post_id, func.count())
+        .where(Comment.post_id.in_(post_ids))
+        .group_by(Comment.post_id)).all()
+
+    # Likes and comments are stored with their post, so the viewer's
+    # engagement with an author is on the author's shard
+    affinity = defaultdict(int)
+    for model, weight in ((Like, LIKE_WEIGHT), (Comment, COMMENT_WEIGHT)):
+        counts = db.session.execute(
+            db.select(Post.author_id, func.count())
+            .join(model, model.post_id == Post.id)
+            .where(model.user_id == viewer_id, Post.author_id.in_(author_ids))
+            .group_by(Post.author_id)).all()
+        for author_id, count in counts:
+            affinity[author_id] += count * weight
+
+    return ([tuple(candidate) for candidate in candidates],
+            dict(like_counts), dict(comment_counts), dict(affinity))
+
+
+def score(ages, engagement, affinity, half_life):
+    """
+    Scores a set of posts from their signals, given as columns.
+
+    A post's score is its recency, `2 ** (-age / half_life)`, times a
+    boost from its engagement and one from the viewer's affinity with
+    its author. Both boosts grow with the logarithm of their signal, so
+    neither a viral post nor a favourite author drowns out the rest of
+    the feed.
+
+    Parameters
+    ----------
+    ages : list of float
+        The age of each post, in hours.
+    engagement : list of int
+        The weighted likes and comments of each post.
+    affinity : list of int
+        The viewer's weighted likes and comments on each post's author.
+    half_life : float
+        The number of hours after which a post's recency is halved.
+
+    Returns
+    -------
+    list of float
+        The score of each post.
+    """
+    return [2 ** (-age / half_life)
+            * (1 + math.log2(1 + post_engagement))
+            * (1 + AFFINITY_WEIGHT * math.log2(1 + author_affinity))
+            for age, post_engagement, author_affinity
+            in zip(ages, engagement, affinity)]
+
+
+def rank(viewer_id, author_ids):
+    """
+    Ranks the newest posts of some authors by their relevance to a
+    viewer.
+
+    Parameters
+    ----------
+    viewer_id : int
+        The ID of the viewer.
+    author_ids : list of int
+        The IDs of the users the viewer follows.
+
+    Returns
+    -------
+    list of int
+        The IDs of the candidate posts, most relevant first.
+    """
+    limit = current_app.config['RANKING_CANDIDATES']
+    results = sharding.gather(
+        lambda: _load_candidates(viewer_id, author_ids, limit),
+        sharding.shards_for_authors(author_ids))
+
+    # Keep the newest candidates of every shard, as one database
+    # holding all of the posts would
+    candidates = list(islice(heapq.merge(
+        *(shard_candidates for shard_candidates, _, _, _ in results),
+        key=lambda candidate: (candidate[2], candidate[0]), reverse=True),
+        limit))
+    if not candidates:
+        return []
+    like_counts, comment_counts, affinity = {}, {}, {}
+    for _, shard_likes, shard_comments, shard_affinity in results:
+        like_counts.update(shard_likes)
+        comment_counts.update(shard_comments)
+        affinity.update(shard_affinity)
+
+    # Gather the signals into columns, and score them all at once
+    now = datetime.now()
+    post_ids = [post_id for post_id, _, _ in candidates]
+    ages = [max((now - created_at).total_seconds(), 0) / 3600
+            for _, _, created_at in candidates]
+    engagement = [like_counts.get(post_id, 0) * LIKE_WEIGHT
+                  + comment_counts.get(post_id, 0) * COMMENT_WEIGHT
+                  for post_id in post_ids]
+    author_affinity = [affinity.get(author_id, 0)
+                       for _, author_id, _ in candidates]
+    scores = score(ages, engagement, author_affinity,
+                   current_app.config['RANKING_HALF_LIFE'])
+
+    order = sorted(range(len(post_ids)),
+                   key=lambda index: (-scores[index], -post_ids[index]))
+    return [post_ids[index] for index in order]
+
+
+def get_ranked_page(viewer_id, author_ids, page, per_page):
+    """
+    Returns the IDs of one page of a viewer's feed ranked by relevance.
+
+    The ranking is cached per viewer and ETag, so the other pages of
+    the feed are sliced from it without ranking again.
+
+    Parameters
+    ----------
+    viewer_id : int
+        The ID of the viewer.
+    author_ids : list of int
+        The IDs of the users the viewer follows.
+    page : int
+        The page number, starting from 1.
+    per_page : int
+        The number of posts on a page.
+
+    Returns
+    -------
+    list of int
+        The IDs of the posts on the page, most relevant first.
+    """
+    # Invalid values fall back to the defaults, as in `paginate`
+    page = page if page >= 1 else 1
+    per_page = per_page if per_page >= 1 else 20
+
+    # A batch's ranking may include changes which are rolled back
+    start = (page - 1) * per_page
+    if in_batch():
+        return rank(viewer_id, author_ids)[start:start + per_page]
+
+    key = (viewer_id, g.get('resource_etag'))
+    ranking = rankings.get(key)
+    if ranking is None:
+        ranking = Ranking(
+            rank(viewer_id, author_ids),
+            time.monotonic() + current_app.config['RANKING_CACHE_TIMEOUT'])
+        rankings.set(key, ranking)
+    return ranking.post_ids[start:start + per_page]
+
+
+def init_app(app):
+    """
+    Sets the defaults of the ranking settings of an application.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    """
+    app.config.setdefault('RANKING_CANDIDATES', 200)
+    app.config.setdefault('RANKING_HALF_LIFE', 12)
+    app.config.setdefault('RANKING_CACHE_TIMEOUT', 60)
@@ -0,0 +1,285 @@
+"""
+This module contains the read/write splitting between the primary
+database and a read replica.
+
+When `REPLICA_DATABASE_URL` is set, `GET` and `HEAD` requests read from
+the replica, while every other request, every flush and every insert,
+update or delete statement uses the primary. Reads go back to the
+primary when:
+
+- The current user has written in the last `REPLICA_STICKY_SECONDS`
+  seconds, so that they always see their own writes. Writes are
+  remembered in-process by user ID, and in a `primary_until` cookie so
+  that other worker processes honour them too.
+- The replica is lagging the primary by more than `REPLICA_MAX_LAG`
+  seconds, or can't be reached. The lag is checked at most once every
+  `LAG_CHECK_INTERVAL` seconds per process.
+"""
+import time
+from threading import Lock
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from services import sharding
+
+
+# The bind key of the replica engine in SQLALCHEMY_BINDS
+REPLICA_BIND_KEY = 'replica'
+
+# The methods that are served from the replica
+READ_METHODS = {'GET', 'HEAD'}
+
+# Seconds between checks of the replica's lag
+LAG_CHECK_INTERVAL = 1.0
+
+# Name of the cookie holding the time reads must use the primary until
+STICKY_COOKIE = 'primary_until'
+
+# The key of the running batch in the session's `info`
+BATCH_KEY = 'batch'
+
+# Maximum number of users remembered as having recently written
+MAX_STICKY_USERS = 10000
+
+# The time each user must read from the primary until
+_sticky_until = {}
+_sticky_lock = Lock()
+
+# The last measured lag, and when it was measured
+_lag = {'checked': 0.0, 'seconds': 0.0}
+_lock = Lock()
+
+# Queries returning the replica's lag in seconds, for each database
+LAG_QUERIES = {
+    'postgresql': text(
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()"
+        " THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM"
+        " now() - pg_last_xact_replay_timestamp()), 0) END"),
+}
+
+
+def _current_user_id():
+    """
+    Returns the ID of the current user, if the request has been
+    authenticated.
+
+    The session class is imported with the extensions by every process,
+    so the JWT package is only imported once a request needs it.
+    """
+    # pylint: disable=import-outside-toplevel
+    from flask_jwt_extended import get_jwt_identity
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+
+def replica_lag(engine):
+    """
+    Returns how far the replica is behind the primary, in seconds.
+
+    The lag is measured at most once every `LAG_CHECK_INTERVAL` seconds.
+    Databases without a lag query, such as a second SQLite file, are
+    never behind. A replica that can't be reached is infinitely behind.
+
+    Parameters
+    ----------
+    engine : Engine
+        The replica engine.
+
+    Returns
+    -------
+    float
+        The lag in seconds.
+    """
+    now = time.monotonic()
+    if now - _lag['checked'] < LAG_CHECK_INTERVAL:
+        return _lag['seconds']
+
+    with _lock:
+        if now - _lag['checked'] < LAG_CHECK_INTERVAL:
+            return _lag['seconds']
+        query = LAG_QUERIES.get(engine.dialect.name)
+        try:
+            if query is None:
+                seconds = 0.0
+            else:
+                with engine.connect() as connection:
+                    seconds = float(connection.execute(query).scalar() or 0)
+        except SQLAlchemyError:
+            seconds = float('inf')
+        _lag['seconds'] = seconds
+        _lag['checked'] = now
+        return seconds
+
+
+def is_sticky():
+    """
+    Returns if the current request must read from the primary because
+    its user wrote recently.
+    """
+    now = time.time()
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > now:
+            return True
+    except ValueError:
+        pass
+    user_id = _current_user_id()
+    return user_id is not None and _sticky_until.get(user_id, 0) > now
+
+
+def use_replica(engine):
+    """
+    Returns if the current request should read from the replica.
+
+    Parameters
+    ----------
+    engine : Engine
+        The replica engine.
+
+    Returns
+    -------
+    bool
+        If reads should use the replica.
+    """
+    if not has_request_context() or request.method not in READ_METHODS:
+        return False
+
+    # Decide once per request, after the user has been authenticated
+    if 'use_replica' in g:
+        return g.use_replica
+    if _current_user_id() is None and request.headers.get('Authorization'):
+        return False
+
+    max_lag = current_app.config.get('REPLICA_MAX_LAG', 5)
+    g.use_replica = not is_sticky() and replica_lag(engine) <= max_lag
+    return g.use_replica
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to the replica when `use_replica` allows,
+    and everything else to the primary.
+
+    Queries on sharded tables go to the selected shard instead, and
+    flushed rows to their own shard.
+
+    While a batch of requests is running, see `services.batch`, every
+    query uses the primary, as the batch's own writes aren't committed
+    yet, and `commit` and `rollback` apply to the current operation of
+    the batch instead of the whole transaction.
+    """
+
+    def __init__(self, db, **kwargs):
+        super().__init__(db, **kwargs)
+        if sharding.is_sharded():
+            self.connection_callable = self._connection_for_instance
+
+    def _connection_for_instance(self, mapper, instance):
+        """
+        Returns the connection to flush an instance with.
+        """
+        shard = sharding.shard_for_instance(instance)
+        if shard is None:
+            return self.connection(bind_arguments={'mapper': mapper})
+        return self.connection(
+            bind_arguments={'bind': sharding.shard_engine(shard)})
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """
+        Returns the engine to use for a query.
+        """
+        if bind is None and sharding.is_sharded():
+            table = sharding.sharded_table(mapper, clause)
+            if table is not None:
+                return sharding.shard_engine(sharding.require_shard(table))
+
+        if bind is None and not self._flushing and BATCH_KEY not in self.info \
+                and not getattr(clause, 'is_dml', False):
+            engine = self._db.engines.get(REPLICA_BIND_KEY)
+            if engine is not None and use_replica(engine):
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+    def commit(self):
+        """
+        Commits the transaction, or only flushes it while a batch is
+        running, for the batch to commit once all of its operations
+        have run.
+
+        Like a commit, the flush expires every instance, so that the
+        rest of the operation reads what it wrote, such as the likes of
+        a post it liked.
+        """
+        if BATCH_KEY in self.info:
+            self.flush()
+            self.expire_all()
+            return
+        super().commit()
+
+    def rollback(self):
+        """
+        Rolls the transaction back, or only the current operation while
+        a batch is running.
+        """
+        batch = self.info.get(BATCH_KEY)
+        if batch is not None:
+            batch.rollback_operation()
+            return
+        super().rollback()
+
+
+def record_write(response):
+    """
+    Makes the current user read from the primary for a while, after a
+    successful write request.
+
+    Parameters
+    ----------
+    response : Response
+        The response to the write request.
+
+    Returns
+    -------
+    Response
+        The response.
+    """
+    if request.method in READ_METHODS or request.method == 'OPTIONS' \
+            or response.status_code >= 400:
+        return response
+
+    window = current_app.config.get('REPLICA_STICKY_SECONDS', 5)
+    until = time.time() + window
+
+    user_id = _current_user_id()
+    if user_id is not None:
+        with _sticky_lock:
+            # Forget the users whose window has passed when full
+            if len(_sticky_until) >= MAX_STICKY_USERS:
+                now = time.time()
+                for key in [key for key, value in _sticky_until.items()
+                            if value <= now]:
+                    del _sticky_until[key]
+            _sticky_until[user_id] = until
+
+    response.set_cookie(STICKY_COOKIE, str(until), max_age=int(window) + 1,
+                        httponly=True)
+    return response
+
+
+def init_app(app):
+    """
+    Enables read/write splitting for an application, if it has a
+    replica bind configured.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    """
+    if REPLICA_BIND_KEY in app.config.get('SQLALCHEMY_BINDS', {}):
+        app.after_request(record_write)
@@ -0,0 +1,497 @@
+"""
+This module contains the full-text search index for posts and comments.
+
+The index is an inverted index kept inside the application database:
+
+- On PostgreSQL it is a `search_index` table with a weighted `tsvector`
+  column and a GIN index.
+- On SQLite it is an FTS5 virtual table called `search_index`.
+
+Every post and every comment is stored as one document in the index.
+The index is kept up to date by `apply_events`, which consumes the post
+and comment events recorded by the controllers in batches, so requests
+never write to the index themselves. Searches see a change once the
+event dispatcher has delivered it, usually within a second, and the
+index never has to be rebuilt during normal operation. The
+`reindex_search` CLI command rebuilds it from scratch when required.
+
+Searches rank the matching documents, then sum the scores of each
+post's documents so that a post whose comments also match is ranked
+higher than one that only matches once.
+"""
+import re
+
+from sqlalchemy import text
+
+from init import db
+from services import events
+
+
+# Post titles are weighted above post content, which is weighted above
+# the content of comments on the post
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 4.0
+COMMENT_WEIGHT = 1.0
+
+# Maximum number of matching documents that are ranked for a single
+# search. This keeps the cost of a search bounded for very common terms.
+MAX_CANDIDATES = 1000
+
+# Number of rows inserted per statement when rebuilding the index
+REINDEX_BATCH_SIZE = 1000
+
+# Matches the words in a search query
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+class PostgresSearchBackend:
+    """
+    Search index backed by a PostgreSQL `tsvector` column and GIN index.
+    """
+
+    def create(self):
+        """
+        Creates the index table if it does not already exist.
+        """
+        db.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS search_index ("
+            " kind VARCHAR(8) NOT NULL,"
+            " ref_id BIGINT NOT NULL,"
+            " post_id BIGINT NOT NULL,"
+            " document TSVECTOR NOT NULL,"
+            " PRIMARY KEY (kind, ref_id))"))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_search_index_document "
+            "ON search_index USING GIN (document)"))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_search_index_post_id "
+            "ON search_index (post_id)"))
+
+    def drop(self):
+        """
+        Drops the index table.
+        """
+        db.session.execute(text("DROP TABLE IF EXISTS search_index"))
+
+    def upsert(self, rows):
+        """
+        Adds or replaces documents in the index.
+
+        Parameters
+        ----------
+        rows : list of dict
+            The documents to index, as returned by `post_row` and
+            `comment_row`.
+        """
+        db.session.execute(text(
+            "INSERT INTO search_index (kind, ref_id, post_id, document) "
+            "VALUES (:kind, :ref_id, :post_id,"
+            " setweight(to_tsvector('english', :title), 'A') ||"
+            " setweight(to_tsvector('english', :content), 'B') ||"
+            " setweight(to_tsvector('english', :comment), 'C')) "
+            "ON CONFLICT (kind, ref_id) DO UPDATE"
+            " SET post_id = EXCLUDED.post_id, document = EXCLUDED.document"),
+            rows)
+
+    def delete_post(self, post_id, _comment_ids):
+        """
+        Removes a post and all of its comments from the index.
+
+        Parameters
+        ----------
+        post_id : int
+            The ID of the post to remove.
+        _comment_ids : list of int
+            The IDs of the post's comments. Unused, as the post ID is
+            indexed.
+        """
+        db.session.execute(
+            text("DELETE FROM search_index WHERE post_id = :post_id"),
+            {"post_id": post_id})
+
+    def delete_comment(self, comment_id):
+        """
+        Removes a comment from the index.
+
+        Parameters
+        ----------
+        comment_id : int
+            The ID of the comment to remove.
+        """
+        db.session.execute(
+            text("DELETE FROM search_index "
+                 "WHERE kind = 'comment' AND ref_id = :ref_id"),
+            {"ref_id": comment_id})
+
+    def search(self, query, limit, offset):
+        """
+        Returns the IDs of the posts matching a query, best match first.
+
+        Parameters
+        ----------
+        query : str
+            The search query.
+        limit : int
+            The maximum number of post IDs to return.
+        offset : int
+            The number of post IDs to skip.
+
+        Returns
+        -------
+        list of int
+            The matching post IDs.
+        """
+        # Postgres weights are given lowest first, as {D, C, B, A}
+        weights = '{0, %s, %s, 1}' % (
+            COMMENT_WEIGHT / TITLE_WEIGHT, CONTENT_WEIGHT / TITLE_WEIGHT)
+        result = db.session.execute(text(
+            "SELECT post_id, SUM(score) AS total FROM ("
+            " SELECT post_id,"
+            " ts_rank(CAST(:weights AS float4[]), document, query) AS score"
+            " FROM search_index, plainto_tsquery('english', :query) AS query"
+            " WHERE document @@ query"
+            " ORDER BY score DESC LIMIT :candidates) AS matches "
+            "GROUP BY post_id ORDER BY total DESC LIMIT :limit OFFSET :offset"),
+            {"query": query, "weights": weights, "candidates": MAX_CANDIDATES,
+             "limit": limit, "offset": offset})
+        return [row.post_id for row in result]
+
+
+class SQLiteSearchBackend:
+    """
+    Search index backed by an SQLite FTS5 virtual table.
+
+    FTS5 tables can only be looked up efficiently by `rowid`, so the
+    `rowid` of each document is derived from its kind and ID.
+    """
+
+    def create(self):
+        """
+        Creates the index table if it does not already exist.
+        """
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+            " title, content, comment, post_id UNINDEXED,"
+            " tokenize = 'porter unicode61')"))
+        db.session.execute(
+            text("INSERT INTO search_index (search_index, rank) "
+                 "VALUES ('rank', :rank)"),
+            {"rank": f"bm25({TITLE_WEIGHT}, {CONTENT_WEIGHT}, {COMMENT_WEIGHT})"})
+
+    def drop(self):
+        """
+        Drops the index table.
+        """
+        db.session.execute(text("DROP TABLE IF EXISTS search_index"))
+
+    @staticmethod
+    def rowid(kind, ref_id):
+        """
+        Returns the `rowid` of a document.
+
+        Parameters
+        ----------
+        kind : str
+            Either `post` or `comment`.
+        ref_id : int
+            The ID of the post or comment.
+
+        Returns
+        -------
+        int
+            The `rowid` of the document.
+        """
+        return ref_id * 2 + (kind == 'comment')
+
+    def upsert(self, rows):
+        """
+        Adds or replaces documents in the index.
+
+        Parameters
+        ----------
+        rows : list of dict
+            The documents to index, as returned by `post_row` and
+            `comment_row`.
+        """
+        rows = [dict(row, rowid=self.rowid(row['kind'], row['ref_id']))
+                for row in rows]
+        db.session.execute(
+            text("DELETE FROM search_index WHERE rowid = :rowid"), rows)
+        db.session.execute(text(
+            "INSERT INTO search_index (rowid, title, content, comment, post_id) "
+            "VALUES (:rowid, :title, :content, :comment, :post_id)"), rows)
+
+    def delete_post(self, post_id, comment_ids):
+        """
+        Removes a post and all of its comments from the index.
+
+        Parameters
+        ----------
+        post_id : int
+            The ID of the post to remove.
+        comment_ids : list of int
+            The IDs of the post's comments.
+        """
+        rowids = [self.rowid('post', post_id)]
+        rowids += [self.rowid('comment', comment_id)
+                   for comment_id in comment_ids]
+        db.session.execute(
+            text("DELETE FROM search_index WHERE rowid = :rowid"),
+            [{"rowid": rowid} for rowid in rowids])
+
+    def delete_comment(self, comment_id):
+        """
+        Removes a comment from the index.
+
+        Parameters
+        ----------
+        comment_id : int
+            The ID of the comment to remove.
+        """
+        db.session.execute(
+            text("DELETE FROM search_index WHERE rowid = :rowid"),
+            {"rowid": self.rowid('comment', comment_id)})
+
+    def search(self, query, limit, offset):
+        """
+        Returns the IDs of the posts matching a query, best match first.
+
+        Parameters
+        ----------
+        query : str
+            The search query.
+        limit : int
+            The maximum number of post IDs to return.
+        offset : int
+            The number of post IDs to skip.
+
+        Returns
+        -------
+        list of int
+            The matching post IDs.
+        """
+        # Quote every word so that the query can't use FTS5 syntax
+        words = WORD_PATTERN.findall(query)
+        match = ' '.join(f'"{word}"' for word in words)
+        result = db.session.execute(text(
+            "SELECT post_id, SUM(score) AS total FROM ("
+            " SELECT post_id, -rank AS score FROM search_index"
+            " WHERE search_index MATCH :match"
+            " ORDER BY rank LIMIT :candidates) "
+            "GROUP BY post_id ORDER BY total DESC LIMIT :limit OFFSET :offset"),
+            {"match": match, "candidates": MAX_CANDIDATES,
+             "limit": limit, "offset": offset})
+        return [row.post_id for row in result]
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_backend():
+    """
+    Returns the search backend for the database in use.
+
+    Returns
+    -------
+    PostgresSearchBackend or SQLiteSearchBackend
+        The search backend.
+
+    Raises
+    ------
+    RuntimeError
+        If the database does not support full-text search.
+    """
+    dialect = db.engine.dialect.name
+    if dialect not in BACKENDS:
+        raise RuntimeError(f"Full-text search is not supported on {dialect}")
+    return BACKENDS[dialect]()
+
+
+def post_row(post):
+    """
+    Returns the index document for a post.
+
+    Parameters
+    ----------
+    post : Post
+        The post to index.
+
+    Returns
+    -------
+    dict
+        The index document.
+    """
+    return {"kind": "post", "ref_id": post.id, "post_id": post.id,
+            "title": post.title, "content": post.content, "comment": ""}
+
+
+def comment_row(comment):
+    """
+    Returns the index document for a comment.
+
+    Parameters
+    ----------
+    comment : Comment
+        The comment to index.
+
+    Returns
+    -------
+    dict
+        The index document.
+    """
+    return {"kind": "comment", "ref_id": comment.id,
+            "post_id": comment.post_id,
+            "title": "", "content": "", "comment": comment.content}
+
+
+def create_index():
+    """
+    Creates the search index if it does not already exist.
+    """
+    get_backend().create()
+
+
+def drop_index():
+    """
+    Drops the search index.
+    """
+    get_backend().drop()
+
+
+def search_posts(query, limit, offset=0):
+    """
+    Returns the IDs of the posts matching a query, best match first.
+
+    Parameters
+    ----------
+    query : str
+        The search query.
+    limit : int
+        The maximum number of post IDs to return.
+    offset : int
+        The number of post IDs to skip.
+
+    Returns
+    -------
+    list of int
+        The matching post IDs.
+    """
+    if not WORD_PATTERN.search(query):
+        return []
+    return get_backend().search(query, limit, offset)
+
+
+def rebuild_index(posts, comments):
+    """
+    Rebuilds the search index from scratch.
+
+    Parameters
+    ----------
+    posts : iterable of Post
+        Every post in the database.
+    comments : iterable of Comment
+        Every comment in the database.
+
+    Returns
+    -------
+    int
+        The number of documents indexed.
+    """
+    # Flush pending posts and comments so that they all have IDs
+    db.session.flush()
+
+    backend = get_backend()
+    backend.drop()
+    backend.create()
+
+    count = 0
+    batch = []
+    for row in _rows(posts, comments):
+        batch.append(row)
+        if len(batch) >= REINDEX_BATCH_SIZE:
+            backend.upsert(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        backend.upsert(batch)
+        count += len(batch)
+    return count
+
+
+def _rows(posts, comments):
+    """
+    Yields the index documents for the given posts and comments.
+    """
+    for post in posts:
+        yield post_row(post)
+    for comment in comments:
+        yield comment_row(comment)
+
+
+def _forget_post(rows, post_id):
+    """
+    Drops a post and its comments from a batch of pending documents.
+    """
+    for key in [key for key, row in rows.items() if row["post_id"] == post_id]:
+        del rows[key]
+
+
+@events.consumer(events.POST_CREATED, events.POST_UPDATED,
+                 events.POST_DELETED, events.COMMENT_CREATED,
+                 events.COMMENT_UPDATED, events.COMMENT_DELETED,
+                 events.POSTS_PURGED, events.COMMENTS_PURGED, name='search')
+def apply_events(batch):
+    """
+    Brings the search index up to date with a batch of events.
+
+    Changes to the same document are coalesced, so each document is
+    written at most once per batch, and all of the new and changed
+    documents are written with a single statement.
+
+    Parameters
+    ----------
+    batch : list of OutboxEvent
+        The events, in the order they were recorded.
+    """
+    rows = {}
+    deleted_posts = set()
+    deleted_comments = set()
+
+    for event in batch:
+        payload = event.payload
+        if event.type in (events.POST_CREATED, events.POST_UPDATED):
+            rows[("post", payload["post_id"])] = {
+                "kind": "post", "ref_id": payload["post_id"],
+                "post_id": payload["post_id"], "title": payload["title"],
+                "content": payload["content"], "comment": ""}
+        elif event.type in (events.COMMENT_CREATED, events.COMMENT_UPDATED):
+            rows[("comment", payload["comment_id"])] = {
+                "kind": "comment", "ref_id": payload["comment_id"],
+                "post_id": payload["post_id"], "title": "", "content": "",
+                "comment": payload["content"]}
+        elif event.type == events.POST_DELETED:
+            # The post's comments are removed when they are purged
+            _forget_post(rows, payload["post_id"])
+            deleted_posts.add(payload["post_id"])
+        elif event.type == events.POSTS_PURGED:
+            for post_id in payload["post_ids"]:
+                _forget_post(rows, post_id)
+                deleted_posts.add(post_id)
+        elif event.type == events.COMMENT_DELETED:
+            rows.pop(("comment", payload["comment_id"]), None)
+            deleted_comments.add(payload["comment_id"])
+        elif event.type == events.COMMENTS_PURGED:
+            for comment_id in payload["comment_ids"]:
+                rows.pop(("comment", comment_id), None)
+                deleted_comments.add(comment_id)
+
+    backend = get_backend()
+    for post_id in deleted_posts:
+        backend.delete_post(post_id, [])
+    for comment_id in deleted_comments:
+        backend.delete_comment(comment_id)
+    if rows:
+        backend.upsert(list(rows.values()))
@@ -0,0 +1,283 @@
+"""
+This module contains the compiled serializers for the hot read paths.
+
+Dumping objects with a marshmallow schema walks every field through
+several layers of generic method calls. `compile_schema` instead reads
+the field definitions of an existing schema once, and generates a plain
+Python function specialised to those fields, which produces exactly the
+same output as `schema.dump`.
+
+The schemas stay the single source of truth: any field type, option or
+hook that the compiler doesn't recognise is delegated back to
+marshmallow, so adding a field to a schema never changes the output.
+
+Use `dump(schema, obj)` in place of `schema.dump(obj)`. The compiled
+function for each schema is generated the first time it is used.
+
+When the response is MessagePack, `dump` leaves datetimes as datetime
+objects, so that they are encoded as compact MessagePack timestamps
+instead of ISO strings.
+"""
+from datetime import datetime
+from threading import Lock
+
+from marshmallow import fields, missing, utils
+
+from services.negotiation import wants_msgpack
+
+
+# The types that marshmallow's inferred fields pass through unchanged
+PASSTHROUGH_TYPES = (str, int, float, bool, type(None))
+
+# The compiled dump function for each schema instance and datetime mode
+_compiled = {}
+_lock = Lock()
+
+
+def _has_dump_hooks(schema):
+    """
+    Returns if a schema has `pre_dump` or `post_dump` hooks.
+    """
+    return any(schema._hooks[(tag, many)]
+               for tag in ('pre_dump', 'post_dump')
+               for many in (False, True))
+
+
+def _infer(value, field):
+    """
+    Serializes a value for a field whose type was not declared.
+    """
+    if type(value) in PASSTHROUGH_TYPES:
+        return value
+    if type(value) is datetime:
+        return value.isoformat()
+    return field._serialize(value, field.name, None)
+
+
+def _infer_native(value, field):
+    """
+    Serializes a value for a field whose type was not declared, leaving
+    datetimes as datetime objects.
+    """
+    if type(value) is datetime:
+        return value
+    return _infer(value, field)
+
+
+def _value_expression(field, index, namespace, native):
+    """
+    Returns the Python expression serializing `value` for a field.
+
+    Parameters
+    ----------
+    field : Field
+        The marshmallow field.
+    index : int
+        The position of the field in the schema, used to name the
+        helpers added to the namespace.
+    namespace : dict
+        The namespace of the generated function.
+    native : bool
+        If datetimes are left as datetime objects.
+
+    Returns
+    -------
+    str or None
+        The expression, or `None` if the field must be serialized by
+        marshmallow.
+    """
+    if type(field) is fields.Integer and not field.as_string:
+        return 'None if value is None else int(value)'
+
+    if type(field) is fields.String:
+        namespace[f'text_{index}'] = utils.ensure_text_type
+        return (f'value if value is None or type(value) is str '
+                f'else text_{index}(value)')
+
+    if type(field) is fields.Boolean:
+        namespace[f'field_{index}'] = field
+        return (f'value if value is None or value is True or value is False '
+                f'else field_{index}._serialize(value, None, None)')
+
+    if type(field) is fields.DateTime and native:
+        return 'value'
+
+    if type(field) is fields.DateTime:
+        format_func = field.SERIALIZATION_FUNCS.get(
+            field.format or field.DEFAULT_FORMAT)
+        if format_func is None:
+            return None
+        namespace[f'format_{index}'] = format_func
+        return f'None if value is None else format_{index}(value)'
+
+    if type(field) is fields.Inferred:
+        namespace[f'infer_{index}'] = _infer_native if native else _infer
+        namespace[f'field_{index}'] = field
+        return f'infer_{index}(value, field_{index})'
+
+    if type(field) is fields.Nested:
+        schema = field.schema
+        namespace[f'nested_{index}'] = compile_schema(
+            schema, many=False, native=native)
+        if schema.many or field.many:
+            return (f'None if value is None '
+                    f'else [nested_{index}(each) for each in value]')
+        return f'None if value is None else nested_{index}(value)'
+
+    if type(field) is fields.List and type(field.inner) is fields.Nested \
+            and not (field.inner.many or field.inner.schema.many):
+        namespace[f'nested_{index}'] = compile_schema(
+            field.inner.schema, many=False, native=native)
+        return (f'None if value is None '
+                f'else [nested_{index}(each) for each in value]')
+
+    return None
+
+
+def _generate(schema, native):
+    """
+    Generates the function dumping a single object with a schema.
+
+    Parameters
+    ----------
+    schema : Schema
+        The schema to compile.
+    native : bool
+        If datetimes are left as datetime objects.
+
+    Returns
+    -------
+    function
+        The dump function.
+    """
+    namespace = {'MISSING': missing, 'get_value': utils.get_value}
+    lines = [
+        'def dump(obj):',
+        '    out = {}',
+        # Read mappings, such as dicts, by key, as marshmallow does
+        "    get = get_value if hasattr(obj, '__getitem__') else getattr",
+    ]
+
+    for index, (name, field) in enumerate(schema.dump_fields.items()):
+        key = field.data_key if field.data_key is not None else name
+        attribute = field.attribute or name
+
+        # Method fields call the schema method directly
+        if type(field) is fields.Method:
+            if field._serialize_method is None:
+                continue
+            namespace[f'method_{index}'] = field._serialize_method
+            lines.append(f'    out[{key!r}] = method_{index}(obj)')
+            continue
+
+        expression = None
+        if '.' not in attribute and field.dump_default is missing:
+            expression = _value_expression(field, index, namespace, native)
+
+        if expression is None:
+            # Let marshmallow serialize anything it was not compiled for
+            namespace[f'field_{index}'] = field
+            lines.append(f'    value = field_{index}.serialize({name!r}, obj)')
+            lines.append('    if value is not MISSING:')
+            lines.append(f'        out[{key!r}] = value')
+            continue
+
+        lines.append(f'    value = get(obj, {attribute!r}, MISSING)')
+        lines.append('    if value is not MISSING:')
+        lines.append(f'        out[{key!r}] = {expression}')
+
+    lines.append('    return out')
+    exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+    return namespace['dump']
+
+
+def compile_schema(schema, many=None, native=False):
+    """
+    Compiles a schema into a specialised dump function.
+
+    Schemas with dump hooks are not compiled, and dump with marshmallow.
+
+    Parameters
+    ----------
+    schema : Schema
+        The schema to compile.
+    many : bool, optional
+        If the function dumps a list of objects. Defaults to the
+        schema's own `many` option.
+    native : bool, optional
+        If datetimes are left as datetime objects. Defaults to `False`.
+
+    Returns
+    -------
+    function
+        A function taking an object, or a list of objects, and returning
+        the same data as `schema.dump`.
+    """
+    many = schema.many if many is None else many
+    if _has_dump_hooks(schema):
+        return lambda obj: schema.dump(obj, many=many)
+
+    dump_one = _generate(schema, native)
+    if many:
+        return lambda objs: [dump_one(obj) for obj in objs]
+    return dump_one
+
+
+def compile_all(schemas):
+    """
+    Compiles schemas ahead of their first use, in both datetime modes.
+
+    A server forking its workers from a preloaded application calls this
+    before forking, so that the workers share the compiled functions
+    instead of each compiling them again.
+
+    Parameters
+    ----------
+    schemas : iterable of Schema
+        The schemas to compile.
+
+    Returns
+    -------
+    int
+        The number of functions compiled.
+    """
+    count = 0
+    with _lock:
+        for schema in schemas:
+            for native in (False, True):
+                if (schema, native) not in _compiled:
+                    _compiled[(schema, native)] = compile_schema(
+                        schema, native=native)
+                    count += 1
+    return count
+
+
+def dump(schema, obj, native=None):
+    """
+    Dumps an object with the compiled version of a schema.
+
+    Parameters
+    ----------
+    schema : Schema
+        The schema to dump with.
+    obj : object or list
+        The object, or list of objects if the schema has `many=True`.
+    native : bool, optional
+        If datetimes are left as datetime objects. Defaults to whether
+        the current response is MessagePack.
+
+    Returns
+    -------
+    dict or list
+        The same data as `schema.dump(obj)`, with datetimes left as
+        datetime objects if the response is MessagePack.
+    """
+    key = (schema, wants_msgpack() if native is None else native)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        with _lock:
+            compiled = _compiled.get(key)
+            if compiled is None:
+                compiled = _compiled[key] = compile_schema(
+                    schema, native=key[1])
+    return compiled(obj)
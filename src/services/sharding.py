@@ -0,0 +1,634 @@
+"""
+This module contains the horizontal sharding of posts, likes and
+comments.
+
+When `SHARD_DATABASE_URLS` is set, the `posts`, `likes` and `comments`
+tables live in N shard databases instead of the primary. Users, follows
+and everything else stay on the primary.
+
+- A post lives on the shard of its author, `author_id % N`, so that a
+  user's timeline is read from a single shard.
+- Likes and comments live on the shard of their post, so a post and
+  everything dumped with it is read from a single shard.
+- The IDs of sharded rows are generated by `next_id`, and carry the
+  shard they live on in their low `SHARD_BITS` bits. Any post, like or
+  comment can be found from its ID alone.
+
+`RoutingSession` sends each flushed row to its own shard, and every
+other query on a sharded table to the shard selected for the request.
+The post endpoints select the shard of the post in their URL. Other
+views select the shard of an author with `select_author_shard`, or read
+from many shards at once with `gather_page`, `gather_all`, `get_many`
+and `load_collections`.
+
+Without `SHARD_DATABASE_URLS`, the tables stay on the primary and these
+helpers run their queries there.
+"""
+import heapq
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import islice
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import Column, Integer, MetaData, Table, event, inspect
+from sqlalchemy.orm import Session, object_session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+# The prefix of the shard bind keys in SQLALCHEMY_BINDS
+SHARD_BIND_PREFIX = 'shard_'
+
+# The sharded tables, and the column each one is routed by
+SHARD_KEYS = {
+    'posts': 'author_id',
+    'likes': 'post_id',
+    'comments': 'post_id',
+}
+
+# The number of low bits of a sharded row's ID holding its shard
+SHARD_BITS = 10
+MAX_SHARDS = 1 << SHARD_BITS
+
+# The number of IDs a session reserves from a shard at a time
+ID_BLOCK_SIZE = 100
+
+# The maximum number of shards queried at the same time
+MAX_GATHER_WORKERS = 16
+
+# The table on each shard that hands out blocks of IDs
+id_metadata = MetaData()
+id_blocks = Table(
+    'id_blocks', id_metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True))
+
+# The shard selected outside of a request, or in a gathering thread
+_shard = ContextVar('shard', default=None)
+
+_executor = None
+
+
+def configure(app, urls):
+    """
+    Adds a bind for each shard database to an application's config.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    urls : list of str
+        The database URL of each shard, in shard order.
+    """
+    urls = [url.strip() for url in urls if url.strip()]
+    if len(urls) > MAX_SHARDS:
+        raise RuntimeError(f"At most {MAX_SHARDS} shards are supported")
+    keys = [f'{SHARD_BIND_PREFIX}{index}' for index in range(len(urls))]
+    app.config.setdefault('SQLALCHEMY_BINDS', {}).update(zip(keys, urls))
+    app.config['SHARD_BINDS'] = keys
+
+
+def shard_binds(app=None):
+    """
+    Returns the bind keys of the shards, in shard order.
+    """
+    return (app or current_app).config.get('SHARD_BINDS', ())
+
+
+def shard_count(app=None):
+    """
+    Returns the number of shards, or 0 if sharding is disabled.
+    """
+    return len(shard_binds(app))
+
+
+def is_sharded(app=None):
+    """
+    Returns if posts, likes and comments are sharded.
+    """
+    if app is None and not has_app_context():
+        return False
+    return bool(shard_binds(app))
+
+
+def shard_engine(shard):
+    """
+    Returns the engine of a shard.
+
+    Parameters
+    ----------
+    shard : int
+        The shard number.
+
+    Returns
+    -------
+    Engine
+        The shard's engine.
+    """
+    db = current_app.extensions['sqlalchemy']
+    return db.engines[shard_binds()[shard]]
+
+
+def shard_for_author(author_id):
+    """
+    Returns the shard holding the posts of an author.
+
+    Parameters
+    ----------
+    author_id : int
+        The ID of the author.
+
+    Returns
+    -------
+    int
+        The shard number.
+    """
+    return int(author_id) % shard_count()
+
+
+def shard_for_id(row_id):
+    """
+    Returns the shard holding a post, like or comment, from its ID.
+
+    IDs that no shard could have generated are sent to some shard, where
+    they are simply not found.
+
+    Parameters
+    ----------
+    row_id : int
+        The ID of the post, like or comment.
+
+    Returns
+    -------
+    int
+        The shard number.
+    """
+    return (int(row_id) & (MAX_SHARDS - 1)) % shard_count()
+
+
+def shard_for_instance(instance):
+    """
+    Returns the shard an instance is stored on.
+
+    Parameters
+    ----------
+    instance : Model
+        The instance.
+
+    Returns
+    -------
+    int or None
+        The shard number, or `None` if the instance's table is not
+        sharded.
+    """
+    key = SHARD_KEYS.get(inspect(instance).mapper.local_table.name)
+    if key is None:
+        return None
+    if key == 'author_id':
+        return shard_for_author(instance.author_id)
+    return shard_for_id(getattr(instance, key))
+
+
+def sharded_table(mapper=None, clause=None):
+    """
+    Returns the name of the sharded table a query is for, if any.
+
+    Parameters
+    ----------
+    mapper : Mapper or type, optional
+        The mapper of the query's entity.
+    clause : ClauseElement, optional
+        The statement being executed.
+
+    Returns
+    -------
+    str or None
+        The table name, or `None` if the query is not for a sharded
+        table.
+    """
+    if mapper is not None:
+        name = inspect(mapper).local_table.name
+    else:
+        name = getattr(getattr(clause, 'table', None), 'name', None)
+    return name if name in SHARD_KEYS else None
+
+
+def current_shard():
+    """
+    Returns the shard selected for the current request or thread.
+    """
+    shard = _shard.get()
+    if shard is None and has_app_context():
+        shard = g.get('shard')
+    return shard
+
+
+def require_shard(table):
+    """
+    Returns the selected shard, for a query on a sharded table.
+
+    Raises
+    ------
+    RuntimeError
+        If no shard has been selected.
+    """
+    shard = current_shard()
+    if shard is None:
+        raise RuntimeError(f"No shard selected for a query on {table}")
+    return shard
+
+
+def select_author_shard(author_id):
+    """
+    Selects the shard of an author's posts for the rest of the current
+    request.
+
+    Parameters
+    ----------
+    author_id : int
+        The ID of the author.
+    """
+    if is_sharded():
+        g.shard = shard_for_author(author_id)
+
+
+def shards_for_authors(author_ids):
+    """
+    Returns the shards holding the posts of some authors.
+
+    Parameters
+    ----------
+    author_ids : iterable of int
+        The IDs of the authors.
+
+    Returns
+    -------
+    set of int or None
+        The shard numbers, or `None` if sharding is disabled.
+    """
+    if not is_sharded():
+        return None
+    return {shard_for_author(author_id) for author_id in author_ids}
+
+
+@contextmanager
+def use_shard(shard):
+    """
+    Selects a shard for the duration of a `with` block.
+
+    Parameters
+    ----------
+    shard : int
+        The shard number.
+    """
+    token = _shard.set(shard)
+    try:
+        yield shard
+    finally:
+        _shard.reset(token)
+
+
+def select_post_shard():
+    """
+    Selects the shard of the post in the URL.
+
+    Registered as a `before_request` hook of the post endpoints.
+    """
+    post_id = (request.view_args or {}).get('post_id')
+    if post_id is not None and is_sharded():
+        g.shard = shard_for_id(post_id)
+
+
+def next_id(session, connection, shard):
+    """
+    Returns a new ID for a row on a shard.
+
+    Each session reserves a block of `ID_BLOCK_SIZE` IDs from the
+    shard's `id_blocks` table, on the same connection as the rows being
+    inserted. If the transaction rolls back, so does the reservation,
+    and the block is forgotten with it.
+
+    Parameters
+    ----------
+    session : Session
+        The session inserting the row.
+    connection : Connection
+        The connection to the shard.
+    shard : int
+        The shard number.
+
+    Returns
+    -------
+    int
+        The ID.
+    """
+    blocks = session.info.setdefault('id_blocks', {})
+    block = blocks.get(shard)
+    if block is None or block[1] == ID_BLOCK_SIZE:
+        result = connection.execute(id_blocks.insert())
+        block = blocks[shard] = [result.inserted_primary_key[0], 0]
+    local_id = block[0] * ID_BLOCK_SIZE + block[1]
+    block[1] += 1
+    return (local_id << SHARD_BITS) | shard
+
+
+def _assign_id(mapper, connection, target):
+    """
+    Gives a new sharded row an ID carrying its shard.
+    """
+    if mapper.local_table.name in SHARD_KEYS and target.id is None \
+            and is_sharded():
+        target.id = next_id(object_session(target), connection,
+                            shard_for_instance(target))
+
+
+def _forget_id_blocks(session):
+    """
+    Forgets the ID blocks reserved by a session's ended transaction.
+    """
+    session.info.pop('id_blocks', None)
+
+
+def shard_metadata():
+    """
+    Returns the metadata of the tables stored on each shard.
+
+    The shards can't enforce foreign keys to tables on the primary, so
+    those are left out.
+
+    Returns
+    -------
+    MetaData
+        The metadata.
+    """
+    db = current_app.extensions['sqlalchemy']
+    metadata = MetaData()
+    id_blocks.to_metadata(metadata)
+    for name in SHARD_KEYS:
+        table = db.metadata.tables[name].to_metadata(metadata)
+        for foreign_key in list(table.foreign_keys):
+            if foreign_key.target_fullname.split('.')[0] not in SHARD_KEYS:
+                table.foreign_keys.discard(foreign_key)
+                foreign_key.parent.foreign_keys.discard(foreign_key)
+                table.constraints.discard(foreign_key.constraint)
+    return metadata
+
+
+def create_all():
+    """
+    Creates the sharded tables on every shard.
+    """
+    metadata = shard_metadata()
+    for shard in range(shard_count()):
+        metadata.create_all(shard_engine(shard))
+
+
+def drop_all():
+    """
+    Drops the sharded tables from every shard.
+    """
+    metadata = shard_metadata()
+    for shard in range(shard_count()):
+        metadata.drop_all(shard_engine(shard))
+
+
+def _run_on_shard(app, shard, fn):
+    """
+    Calls a function in a new application context, on a shard.
+    """
+    with app.app_context(), use_shard(shard):
+        return fn()
+
+
+def gather(fn, shards=None):
+    """
+    Calls a function once on each shard, all at the same time.
+
+    Each call runs in its own thread and database session, with its
+    shard selected. The session is closed when the call returns, so
+    the function must load everything that will be used later.
+
+    Without sharding, the function is called once, in the current
+    session.
+
+    Parameters
+    ----------
+    fn : callable
+        The function to call, without arguments.
+    shards : iterable of int, optional
+        The shards to call the function on. Defaults to all of them.
+
+    Returns
+    -------
+    list
+        The result of each call, in shard order.
+    """
+    global _executor  # pylint: disable=global-statement
+    if not is_sharded():
+        return [fn()]
+    shards = sorted(set(range(shard_count()) if shards is None else shards))
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    if len(shards) == 1:
+        return [_run_on_shard(app, shards[0], fn)]
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_GATHER_WORKERS,
+                                       thread_name_prefix='shard')
+    futures = [_executor.submit(_run_on_shard, app, shard, fn)
+               for shard in shards]
+    return [future.result() for future in futures]
+
+
+def forget_executor():
+    """
+    Forgets the thread pool of `gather`, so that a new one is started
+    when it is next needed.
+
+    The threads of a pool don't survive a fork, so a forked worker must
+    call this before gathering from shards.
+    """
+    global _executor  # pylint: disable=global-statement
+    _executor = None
+
+
+def gather_page(build_query, order_by, page, per_page, shards=None,
+                options=None):
+    """
+    Returns one page of rows from many shards, in descending order.
+
+    Every shard returns its first `page * per_page` rows in order, and
+    the sorted results are merged, so the page matches the page that
+    one database holding all of the rows would return.
+
+    The rows' relationships are loaded with them, as they are used
+    after their shard's session has closed.
+
+    Parameters
+    ----------
+    build_query : callable
+        Returns the query for the rows on the selected shard, without
+        ordering or pagination.
+    order_by : list of InstrumentedAttribute
+        The attributes to sort the rows by, descending.
+    page : int
+        The page number, starting from 1.
+    per_page : int
+        The number of rows on a page.
+    shards : iterable of int, optional
+        The shards to read from. Defaults to all of them.
+    options : tuple of loader options, optional
+        The relationships to load with the rows. Defaults to all of
+        them.
+
+    Returns
+    -------
+    list
+        The rows on the page.
+    """
+    # Invalid values fall back to the defaults, as in `paginate`
+    page = page if page >= 1 else 1
+    per_page = per_page if per_page >= 1 else 20
+    limit = page * per_page
+    options = (selectinload('*'),) if options is None else options
+
+    def query():
+        return build_query() \
+            .options(*options) \
+            .order_by(*(attribute.desc() for attribute in order_by))
+
+    if not is_sharded():
+        return query().limit(per_page).offset((page - 1) * per_page).all()
+
+    def fetch():
+        return query().limit(limit).all()
+
+    def sort_key(row):
+        return tuple(getattr(row, attribute.key) for attribute in order_by)
+
+    rows = heapq.merge(*gather(fetch, shards), key=sort_key, reverse=True)
+    return list(islice(rows, (page - 1) * per_page, limit))
+
+
+def gather_all(build_query, shards=None):
+    """
+    Returns every row of a query from many shards, with their
+    relationships loaded.
+
+    Parameters
+    ----------
+    build_query : callable
+        Returns the query for the rows on the selected shard.
+    shards : iterable of int, optional
+        The shards to read from. Defaults to all of them.
+
+    Returns
+    -------
+    list
+        The rows, shard by shard.
+    """
+    def fetch():
+        return build_query().options(selectinload('*')).all()
+
+    return [row for rows in gather(fetch, shards) for row in rows]
+
+
+def get_many(model, ids):
+    """
+    Returns the sharded rows with the given IDs, from their shards.
+
+    Parameters
+    ----------
+    model : type
+        The model of the rows.
+    ids : iterable of int
+        The IDs of the rows.
+
+    Returns
+    -------
+    list
+        The rows that exist, in no particular order.
+    """
+    ids = list(ids)
+    if not ids:
+        return []
+    if not is_sharded():
+        return model.query.filter(model.id.in_(ids)).all()
+
+    ids_by_shard = defaultdict(list)
+    for row_id in ids:
+        ids_by_shard[shard_for_id(row_id)].append(row_id)
+    return gather_all(
+        lambda: model.query.filter(model.id.in_(ids_by_shard[current_shard()])),
+        ids_by_shard)
+
+
+def scan(build_query, batch_size):
+    """
+    Yields every row of a query from each shard in turn, in batches.
+
+    Parameters
+    ----------
+    build_query : callable
+        Returns the query for the rows on the selected shard.
+    batch_size : int
+        The number of rows loaded at a time.
+
+    Yields
+    ------
+    Model
+        The rows.
+    """
+    if not is_sharded():
+        yield from build_query().yield_per(batch_size)
+        return
+    for shard in range(shard_count()):
+        with use_shard(shard):
+            yield from build_query().yield_per(batch_size)
+
+
+def load_collections(obj, *names):
+    """
+    Loads collections of sharded rows on an object from every shard.
+
+    A user's likes and comments are spread over the shards of the posts
+    they are on, so can't be lazy loaded from a single shard. The rows'
+    own relationships are loaded with them, so that deleting the object
+    cascades to them.
+
+    Parameters
+    ----------
+    obj : Model
+        The object, in the current session.
+    names : str
+        The names of the collections to load.
+    """
+    if not is_sharded():
+        return
+    session = object_session(obj)
+    mapper = inspect(obj).mapper
+    for name in names:
+        target = mapper.relationships[name].mapper.class_
+        rows = []
+        for shard in range(shard_count()):
+            with use_shard(shard):
+                rows += session.query(target) \
+                    .with_parent(obj, getattr(type(obj), name)) \
+                    .options(selectinload('*')).all()
+        set_committed_value(obj, name, rows)
+
+
+def init_app(app):
+    """
+    Enables sharding for an application, if it has shards configured.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    """
+    if not shard_binds(app):
+        return
+    db = app.extensions['sqlalchemy']
+    if not event.contains(db.Model, 'before_insert', _assign_id):
+        event.listen(db.Model, 'before_insert', _assign_id, propagate=True)
+        event.listen(Session, 'after_commit', _forget_id_blocks)
+        event.listen(Session, 'after_rollback', _forget_id_blocks)
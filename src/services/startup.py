@@ -0,0 +1,322 @@
+"""
+This module contains the lazy parts of application startup, and the
+import time profile of a cold start.
+
+Creating the application only configures it and registers what every
+process needs: the extensions, the models and the CLI commands. The
+HTTP surface, the response formats and compression, the bcrypt and JWT
+extensions, and the blueprints of the API endpoints and their error
+handlers, is only needed by a process serving requests, so it is set up
+by `defer` just before the first request. A `flask` CLI command, or a
+background worker, never imports the API controllers, nor the JWT
+package, at all.
+
+A pre-fork server, such as gunicorn with `wsgi.py`, creates the
+application once and forks its workers from it. `before_fork` finishes
+everything that can be shared before forking: the HTTP surface, the
+mappers, the URL matcher and the compiled serializers. It then freezes
+them out of the garbage collector, so that collections in the workers
+don't write to, and so copy, the memory pages holding them.
+`after_fork` gives each worker its own database connections, and
+`warm_up` optionally opens them before the worker accepts traffic.
+
+`profile` starts the application in a new interpreter with `python -X
+importtime`, and reports where the time of a cold start goes, so that
+the startup time of autoscaled workers can be tracked.
+"""
+import gc
+import json
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from threading import Lock
+
+from marshmallow import Schema
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+from init import db
+from services import serializers, sharding
+
+
+# The code run by `profile` in a new interpreter, reporting the time
+# taken by each step of startup as JSON on its last line
+PROFILE_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import main
+from services import startup
+imported = time.perf_counter()
+app = main.create_app()
+created = time.perf_counter()
+startup.finish(app)
+finished = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create': created - imported,
+                  'http': finished - created}))
+"""
+
+
+class DeferredSetup:
+    """
+    WSGI middleware running the deferred setup of an application before
+    its first request.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    wsgi_app : callable
+        The WSGI application being wrapped.
+    """
+
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.steps = []
+        self.done = False
+        self.lock = Lock()
+
+    def finish(self):
+        """
+        Runs the deferred steps, once, if they haven't been run yet.
+
+        A step is only removed once it has succeeded, so if one raises,
+        the error is raised again by every request, which runs the step
+        again, instead of the application serving without it.
+        """
+        if self.done:
+            return
+        with self.lock:
+            # Another thread may have run them while this one waited
+            while self.steps:
+                self.steps[0](self.app)
+                self.steps.pop(0)
+            self.done = True
+
+    def __call__(self, environ, start_response):
+        if not self.done:
+            self.finish()
+        return self.wsgi_app(environ, start_response)
+
+
+def defer(app, step):
+    """
+    Defers a step of an application's setup until just before its
+    first request.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    step : callable
+        Called with the application.
+    """
+    setup = app.extensions.get('deferred_setup')
+    if setup is None:
+        setup = app.extensions['deferred_setup'] = DeferredSetup(
+            app, app.wsgi_app)
+        app.wsgi_app = setup
+    setup.steps.append(step)
+    setup.done = False
+
+
+def finish(app):
+    """
+    Runs the deferred steps of an application's setup now, instead of
+    before its first request.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+
+    Returns
+    -------
+    Flask
+        The application.
+    """
+    setup = app.extensions.get('deferred_setup')
+    if setup is not None:
+        setup.finish()
+    return app
+
+
+def _schemas():
+    """
+    Returns the schema instances defined by the imported models.
+    """
+    schemas = []
+    for name, module in list(sys.modules.items()):
+        if name.startswith('models.') and module is not None:
+            schemas += [value for value in vars(module).values()
+                        if isinstance(value, Schema)]
+    return schemas
+
+
+def before_fork(app):
+    """
+    Finishes the setup of an application in a pre-fork server's master
+    process, so that its workers share it.
+
+    Any database connection opened by the master is closed, as it can't
+    be shared with the workers.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+
+    Returns
+    -------
+    Flask
+        The application.
+    """
+    finish(app)
+    configure_mappers()
+    app.url_map.update()
+    serializers.compile_all(_schemas())
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+    # Move everything created so far out of the garbage collector's
+    # reach, so that the workers never touch its reference counts
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+def after_fork(app):
+    """
+    Gives a forked worker its own database connections.
+
+    The connection pools inherited from the master are replaced without
+    closing their connections, which the master may still be using.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    sharding.forget_executor()
+
+
+def warm_up(app, connections):
+    """
+    Opens a worker's database connections, and the threads gathering
+    from shards, before it accepts traffic.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    connections : int
+        The number of connections opened to each database, at most the
+        size of its pool.
+
+    Returns
+    -------
+    int
+        The number of connections opened.
+    """
+    opened = 0
+    with app.app_context():
+        for engine in db.engines.values():
+            size = min(connections, getattr(engine.pool, 'size', lambda: 1)())
+            # Hold every connection at once, so that the pool opens
+            # new ones instead of handing the same one back
+            held = []
+            try:
+                for _ in range(size):
+                    held.append(engine.connect())
+                    held[-1].execute(text('SELECT 1'))
+            finally:
+                for connection in held:
+                    connection.close()
+            opened += len(held)
+
+        # Start the threads gathering from shards
+        sharding.gather(sharding.current_shard)
+    return opened
+
+
+def parse_importtime(output):
+    """
+    Parses the report of `python -X importtime`.
+
+    Parameters
+    ----------
+    output : str
+        The standard error of the interpreter.
+
+    Returns
+    -------
+    list of tuple
+        For each imported module, in import order, its name, the
+        microseconds spent importing it alone, and including the modules
+        it imported.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            # The header of the report
+            continue
+        modules.append((name.strip(), int(own), int(cumulative)))
+    return modules
+
+
+def profile(root_path, limit=20):
+    """
+    Profiles a cold start of the application in a new interpreter.
+
+    Parameters
+    ----------
+    root_path : str
+        The directory the application is imported from.
+    limit : int, optional
+        The number of modules and packages reported.
+
+    Returns
+    -------
+    dict
+        The wall time of the interpreter and of each step of startup, in
+        seconds, and the modules and top level packages which took the
+        longest to import, in milliseconds.
+
+    Raises
+    ------
+    RuntimeError
+        If the application could not be started.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROFILE_SCRIPT],
+        cwd=root_path, capture_output=True, text=True, check=False)
+    total = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    steps = json.loads(result.stdout.strip().splitlines()[-1])
+
+    modules = parse_importtime(result.stderr)
+    packages = defaultdict(int)
+    for name, own, _ in modules:
+        packages[name.split('.')[0]] += own
+
+    def slowest(items):
+        return [{'name': name, 'ms': round(us / 1000, 1)}
+                for name, us in sorted(items, key=lambda item: -item[1])[:limit]]
+
+    return {
+        'total': round(total, 3),
+        'steps': {step: round(seconds, 3) for step, seconds in steps.items()},
+        'modules': len(modules),
+        'slowest_modules': slowest((name, own) for name, own, _ in modules),
+        'slowest_packages': slowest(packages.items()),
+    }
@@ -0,0 +1,401 @@
+"""
+This module contains the pub/sub behind the feed's event stream.
+
+Each process has a `Broker`, which delivers messages to the streams
+subscribed to their topic, here the IDs of the authors of new posts.
+Streams hold their undelivered messages in a bounded queue, so a slow
+client can't make the broker wait, and a stream whose queue overflows
+is ended, for its client to reconnect and catch up.
+
+Posts are created by whichever process handles the request, so the
+broker is fed from the outbox rather than by the controllers: a relay
+thread in each process tails `outbox_events` every
+`STREAM_POLL_INTERVAL` seconds and publishes the `PostCreated` events
+to the local broker. The outbox stands in for a message broker shared
+by the processes, and only the relay would change if one was used. The
+relay only polls while the process has streams open.
+
+Messages are identified by the ID of their event, which only ever
+increases, so a client reconnecting with the ID of the last message it
+received is sent the messages it missed from the outbox, up to
+`STREAM_REPLAY_LIMIT` events back, instead of reloading its feed.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import func
+
+from init import db
+from models.outbox import OutboxEvent
+from services import events
+
+
+logger = logging.getLogger(__name__)
+
+# The number of undelivered messages a stream holds before it is ended
+MAX_PENDING = 256
+
+# The number of milliseconds a client waits before reconnecting
+RETRY_MILLISECONDS = 3000
+
+
+class Subscription:
+    """
+    A stream's subscription to some topics of a broker.
+
+    Attributes
+    ----------
+    topics : frozenset
+        The topics subscribed to.
+    after : int
+        The ID of the last message queued, or sent to the stream
+        otherwise, so only later messages are delivered.
+    messages : Queue
+        The undelivered messages, as `(id, data)` pairs.
+    overflowed : bool
+        If a message was dropped because the queue was full.
+    """
+
+    def __init__(self, topics, after):
+        self.topics = frozenset(topics)
+        self.after = after
+        self.messages = queue.Queue(maxsize=MAX_PENDING)
+        self.overflowed = False
+
+    def put(self, message_id, data):
+        """
+        Queues a message, unless the stream has already been sent it.
+        """
+        if message_id <= self.after:
+            return
+        self.after = message_id
+        try:
+            self.messages.put_nowait((message_id, data))
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """
+        Returns the next message, or `None` if there is none within
+        `timeout` seconds.
+        """
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broker:
+    """
+    A thread-safe, in-process publisher of messages to subscriptions.
+    """
+
+    def __init__(self):
+        self.subscriptions = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, topics, after):
+        """
+        Subscribes a new stream to some topics.
+
+        Parameters
+        ----------
+        topics : iterable
+            The topics.
+        after : int
+            The ID of the last message the stream has been sent.
+
+        Returns
+        -------
+        Subscription
+            The subscription.
+        """
+        subscription = Subscription(topics, after)
+        with self.lock:
+            for topic in subscription.topics:
+                self.subscriptions[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Removes a subscription from its topics.
+        """
+        with self.lock:
+            for topic in subscription.topics:
+                subscribers = self.subscriptions.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscriptions[topic]
+
+    def publish(self, topic, message_id, data):
+        """
+        Delivers a message to every subscription to its topic.
+
+        Parameters
+        ----------
+        topic : hashable
+            The topic.
+        message_id : int
+            The ID of the message.
+        data : dict
+            The JSON serializable message.
+        """
+        with self.lock:
+            subscribers = list(self.subscriptions.get(topic, ()))
+        for subscription in subscribers:
+            subscription.put(message_id, data)
+
+    def oldest(self):
+        """
+        Returns the lowest `after` of the subscriptions, or `None` if
+        there are none.
+        """
+        with self.lock:
+            return min((subscription.after
+                        for subscribers in self.subscriptions.values()
+                        for subscription in subscribers), default=None)
+
+
+# The broker of the current process
+broker = Broker()
+
+# The ID of the last event the relay has published, or `None` when it
+# is idle
+_relayed_id = None
+
+# The ID of the process whose relay thread is running, so that a forked
+# process starts its own
+_relay_pid = None
+_relay_lock = threading.Lock()
+
+
+def message(post_event):
+    """
+    Returns the message published for a `PostCreated` event.
+    """
+    return {'post_id': post_event.payload['post_id'],
+            'author_id': post_event.payload['author_id']}
+
+
+def relay(app):
+    """
+    Publishes the `PostCreated` events recorded since the last call to
+    the broker.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+
+    Returns
+    -------
+    int
+        The number of events read.
+    """
+    global _relayed_id  # pylint: disable=global-statement
+    start = broker.oldest()
+    if start is None:
+        _relayed_id = None
+        return 0
+    if _relayed_id is None or start < _relayed_id:
+        _relayed_id = start
+
+    batch_size = app.config['OUTBOX_BATCH_SIZE']
+    count = 0
+    with app.app_context():
+        try:
+            while True:
+                batch = db.session.execute(
+                    db.select(OutboxEvent).where(OutboxEvent.id > _relayed_id)
+                    .order_by(OutboxEvent.id).limit(batch_size)
+                ).scalars().all()
+                batch = events.settled(batch, _relayed_id,
+                                       app.config['OUTBOX_GAP_TIMEOUT'])
+                for event in batch:
+                    if event.type == events.POST_CREATED:
+                        broker.publish(event.payload['author_id'], event.id,
+                                       message(event))
+                if batch:
+                    _relayed_id = batch[-1].id
+                    count += len(batch)
+                if len(batch) < batch_size:
+                    return count
+        finally:
+            db.session.remove()
+
+
+def _run_relay(app):
+    """
+    Relays the outbox to the broker of the current process periodically.
+    """
+    while True:
+        time.sleep(app.config['STREAM_POLL_INTERVAL'])
+        try:
+            relay(app)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not relay the outbox to the streams")
+
+
+def _start_relay(app):
+    """
+    Starts the relay thread of the current process, once.
+    """
+    global _relay_pid  # pylint: disable=global-statement
+    with _relay_lock:
+        if _relay_pid == os.getpid():
+            return
+        _relay_pid = os.getpid()
+    threading.Thread(target=_run_relay, args=(app,),
+                     name='stream-relay', daemon=True).start()
+
+
+def head():
+    """
+    Returns the ID of the latest event in the outbox, or 0.
+    """
+    return db.session.execute(
+        db.select(func.max(OutboxEvent.id))).scalar() or 0
+
+
+def replay(author_ids, after, until):
+    """
+    Returns the messages for the posts some authors created between two
+    events.
+
+    Parameters
+    ----------
+    author_ids : collection of int
+        The IDs of the authors.
+    after : int
+        The ID of the last event the client received.
+    until : int
+        The ID of the last event to replay.
+
+    Returns
+    -------
+    list of tuple or None
+        The messages, as `(id, data)` pairs, or `None` if more than
+        `STREAM_REPLAY_LIMIT` events would be read, or some have been
+        pruned, and the client must reload its feed instead.
+    """
+    if after >= until:
+        return []
+    limit = current_app.config['STREAM_REPLAY_LIMIT']
+    # Events are pruned oldest first, so those after the client's last
+    # one are all there if the oldest left isn't after it
+    oldest = db.session.execute(db.select(func.min(OutboxEvent.id))).scalar()
+    if oldest is None or oldest > after + 1:
+        return None
+    post_events = db.session.execute(
+        db.select(OutboxEvent)
+        .where(OutboxEvent.id > after, OutboxEvent.id <= until,
+               OutboxEvent.type == events.POST_CREATED)
+        .order_by(OutboxEvent.id).limit(limit + 1)).scalars().all()
+    if len(post_events) > limit:
+        return None
+    return [(event.id, message(event)) for event in post_events
+            if event.payload['author_id'] in author_ids]
+
+
+def subscribe(author_ids, after):
+    """
+    Subscribes a new stream to the posts some authors create, starting
+    the relay of the current process if needed.
+
+    Parameters
+    ----------
+    author_ids : iterable of int
+        The IDs of the authors.
+    after : int
+        The ID of the last event the stream has been sent.
+
+    Returns
+    -------
+    Subscription
+        The subscription, to be passed to `broker.unsubscribe` once the
+        stream ends.
+    """
+    subscription = broker.subscribe(author_ids, after)
+    if _relay_pid != os.getpid():
+        _start_relay(current_app._get_current_object())  # pylint: disable=protected-access
+    return subscription
+
+
+def format_event(message_id, data, event='post'):
+    """
+    Returns a message as a server-sent event.
+    """
+    return (f'id: {message_id}\nevent: {event}\n'
+            f'data: {current_app.json.dumps(data)}\n\n')
+
+
+def stream(subscription, missed, until):
+    """
+    Yields the server-sent events of a stream, until it has been open
+    for `STREAM_TIMEOUT` seconds or its subscription overflows.
+
+    A comment is sent every `STREAM_HEARTBEAT` seconds without messages,
+    so that proxies keep the connection open and the client notices
+    when it drops. The subscription is removed when the stream ends.
+
+    Parameters
+    ----------
+    subscription : Subscription
+        The stream's subscription.
+    missed : list of tuple or None
+        The messages the client missed, from `replay`, or `None` if it
+        must reload its feed.
+    until : int
+        The ID of the last event replayed.
+
+    Yields
+    ------
+    str
+        The events.
+    """
+    heartbeat = current_app.config['STREAM_HEARTBEAT']
+    deadline = time.monotonic() + current_app.config['STREAM_TIMEOUT']
+    try:
+        yield f'retry: {RETRY_MILLISECONDS}\n\n'
+        if missed is None:
+            yield format_event(until, {}, event='reset')
+        else:
+            for message_id, data in missed:
+                yield format_event(message_id, data)
+
+        # The client reconnects from the last event it received, so an
+        # overflowing stream ends without losing any
+        while not subscription.overflowed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            pending = subscription.get(min(heartbeat, remaining))
+            if pending is None:
+                yield ': heartbeat\n\n'
+            else:
+                yield format_event(*pending)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def init_app(app):
+    """
+    Sets the defaults of the stream settings of an application.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    """
+    app.config.setdefault('STREAM_HEARTBEAT', 15)
+    app.config.setdefault('STREAM_TIMEOUT', 300)
+    app.config.setdefault('STREAM_POLL_INTERVAL', 1)
+    app.config.setdefault('STREAM_REPLAY_LIMIT', 1000)
+    app.config.setdefault('OUTBOX_BATCH_SIZE', 500)
+    app.config.setdefault('OUTBOX_GAP_TIMEOUT', 30)
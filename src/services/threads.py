@@ -0,0 +1,223 @@
+"""
+This module contains the threading of comments.
+
+Each comment stores its materialized path: the fixed width hexadecimal
+IDs of the root of its thread, of each of its ancestors and of itself.
+The path of a reply starts with the path of the comment it replies to,
+so:
+
+- A subtree is a range of paths, `[path, path + 'g')`, read with a
+  single range scan of the `(post_id, path)` index.
+- Ordering by path lists a thread depth first, each comment followed by
+  its replies, oldest first.
+- A thread is the range of paths starting with its root's ID.
+
+Reading a whole subtree, or a page of it, therefore takes one query no
+matter how deep it is, instead of one query per level. Pages are
+keyset paginated on the path, so a page deep into a long thread costs
+the same as the first one.
+"""
+from sqlalchemy import and_, event, func, update
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+
+from init import db
+from models.comment import Comment, MAX_DEPTH, PATH_SEGMENT_LENGTH
+
+
+# Sorts after every hexadecimal digit, so that `path + PATH_END` is
+# greater than the path of every comment in the subtree of `path`
+PATH_END = 'g'
+
+# The characters of a path
+HEX_DIGITS = frozenset('0123456789abcdef')
+
+
+def segment(comment_id):
+    """
+    Returns the part of a path identifying a single comment.
+
+    Parameters
+    ----------
+    comment_id : int
+        The ID of the comment.
+
+    Returns
+    -------
+    str
+        The comment's ID as fixed width hexadecimal.
+    """
+    return format(comment_id, f'0{PATH_SEGMENT_LENGTH}x')
+
+
+def depth(path):
+    """
+    Returns the number of comments above the comment with a given path.
+    """
+    return len(path) // PATH_SEGMENT_LENGTH - 1
+
+
+def can_reply(parent):
+    """
+    Returns if a comment can be replied to without exceeding `MAX_DEPTH`.
+    """
+    return depth(parent.path) + 1 < MAX_DEPTH
+
+
+def is_cursor(cursor, path):
+    """
+    Returns if a cursor is the path of a comment in the subtree of
+    another comment.
+
+    Parameters
+    ----------
+    cursor : str
+        The cursor from the client.
+    path : str
+        The path of the root of the subtree.
+
+    Returns
+    -------
+    bool
+        If the cursor is valid.
+    """
+    return cursor.startswith(path) and set(cursor) <= HEX_DIGITS \
+        and len(cursor) % PATH_SEGMENT_LENGTH == 0
+
+
+def subtree(post_id, path, include_root=True):
+    """
+    Returns the criteria of the comments in the subtree of a comment.
+
+    Parameters
+    ----------
+    post_id : int
+        The ID of the post the comment is on.
+    path : str
+        The path of the comment.
+    include_root : bool, optional
+        If the comment itself matches.
+
+    Returns
+    -------
+    ColumnElement
+        The criteria.
+    """
+    lower = Comment.path >= path if include_root else Comment.path > path
+    return and_(Comment.post_id == post_id, lower,
+                Comment.path < path + PATH_END)
+
+
+def get_replies(comment, limit, after=None):
+    """
+    Returns a page of the replies to a comment, at every depth, in
+    thread order.
+
+    Parameters
+    ----------
+    comment : Comment
+        The comment.
+    limit : int
+        The maximum number of replies returned.
+    after : str, optional
+        The path of the last reply of the previous page.
+
+    Returns
+    -------
+    list of Comment
+        The replies.
+    """
+    query = Comment.query.filter(
+        subtree(comment.post_id, comment.path, include_root=False))
+    if after is not None:
+        query = query.filter(Comment.path > after)
+    return query.order_by(Comment.path).limit(limit).all()
+
+
+def get_threads(post_id, limit, replies, before=None):
+    """
+    Returns the newest threads on a post, each with its first replies,
+    in a single query.
+
+    The roots of the threads are found with the `(post_id, parent_id,
+    id)` index. Each thread's comments are then numbered in thread
+    order with `ROW_NUMBER()`, and only the first ones are kept.
+
+    Parameters
+    ----------
+    post_id : int
+        The ID of the post.
+    limit : int
+        The maximum number of threads returned.
+    replies : int
+        The maximum number of replies returned with each thread.
+    before : int, optional
+        The ID of the root of the last thread of the previous page.
+
+    Returns
+    -------
+    list of tuple
+        For each thread, newest first, its root, its first replies in
+        thread order, and if it has more replies.
+    """
+    roots = db.select(Comment.path).where(Comment.post_id == post_id,
+                                          Comment.parent_id.is_(None))
+    if before is not None:
+        roots = roots.where(Comment.id < before)
+    roots = roots.order_by(Comment.id.desc()).limit(limit).subquery()
+
+    # Number each thread's comments, with one more reply than is needed
+    # to tell if there are more
+    thread = func.substr(Comment.path, 1, PATH_SEGMENT_LENGTH)
+    ranked = db.select(
+        Comment,
+        func.row_number().over(partition_by=thread, order_by=Comment.path)
+        .label('position')
+    ).join(roots, and_(Comment.path >= roots.c.path,
+                       Comment.path < roots.c.path + PATH_END)) \
+        .where(Comment.post_id == post_id).subquery()
+    comment = aliased(Comment, ranked)
+    rows = db.session.execute(
+        db.select(comment, ranked.c.position)
+        .where(ranked.c.position <= replies + 2)
+        .order_by(func.substr(ranked.c.path, 1, PATH_SEGMENT_LENGTH).desc(),
+                  ranked.c.path)).all()
+
+    # The root of each thread comes first, followed by its replies
+    threads = []
+    more = set()
+    for row, position in rows:
+        if position == 1:
+            threads.append((row, []))
+        elif position <= replies + 1:
+            threads[-1][1].append(row)
+        else:
+            more.add(threads[-1][0].id)
+    return [(root, thread_replies, root.id in more)
+            for root, thread_replies in threads]
+
+
+def _complete_path(mapper, connection, target):
+    """
+    Appends a new comment's ID to its path, once it has one.
+
+    Registered as an `after_insert` listener of `Comment`.
+    """
+    path = (target.path or '') + segment(target.id)
+    table = mapper.local_table
+    connection.execute(update(table).where(table.c.id == target.id)
+                       .values(path=path))
+    set_committed_value(target, 'path', path)
+
+
+def init_app(_app):
+    """
+    Gives new comments their paths.
+
+    Parameters
+    ----------
+    _app : Flask
+        The application.
+    """
+    if not event.contains(Comment, 'after_insert', _complete_path):
+        event.listen(Comment, 'after_insert', _complete_path)
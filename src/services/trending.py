@@ -0,0 +1,276 @@
+"""
+This module contains the ranking of trending posts.
+
+Posts are ranked by their likes and comments over the last few hours,
+each weighted by how recent it is: engagement loses half of its weight
+every `TRENDING_HALF_LIFE` hours, and engagement older than
+`TRENDING_HOURS` hours doesn't count at all.
+
+The `trending` consumer of the outbox counts likes and comments as they
+are recorded, into a ring buffer of `TRENDING_HOURS` hourly buckets per
+post in the `engagement_buckets` table. A bucket is reset when a new
+hour maps to it, and buckets which have left the window are deleted, so
+the table only ever holds recent engagement. Likes and comments which
+are removed, one at a time or in bulk, are withdrawn from the post's
+newest buckets, so liking and unliking a post over and over doesn't
+make it trend.
+
+For each post with new engagement, the consumer also updates its score
+in the `trending_posts` table. Scores are forward decayed: the weight
+of an hour grows with the hour instead of shrinking with its age, which
+ranks posts in the same order at any moment, so the scores of posts
+without new engagement never need updating. A request reads the best
+scored posts from the score index, and only their buckets are summed to
+rank them exactly. Neither touches the `likes` or `comments` tables.
+"""
+import math
+import time
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import delete
+
+from init import db
+from models.trending import EngagementBucket, TrendingPost
+from services import events
+
+
+# The weight of a like and of a comment
+LIKE_WEIGHT = 1
+COMMENT_WEIGHT = 2
+
+# The number of best scored posts ranked exactly for each post returned
+CANDIDATE_FACTOR = 4
+
+
+def current_hour():
+    """
+    Returns the number of hours since the epoch.
+    """
+    return int(time.time() // 3600)
+
+
+def weight(bucket):
+    """
+    Returns the undecayed engagement of a bucket.
+    """
+    return bucket.likes * LIKE_WEIGHT + bucket.comments * COMMENT_WEIGHT
+
+
+def forward_score(buckets, half_life):
+    """
+    Returns the forward decayed score of some buckets of a post.
+
+    The score is the base 2 logarithm of the sum of each bucket's
+    engagement times `2 ** (hour / half_life)`, which is too large to
+    hold without the logarithm.
+
+    Parameters
+    ----------
+    buckets : list of EngagementBucket
+        The buckets.
+    half_life : float
+        The number of hours after which engagement has half its weight.
+
+    Returns
+    -------
+    float
+        The score.
+    """
+    exponents = [math.log2(weight(bucket)) + bucket.hour / half_life
+                 for bucket in buckets if weight(bucket) > 0]
+    if not exponents:
+        return float('-inf')
+    top = max(exponents)
+    return top + math.log2(sum(2 ** (exponent - top) for exponent in exponents))
+
+
+def _tally(batch, oldest):
+    """
+    Returns the likes and comments of a batch of events, by post and
+    hour, those withdrawn, by post, and the IDs of the posts removed.
+    """
+    counts = defaultdict(lambda: [0, 0])
+    withdrawn = defaultdict(lambda: [0, 0])
+    removed = set()
+    for event in batch:
+        payload = event.payload
+        if event.type == events.POST_DELETED:
+            removed.add(payload["post_id"])
+        elif event.type == events.POSTS_PURGED:
+            removed.update(payload["post_ids"])
+        elif event.type == events.POST_UNLIKED:
+            withdrawn[payload["post_id"]][0] += 1
+        elif event.type == events.COMMENT_DELETED:
+            withdrawn[payload["post_id"]][1] += 1
+        elif event.type in (events.LIKES_PURGED, events.COMMENTS_PURGED):
+            # Purges recorded before they named their posts are skipped
+            for post_id in payload.get("post_ids", ()):
+                withdrawn[post_id][
+                    0 if event.type == events.LIKES_PURGED else 1] += 1
+        else:
+            hour = int(event.created_at.timestamp() // 3600)
+            if hour >= oldest:
+                counts[(payload["post_id"], hour)][
+                    0 if event.type == events.POST_LIKED else 1] += 1
+    return counts, withdrawn, removed
+
+
+def _withdraw(buckets, likes, comments):
+    """
+    Takes likes and comments out of a post's buckets, newest first.
+
+    Events don't say when the engagement they remove was counted, so
+    taking it from the newest buckets undoes a like or comment removed
+    soon after it was made.
+    """
+    for bucket in sorted(buckets, key=lambda bucket: -bucket.hour):
+        taken = min(likes, bucket.likes)
+        bucket.likes -= taken
+        likes -= taken
+        taken = min(comments, bucket.comments)
+        bucket.comments -= taken
+        comments -= taken
+
+
+@events.consumer(events.POST_LIKED, events.COMMENT_CREATED,
+                 events.POST_UNLIKED, events.COMMENT_DELETED,
+                 events.COMMENTS_PURGED, events.LIKES_PURGED,
+                 events.POST_DELETED, events.POSTS_PURGED, name='trending')
+def apply_events(batch):
+    """
+    Counts the likes and comments of a batch of events into their posts'
+    buckets, withdraws those removed since, and updates the scores of
+    those posts.
+
+    Parameters
+    ----------
+    batch : list of OutboxEvent
+        The events, in the order they were recorded.
+    """
+    ring = current_app.config['TRENDING_HOURS']
+    half_life = current_app.config['TRENDING_HALF_LIFE']
+    oldest = current_hour() - ring + 1
+    counts, withdrawn, removed = _tally(batch, oldest)
+
+    if removed:
+        counts = {key: value for key, value in counts.items()
+                  if key[0] not in removed}
+        withdrawn = {key: value for key, value in withdrawn.items()
+                     if key not in removed}
+        db.session.execute(delete(EngagementBucket.__table__).where(
+            EngagementBucket.__table__.c.post_id.in_(removed)))
+        db.session.execute(delete(TrendingPost.__table__).where(
+            TrendingPost.__table__.c.post_id.in_(removed)))
+
+    post_ids = {post_id for post_id, _ in counts} | set(withdrawn)
+    if post_ids:
+        buckets = {(bucket.post_id, bucket.slot): bucket
+                   for bucket in EngagementBucket.query.filter(
+                       EngagementBucket.post_id.in_(post_ids))}
+
+        # Add the counts to the buckets, oldest hour first, reusing the
+        # slots of hours which have left the window
+        for (post_id, hour), (likes, comments) in sorted(
+                counts.items(), key=lambda item: item[0][1]):
+            bucket = buckets.get((post_id, hour % ring))
+            if bucket is None:
+                bucket = buckets[(post_id, hour % ring)] = EngagementBucket(
+                    post_id=post_id, slot=hour % ring, hour=hour,
+                    likes=0, comments=0)
+                db.session.add(bucket)
+            elif bucket.hour < hour:
+                bucket.hour, bucket.likes, bucket.comments = hour, 0, 0
+            bucket.likes += likes
+            bucket.comments += comments
+
+        buckets_by_post = defaultdict(list)
+        for (post_id, _), bucket in buckets.items():
+            if bucket.hour >= oldest:
+                buckets_by_post[post_id].append(bucket)
+
+        # Withdraw the likes and comments removed since
+        for post_id, (likes, comments) in withdrawn.items():
+            _withdraw(buckets_by_post[post_id], likes, comments)
+
+        # Score each post from its buckets in the window, and stop
+        # ranking those left without engagement
+        trending = {post.post_id: post for post in TrendingPost.query.filter(
+            TrendingPost.post_id.in_(post_ids))}
+        for post_id in post_ids:
+            post_buckets = [bucket for bucket in buckets_by_post[post_id]
+                            if weight(bucket) > 0]
+            post = trending.get(post_id)
+            if not post_buckets:
+                if post is not None:
+                    db.session.delete(post)
+                continue
+            if post is None:
+                post = TrendingPost(post_id=post_id)
+                db.session.add(post)
+            post.score = forward_score(post_buckets, half_life)
+            post.last_hour = max(bucket.hour for bucket in post_buckets)
+
+    # Forget the engagement which has left the window
+    db.session.flush()
+    db.session.execute(delete(EngagementBucket.__table__).where(
+        EngagementBucket.__table__.c.hour < oldest))
+    db.session.execute(delete(TrendingPost.__table__).where(
+        TrendingPost.__table__.c.last_hour < oldest))
+
+
+def get_trending(limit, hours):
+    """
+    Returns the IDs of the posts with the most decayed engagement over
+    the last few hours.
+
+    Parameters
+    ----------
+    limit : int
+        The maximum number of posts returned.
+    hours : int
+        The number of hours of engagement counted, at most
+        `TRENDING_HOURS`.
+
+    Returns
+    -------
+    list of int
+        The IDs of the posts, best first.
+    """
+    half_life = current_app.config['TRENDING_HALF_LIFE']
+    now = current_hour()
+    oldest = now - hours + 1
+
+    # The best scored posts, including engagement from before the last
+    # few hours, are the candidates
+    candidates = db.session.execute(
+        db.select(TrendingPost.post_id)
+        .where(TrendingPost.last_hour >= oldest)
+        .order_by(TrendingPost.score.desc())
+        .limit(limit * CANDIDATE_FACTOR)).scalars().all()
+    if not candidates:
+        return []
+
+    # Rank the candidates by their engagement over the last few hours
+    scores = defaultdict(float)
+    buckets = db.session.execute(
+        db.select(EngagementBucket)
+        .where(EngagementBucket.post_id.in_(candidates),
+               EngagementBucket.hour >= oldest)).scalars()
+    for bucket in buckets:
+        scores[bucket.post_id] += weight(bucket) * 2 ** (
+            -(now - bucket.hour) / half_life)
+    return sorted(scores, key=lambda post_id: (-scores[post_id], -post_id))[:limit]
+
+
+def init_app(app):
+    """
+    Sets the defaults of the trending settings of an application.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+    """
+    app.config.setdefault('TRENDING_HOURS', 24)
+    app.config.setdefault('TRENDING_HALF_LIFE', 6)
@@ -0,0 +1,336 @@
+"""
+This module contains the version stamps used for conditional requests.
+
+Every user and every post has a `version` column that is incremented
+whenever something shown in its responses changes:
+
+- A user's version is bumped when they post, like, comment, follow or
+  are followed, when their profile changes, and when one of their posts
+  is liked or commented on.
+- A post's version is bumped when it is edited, liked or commented on.
+
+Views decorated with `conditional` compute an ETag from these stamps
+with a single cheap query, and answer a matching `If-None-Match` header
+with `304 Not Modified` before any of their own queries run.
+"""
+import hashlib
+from functools import wraps
+
+from flask import g, make_response, request
+from sqlalchemy import func, update
+
+from init import db
+from services.negotiation import response_format
+from models.follow import Follow
+from models.post import Post
+from models.user import User
+
+
+def bump_users_statement(*user_ids):
+    """
+    Returns the statement incrementing the version of the given users.
+
+    The increment is done in SQL, so concurrent bumps are never lost.
+
+    Parameters
+    ----------
+    *user_ids : int
+        The IDs of the users to bump.
+
+    Returns
+    -------
+    Update or None
+        The statement, or `None` if there are no users to bump.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return None
+    return update(User).where(User.id.in_(user_ids)) \
+        .values(version=User.version + 1)
+
+
+def bump_post_statement(post_id):
+    """
+    Returns the statement incrementing the version of a post.
+
+    Parameters
+    ----------
+    post_id : int
+        The ID of the post to bump.
+
+    Returns
+    -------
+    Update
+        The statement.
+    """
+    return update(Post).where(Post.id == post_id) \
+        .values(version=Post.version + 1)
+
+
+def bump_posts_statement(*post_ids):
+    """
+    Returns the statement incrementing the version of the given posts.
+
+    Parameters
+    ----------
+    *post_ids : int
+        The IDs of the posts to bump.
+
+    Returns
+    -------
+    Update or None
+        The statement, or `None` if there are no posts to bump.
+    """
+    post_ids = {post_id for post_id in post_ids if post_id is not None}
+    if not post_ids:
+        return None
+    return update(Post).where(Post.id.in_(post_ids)) \
+        .values(version=Post.version + 1)
+
+
+def bump_users(*user_ids):
+    """
+    Increments the version of the given users.
+
+    Parameters
+    ----------
+    *user_ids : int
+        The IDs of the users to bump.
+    """
+    statement = bump_users_statement(*user_ids)
+    if statement is not None:
+        db.session.execute(statement)
+
+
+def bump_post(post_id):
+    """
+    Increments the version of a post.
+
+    Parameters
+    ----------
+    post_id : int
+        The ID of the post to bump.
+    """
+    db.session.execute(bump_post_statement(post_id))
+
+
+def bump_posts(*post_ids):
+    """
+    Increments the version of the given posts.
+
+    Parameters
+    ----------
+    *post_ids : int
+        The IDs of the posts to bump.
+    """
+    statement = bump_posts_statement(*post_ids)
+    if statement is not None:
+        db.session.execute(statement)
+
+
+def make_etag(*parts):
+    """
+    Builds an opaque ETag value from its parts.
+
+    Parameters
+    ----------
+    *parts : object
+        The values the ETag depends on.
+
+    Returns
+    -------
+    str
+        The ETag value.
+    """
+    key = '/'.join(str(part) for part in parts)
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def representation_etag(etag, format_name, query_string):
+    """
+    Returns the ETag of one representation of a resource.
+
+    Parameters
+    ----------
+    etag : str
+        The ETag of the resource, from one of the `*_etag` functions.
+    format_name : str
+        The format of the response, `json` or `msgpack`.
+    query_string : str
+        The query string of the request.
+
+    Returns
+    -------
+    str
+        The ETag value.
+    """
+    return make_etag(etag, format_name, query_string)
+
+
+def user_version_query(user_id):
+    """
+    Returns the query selecting a user's version.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user.
+
+    Returns
+    -------
+    Select
+        The query.
+    """
+    return db.select(User.version).where(User.id == user_id)
+
+
+def post_version_query(post_id):
+    """
+    Returns the query selecting a post's version.
+
+    Parameters
+    ----------
+    post_id : int
+        The ID of the post.
+
+    Returns
+    -------
+    Select
+        The query.
+    """
+    return db.select(Post.version).where(Post.id == post_id)
+
+
+def followed_versions_query(user_id):
+    """
+    Returns the query selecting the number of users a user follows, and
+    the sum of their versions.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the following user.
+
+    Returns
+    -------
+    Select
+        The query.
+    """
+    return db.select(func.count(User.id),
+                     func.coalesce(func.sum(User.version), 0)) \
+        .join(Follow, Follow.followed_id == User.id) \
+        .where(Follow.follower_id == user_id)
+
+
+def user_etag(user_id, **_kwargs):
+    """
+    Returns the ETag for a user's profile or timeline.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user.
+
+    Returns
+    -------
+    str or None
+        The ETag, or `None` if the user does not exist.
+    """
+    version = db.session.execute(user_version_query(user_id)).scalar()
+    if version is None:
+        return None
+    return make_etag('user', user_id, version)
+
+
+def post_etag(post_id, **_kwargs):
+    """
+    Returns the ETag for a post, its comments or its likes.
+
+    Parameters
+    ----------
+    post_id : int
+        The ID of the post.
+
+    Returns
+    -------
+    str or None
+        The ETag, or `None` if the post does not exist.
+    """
+    version = db.session.execute(post_version_query(post_id)).scalar()
+    if version is None:
+        return None
+    return make_etag('post', post_id, version)
+
+
+def following_feed_etag(**_kwargs):
+    """
+    Returns the ETag for the current user's following feed.
+
+    The feed changes whenever the user follows or unfollows someone,
+    which bumps the user's own version, or when a followed user's posts
+    change, which bumps the followed user's version. Versions only ever
+    increase, so the sum of the followed users' versions changes with
+    them.
+
+    Returns
+    -------
+    str or None
+        The ETag, or `None` if the user does not exist.
+    """
+    # pylint: disable=import-outside-toplevel
+    from flask_jwt_extended import get_jwt_identity
+    user_id = get_jwt_identity()
+    version = db.session.execute(user_version_query(user_id)).scalar()
+    if version is None:
+        return None
+    followed = db.session.execute(followed_versions_query(user_id)).one()
+    return make_etag('following', user_id, version, *followed)
+
+
+def conditional(etag_fn):
+    """
+    Adds ETag and `If-None-Match` support to the decorated view.
+
+    The ETag is computed by `etag_fn` from the view's keyword arguments
+    and combined with the request's query string. If it matches the
+    `If-None-Match` header, a `304 Not Modified` response is returned
+    without calling the view.
+
+    The ETag is stored on `g.etag`, so that the response cache can key
+    its entries by it, and the ETag from `etag_fn` on `g.resource_etag`,
+    so that data shared by every page of a feed can be keyed by it.
+
+    Parameters
+    ----------
+    etag_fn : callable
+        Returns the ETag for the view's keyword arguments, or `None` to
+        skip the check.
+
+    Returns
+    -------
+    callable
+        The decorator.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def decorated_function(*args, **kwargs):
+            etag = etag_fn(**kwargs)
+            if etag is None:
+                return fn(*args, **kwargs)
+            g.resource_etag = etag
+            etag = representation_etag(
+                etag, response_format(),
+                request.query_string.decode('latin-1'))
+            g.etag = etag
+
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            response = make_response(fn(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag, weak=True)
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,310 @@
+"""
+This module contains the counting of the unique viewers of posts.
+
+Every read of a post, and every impression of a post in a feed, adds
+the viewer to a HyperLogLog sketch of the post's viewers, held in the
+memory of the serving process. Each process flushes its sketches every
+`VIEW_FLUSH_INTERVAL` seconds from a background thread, merging them
+into the compressed sketch stored in the post's `views_sketch` column
+with a single statement per shard.
+
+A sketch takes the same memory and the same write however many times
+its post is viewed, and merging never counts a viewer twice, so the
+counts of every process can be flushed into the same column. The
+approximate number of unique viewers of a post is its stored sketch
+merged with the process's unflushed one.
+
+A flush which changes the count of a post bumps the version of the post
+and of its author, see `services.versions`, so the conditional
+responses showing the post get a new ETag. Until then, a `304 Not
+Modified` response may show a count up to `VIEW_FLUSH_INTERVAL` seconds
+old.
+
+A feed answered with `304 Not Modified` shows the client the posts of
+the page it already has, so each process remembers the posts of the
+pages it served by their ETag, for `SHOWN_PAGE_TTL` seconds, and counts
+their impressions again on a 304. A 304 for a page another process
+served, or one served longer ago, counts no impressions.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from flask import current_app, g, make_response
+from sqlalchemy import bindparam, update
+
+from init import db
+from services import sharding
+from services.cache import ResponseCache, in_batch
+from services.hyperloglog import HyperLogLog, hash_item
+
+
+logger = logging.getLogger(__name__)
+
+# The number of seconds the posts of a served page are remembered for
+SHOWN_PAGE_TTL = 3600
+
+# The unflushed viewer sketch of each viewed post
+_pending = {}
+_lock = threading.Lock()
+
+# The ID of the process whose flusher thread is running, so that a
+# forked process starts its own
+_flusher_pid = None
+
+
+class ShownPage:
+    """
+    The posts shown by a page of a feed.
+
+    Attributes
+    ----------
+    post_ids : list of int
+        The IDs of the posts on the page.
+    expires : float
+        The monotonic time the page is forgotten at.
+    """
+
+    def __init__(self, post_ids, expires):
+        self.post_ids = post_ids
+        self.expires = expires
+
+
+# The pages served by this process, keyed by ETag
+shown_pages = ResponseCache()
+
+
+def record(post_ids, viewer):
+    """
+    Adds a viewer to the viewers of some posts.
+
+    Parameters
+    ----------
+    post_ids : iterable of int
+        The IDs of the viewed posts.
+    viewer : object
+        The viewer, usually the ID of the current user.
+    """
+    hashed = hash_item(viewer)
+    with _lock:
+        for post_id in post_ids:
+            sketch = _pending.get(post_id)
+            if sketch is None:
+                sketch = _pending[post_id] = HyperLogLog()
+            sketch.add_hash(hashed)
+    if _flusher_pid != os.getpid():
+        _start_flusher(current_app._get_current_object())  # pylint: disable=protected-access
+
+
+def count(post):
+    """
+    Returns the approximate number of unique viewers of a post.
+
+    Parameters
+    ----------
+    post : Post
+        The post.
+
+    Returns
+    -------
+    int
+        The number of viewers, from the post's stored sketch and this
+        process's unflushed one.
+    """
+    sketch = HyperLogLog.from_bytes(post.views_sketch)
+    with _lock:
+        pending = _pending.get(post.id)
+        if pending is not None:
+            sketch.merge(pending)
+    return sketch.estimate()
+
+
+def _flush_posts(sketches):
+    """
+    Merges the unflushed sketches of some posts into their stored ones,
+    on the selected shard.
+    """
+    # Imported here, as the Post schema counts views with this module
+    # pylint: disable=import-outside-toplevel
+    from models.post import Post
+    from services import versions
+
+    # Lock the posts, so that other processes flushing the same posts
+    # merge into this one's result instead of overwriting it
+    rows = db.session.execute(
+        db.select(Post.id, Post.author_id, Post.views_sketch)
+        .where(Post.id.in_(list(sketches))).with_for_update()).all()
+    merged = []
+    recounted_authors = set()
+    for post_id, author_id, stored in rows:
+        sketch = HyperLogLog.from_bytes(stored)
+        before = sketch.estimate()
+        sketch.merge(sketches[post_id])
+        data = sketch.to_bytes()
+        if data == stored:
+            # Every viewer was already counted
+            continue
+        # A new count changes the post's responses, and its author's
+        recounted = sketch.estimate() != before
+        if recounted:
+            recounted_authors.add(author_id)
+        merged.append({'post_id': post_id, 'views_sketch': data,
+                       'bump': int(recounted)})
+    if merged:
+        table = Post.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('post_id'))
+            .values(views_sketch=bindparam('views_sketch'),
+                    version=table.c.version + bindparam('bump')), merged)
+        versions.bump_users(*recounted_authors)
+    db.session.commit()
+    return len(merged)
+
+
+def flush(app):
+    """
+    Merges every unflushed sketch into the stored sketch of its post.
+
+    If the sketches can't be written, they are kept to be flushed with
+    the next ones.
+
+    Parameters
+    ----------
+    app : Flask
+        The application.
+
+    Returns
+    -------
+    int
+        The number of posts whose sketches were written.
+    """
+    global _pending  # pylint: disable=global-statement
+    with _lock:
+        sketches, _pending = _pending, {}
+    if not sketches:
+        return 0
+
+    with app.app_context():
+        try:
+            if not sharding.is_sharded():
+                return _flush_posts(sketches)
+            ids_by_shard = defaultdict(list)
+            for post_id in sketches:
+                ids_by_shard[sharding.shard_for_id(post_id)].append(post_id)
+            flushed = 0
+            for shard, post_ids in ids_by_shard.items():
+                with sharding.use_shard(shard):
+                    flushed += _flush_posts(
+                        {post_id: sketches[post_id] for post_id in post_ids})
+                # Only the sketches of the shards left are kept on failure
+                for post_id in post_ids:
+                    del sketches[post_id]
+            return flushed
+        except Exception:  # pylint: disable=broad-except
+            db.session.rollback()
+            logger.exception("Could not flush the views of %d posts",
+                             len(sketches))
+            # Merge the sketches back into those recorded since
+            with _lock:
+                for post_id, sketch in sketches.items():
+                    pending = _pending.setdefault(post_id, HyperLogLog())
+                    pending.merge(sketch)
+            return 0
+        finally:
+            db.session.remove()
+
+
+def _run_flusher(app):
+    """
+    Flushes the sketches of the current process periodically.
+    """
+    while True:
+        time.sleep(app.config['VIEW_FLUSH_INTERVAL'])
+        flush(app)
+
+
+def _start_flusher(app):
+    """
+    Starts the flusher thread of the current process, once.
+    """
+    global _flusher_pid  # pylint: disable=global-statement
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_run_flusher, args=(app,),
+                     name='view-flusher', daemon=True).start()
+    # Flush the last views when the process exits
+    atexit.register(flush, app)
+
+
+def track_views(arg=None):
+    """
+    Counts the current user as a viewer of the posts shown by the
+    decorated view.
+
+    Must be applied above `versions.conditional` and the response
+    caches, so that requests answered from the caches are counted. A
+    feed answered with `304 Not Modified` is only counted if this
+    process remembers the posts of the page, see `shown_page_ids`.
+
+    Parameters
+    ----------
+    arg : str, optional
+        The name of the view argument holding the ID of the viewed post.
+        If omitted, the posts are those whose IDs the view stored in
+        `g.post_ids`.
+
+    Returns
+    -------
+    function
+        The decorator.
+    """
+    def decorator(fn):
+        # pylint: disable=import-outside-toplevel
+        from flask_jwt_extended import get_jwt_identity
+
+        @wraps(fn)
+        def decorated_function(*args, **kwargs):
+            response = make_response(fn(*args, **kwargs))
+            if response.status_code in (200, 304):
+                post_ids = [kwargs[arg]] if arg \
+                    else shown_page_ids(response.status_code)
+                record(post_ids, get_jwt_identity())
+            return response
+        return decorated_function
+    return decorator
+
+
+def shown_page_ids(status):
+    """
+    Returns the IDs of the posts shown by the current request's page.
+
+    The posts of a page served with an ETag are remembered by it, so
+    that a `304 Not Modified` response for the same page, which doesn't
+    run the view, counts them too.
+
+    Parameters
+    ----------
+    status : int
+        The status code of the response.
+
+    Returns
+    -------
+    list of int
+        The IDs of the posts.
+    """
+    etag = g.get('etag')
+    if status == 304:
+        page = shown_pages.get(etag) if etag is not None else None
+        return page.post_ids if page is not None else ()
+    post_ids = g.get('post_ids', ())
+    # A batch's pages may be rolled back, and their ETags reused
+    if etag is not None and post_ids and not in_batch():
+        shown_pages.set(etag, ShownPage(
+            post_ids, time.monotonic() + SHOWN_PAGE_TTL))
+    return post_ids
@@ -0,0 +1,55 @@
+"""
+Fixtures shared by the tests.
+
+Each test gets an application of its own, backed by a fresh SQLite
+database holding the users created by `flask cli db_create`.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from main import create_app
+from services import cache, hotkeys, ranking, views
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    Returns an application with a new database, and empty caches.
+    """
+    for shared_cache in (cache.response_cache, hotkeys.hot_cache,
+                         ranking.rankings, views.shown_pages):
+        shared_cache.clear()
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv('JWT_SECRET_KEY', 'test-secret-key-' * 4)
+    monkeypatch.delenv('SHARD_DATABASE_URLS', raising=False)
+    monkeypatch.delenv('REPLICA_DATABASE_URL', raising=False)
+    app = create_app()
+    app.config['TESTING'] = True
+    app.test_cli_runner().invoke(args=['cli', 'db_create'])
+    return app
+
+
+@pytest.fixture
+def client(app):
+    """
+    Returns a test client of the application.
+    """
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """
+    Returns a function logging a user in, which returns the headers of
+    their requests.
+    """
+    def login_as(username, password=None):
+        response = client.post('/auth/login', json={
+            'username': username, 'password': password or username})
+        return {'Authorization': f"Bearer {response.json['token']}"}
+    return login_as
@@ -0,0 +1,34 @@
+"""
+Tests of the async endpoints of the ASGI application.
+"""
+import pytest
+from starlette.testclient import TestClient
+
+from services import hotkeys
+
+
+@pytest.fixture
+def asgi_client(app):  # pylint: disable=unused-argument
+    """
+    Returns a client of the ASGI application, sharing the database of
+    the Flask application.
+    """
+    # pylint: disable=import-outside-toplevel
+    from asgi import create_asgi_app
+    asgi_app = create_asgi_app()
+    with TestClient(asgi_app) as client:
+        yield client
+
+
+def test_async_post_requests_count_towards_hot_posts(asgi_client, login):
+    headers = login('user')
+
+    # The user liked the post when the database was created
+    assert asgi_client.delete('/posts/1/like', headers=headers) \
+        .status_code == 200
+    assert asgi_client.get('/posts/1/likes', headers=headers) \
+        .status_code == 200
+
+    flask_app = asgi_client.app.state.flask_app
+    with flask_app.app_context():
+        assert hotkeys.tracker().count('post:1') == 2
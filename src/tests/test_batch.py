@@ -0,0 +1,79 @@
+"""
+Tests of the `POST /batch` endpoint.
+"""
+import pytest
+
+
+def titles(client, headers):
+    """
+    Returns the titles of the posts in the feed.
+    """
+    response = client.get('/feed/?per_page=100', headers=headers)
+    return {post['title'] for post in response.json}
+
+
+@pytest.mark.parametrize('atomic', [False, True])
+def test_failed_statement_rolls_back_only_its_operation(client, login,
+                                                        atomic):
+    headers = login('admin')
+    operations = [
+        # The title is required, so inserting the post fails
+        {'method': 'POST', 'path': '/posts/',
+         'body': {'title': None, 'content': 'Broken'}},
+        {'method': 'POST', 'path': '/posts/',
+         'body': {'title': 'Batched', 'content': 'Valid'}},
+    ]
+
+    response = client.post('/batch/', headers=headers,
+                           json={'operations': operations, 'atomic': atomic})
+
+    assert response.status_code == 200
+    results = response.json['results']
+    assert results[0] == {'status': 500,
+                          'body': {'message': 'Internal server error'}}
+    if atomic:
+        assert response.json['committed'] is False
+        assert results[1]['status'] == 424
+        assert 'Batched' not in titles(client, headers)
+    else:
+        assert response.json['committed'] is True
+        assert results[1]['status'] == 200
+        assert 'Batched' in titles(client, headers)
+
+
+def test_rolled_back_responses_are_not_cached(app, client, login):
+    app.config['RESPONSE_CACHE_TIMEOUT'] = 60
+    headers = login('admin')
+    operations = [
+        {'method': 'POST', 'path': '/posts/',
+         'body': {'title': 'Ghost', 'content': 'Rolled back'}},
+        {'method': 'GET', 'path': '/feed/?per_page=100'},
+        {'method': 'POST', 'path': '/posts/999999/like'},
+    ]
+
+    response = client.post('/batch/', headers=headers,
+                           json={'operations': operations, 'atomic': True})
+
+    assert response.json['committed'] is False
+    assert 'Ghost' in {post['title']
+                       for post in response.json['results'][1]['body']}
+    assert 'Ghost' not in titles(client, headers)
+
+
+def test_batched_operations_answer_as_they_would_alone(client, login):
+    admin, user = login('admin'), login('user')
+    post = client.post('/posts/', headers=admin,
+                       json={'title': 'Liked', 'content': 'Twice'}).json
+    path = f"/posts/{post['id']}/like"
+    alone = [client.post(path, headers=user).json,
+             client.delete(path, headers=user).json]
+
+    response = client.post('/batch/', headers=user, json={'operations': [
+        {'method': 'POST', 'path': path},
+        {'method': 'DELETE', 'path': path},
+    ]})
+
+    batched = [result['body'] for result in response.json['results']]
+    assert batched == alone
+    assert batched[0]['likes_count'] == 1
+    assert batched[1]['likes_count'] == 0
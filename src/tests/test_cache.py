@@ -0,0 +1,57 @@
+"""
+Tests of the response cache and of request coalescing.
+"""
+import threading
+
+from flask import make_response
+
+from services import cache
+
+
+def test_coalesced_requests_get_the_leaders_headers(app, monkeypatch):
+    follower_waiting = threading.Event()
+    leader_running = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    class WaitingEvent(threading.Event):
+        def wait(self, timeout=None):
+            follower_waiting.set()
+            return super().wait(timeout)
+
+    monkeypatch.setattr(cache, 'Event', WaitingEvent)
+
+    @app.route('/coalesced')
+    @cache.single_flight()
+    def coalesced():
+        calls.append(1)
+        leader_running.set()
+        release.wait(5)
+        response = make_response({'message': 'Coalesced'})
+        response.headers['Cache-Control'] = 'private, max-age=5'
+        response.vary.add('Accept')
+        response.set_cookie('leader', 'only')
+        return response
+
+    responses = {}
+
+    def get(name):
+        responses[name] = app.test_client().get('/coalesced')
+
+    leader = threading.Thread(target=get, args=('leader',))
+    leader.start()
+    assert leader_running.wait(5)
+    follower = threading.Thread(target=get, args=('follower',))
+    follower.start()
+    assert follower_waiting.wait(5)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(calls) == 1
+    response = responses['follower']
+    assert response.json == {'message': 'Coalesced'}
+    assert response.headers['Cache-Control'] == 'private, max-age=5'
+    assert 'Accept' in response.vary
+    assert 'Set-Cookie' not in response.headers
+    assert 'leader=only' in responses['leader'].headers['Set-Cookie']
@@ -0,0 +1,78 @@
+"""
+Tests of the response compression.
+"""
+import gzip
+import json
+
+import pytest
+
+from services import compression
+
+
+@pytest.fixture
+def compressing_client(app):
+    """
+    Returns a client of an application compressing every response.
+    """
+    app.config['COMPRESS_MIN_SIZE'] = 1
+    return app.test_client()
+
+
+def test_gzip_is_used_when_accepted(compressing_client, login):
+    headers = login('admin')
+    plain = compressing_client.get('/feed/', headers=headers)
+
+    response = compressing_client.get(
+        '/feed/', headers={**headers, 'Accept-Encoding': 'gzip, deflate'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert json.loads(gzip.decompress(response.data)) == plain.json
+
+
+def test_zstd_is_preferred_when_accepted(compressing_client, login):
+    zstandard = pytest.importorskip('zstandard')
+    headers = login('admin')
+    plain = compressing_client.get('/feed/', headers=headers)
+
+    response = compressing_client.get(
+        '/feed/', headers={**headers, 'Accept-Encoding': 'gzip, zstd'})
+
+    assert response.headers['Content-Encoding'] == 'zstd'
+    body = zstandard.ZstdDecompressor().decompressobj().decompress(
+        response.data)
+    assert json.loads(body) == plain.json
+
+
+def test_unaccepted_encodings_are_not_used(compressing_client, login):
+    response = compressing_client.get(
+        '/feed/', headers={**login('admin'), 'Accept-Encoding': 'br'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.vary
+
+
+def test_responses_below_the_minimum_size_are_not_compressed(app, client,
+                                                             login):
+    app.config['COMPRESS_MIN_SIZE'] = 1_000_000
+    response = client.get(
+        '/feed/', headers={**login('admin'), 'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.json
+
+
+def test_cached_responses_are_compressed_once(app, compressing_client, login,
+                                              monkeypatch):
+    app.config['RESPONSE_CACHE_TIMEOUT'] = 60
+    headers = {**login('admin'), 'Accept-Encoding': 'gzip'}
+    calls = []
+    compress_gzip = compression.ENCODINGS['gzip']
+    monkeypatch.setitem(compression.ENCODINGS, 'gzip', lambda data, level:
+                        calls.append(data) or compress_gzip(data, level))
+
+    first = compressing_client.get('/feed/', headers=headers)
+    second = compressing_client.get('/feed/', headers=headers)
+
+    assert first.data == second.data
+    assert len(calls) == 1
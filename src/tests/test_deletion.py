@@ -0,0 +1,75 @@
+"""
+Tests of the soft deletion and purging of users and posts.
+"""
+from init import db
+from models.comment import Comment
+from models.like import Like
+from models.post import Post
+from models.user import User
+from services import deletion
+
+
+def feed_ids(client, headers):
+    """
+    Returns the IDs of the posts of the feed.
+    """
+    return [post['id'] for post in client.get(
+        '/feed/?per_page=50', headers=headers).json]
+
+
+def test_deleted_posts_are_hidden_then_purged(app, client, login):
+    app.config.update(RESPONSE_CACHE_TIMEOUT=0, DELETION_BATCH_SIZE=1)
+    admin, user = login('admin'), login('user')
+    post_id = client.post('/posts/', headers=admin, json={
+        'title': 'Doomed', 'content': 'Soon gone'}).json['id']
+    client.post(f'/posts/{post_id}/like', headers=user)
+    for content in ('First', 'Second', 'Third'):
+        client.post(f'/posts/{post_id}/comments/', headers=user,
+                    json={'content': content})
+
+    assert client.delete(f'/posts/{post_id}', headers=admin).status_code == 200
+    assert post_id not in feed_ids(client, user)
+    assert client.get(f'/posts/{post_id}', headers=admin).status_code == 404
+
+    with app.app_context():
+        # The row is only hidden until it is purged
+        assert db.session.get(Post, post_id) is None
+        assert db.session.execute(
+            db.select(Post.deleted_at).where(Post.id == post_id)
+            .execution_options(include_deleted=True)).scalar() is not None
+
+        # One batch per like and comment, and the post itself
+        assert deletion.purge_post(post_id) == 5
+        assert deletion.purge_post(post_id) == 0
+        assert db.session.execute(
+            db.select(Post.id).where(Post.id == post_id)
+            .execution_options(include_deleted=True)).first() is None
+        assert not Like.query.filter_by(post_id=post_id).count()
+        assert not Comment.query.filter_by(post_id=post_id).count()
+
+
+def test_deleted_users_are_hidden_then_purged(app, client, login):
+    app.config.update(RESPONSE_CACHE_TIMEOUT=0, DELETION_BATCH_SIZE=1)
+    admin = login('admin')
+    comment = client.post('/posts/1/comments/', headers=login('user'),
+                          json={'content': 'A comment'}).json
+    client.post('/posts/1/comments/', headers=admin,
+                json={'content': 'A reply', 'parent_id': comment['id']})
+    client.post('/users/2/follow', headers=admin)
+
+    result = app.test_cli_runner().invoke(
+        args=['cli', 'delete_user', 'user', '--background'])
+    assert 'purge queued' in result.output
+    assert feed_ids(client, admin) == [1]
+    assert client.get('/users/2/profile', headers=admin).status_code == 404
+
+    with app.app_context():
+        assert db.session.get(User, 2) is None
+        assert deletion.purge_user(2) > 0
+        assert db.session.execute(
+            db.select(User.id).where(User.id == 2)
+            .execution_options(include_deleted=True)).first() is None
+
+        # The reply to the user's comment went with it
+        assert Comment.query.count() == 0
+        assert Like.query.count() == 0
@@ -0,0 +1,79 @@
+"""
+Tests of the delivery of outbox events to consumers.
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from init import db
+from services import events
+
+
+@pytest.fixture
+def consumers(monkeypatch):
+    """
+    Replaces the registered consumers with the test's own.
+    """
+    monkeypatch.setattr(events, '_consumers', {})
+
+
+@pytest.mark.usefixtures('consumers')
+def test_consumers_get_the_committed_events_of_their_types(app, client, login):
+    received = []
+
+    @events.consumer(events.POST_CREATED, name='created')
+    def created(batch):
+        received.extend((event.type, event.payload['title']) for event in batch)
+
+    admin = login('admin')
+    client.post('/posts/', headers=admin, json={'title': 'First', 'content': ''})
+    client.delete('/posts/1/like', headers=login('user'))
+    with app.app_context():
+        # Events of a rolled back transaction are never delivered
+        events.record(events.POST_CREATED, title='Rolled back')
+        db.session.rollback()
+    client.post('/posts/', headers=admin, json={'title': 'Second', 'content': ''})
+
+    with app.app_context():
+        assert events.dispatch_all() > 0
+        assert events.dispatch_all() == 0
+    assert received == [(events.POST_CREATED, 'First'),
+                        (events.POST_CREATED, 'Second')]
+
+
+@pytest.mark.usefixtures('consumers')
+def test_failed_batches_are_delivered_again(app):
+    received = []
+    failures = [RuntimeError("Failed")]
+
+    @events.consumer(events.USER_FOLLOWED, name='failing')
+    def failing(batch):
+        if failures:
+            raise failures.pop()
+        received.extend(event.payload['follower_id'] for event in batch)
+
+    @events.consumer(events.USER_FOLLOWED, name='working')
+    def working(batch):
+        received.extend(-event.payload['follower_id'] for event in batch)
+
+    with app.app_context():
+        events.record(events.USER_FOLLOWED, follower_id=1, followed_id=2)
+        db.session.commit()
+
+        # The failing consumer doesn't hold up the other one
+        events.dispatch_all()
+        assert received == [-1]
+        events.dispatch_all()
+    assert received == [-1, 1]
+
+
+def test_gaps_are_waited_for_until_they_time_out():
+    now = datetime.now()
+    batch = [SimpleNamespace(id=1, created_at=now),
+             SimpleNamespace(id=3, created_at=now - timedelta(seconds=10)),
+             SimpleNamespace(id=5, created_at=now)]
+
+    assert events.settled(batch, 0, gap_timeout=30) == batch[:1]
+    assert events.settled(batch, 0, gap_timeout=5) == batch[:2]
+    assert events.settled(batch[2:], 4, gap_timeout=30) == batch[2:]
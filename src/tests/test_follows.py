@@ -0,0 +1,70 @@
+"""
+Tests of following many users at once.
+"""
+from init import db
+from models.follow import Follow
+from models.outbox import OutboxEvent
+from models.user import User
+from services import events
+
+
+def add_users(app, *usernames):
+    """
+    Adds users to the database, returning their IDs.
+    """
+    with app.app_context():
+        users = [User(username=username, email=f'{username}@localhost',
+                      password_hash='unused', is_confirmed=True)
+                 for username in usernames]
+        db.session.add_all(users)
+        db.session.commit()
+        return [user.id for user in users]
+
+
+def follows_of(app, follower_id):
+    """
+    Returns the IDs of the users a user follows, and the number of
+    `UserFollowed` events recorded.
+    """
+    with app.app_context():
+        followed = sorted(db.session.execute(
+            db.select(Follow.followed_id)
+            .where(Follow.follower_id == follower_id)).scalars())
+        recorded = OutboxEvent.query.filter_by(
+            type=events.USER_FOLLOWED).count()
+        return followed, recorded
+
+
+def test_bulk_follows_are_idempotent(app, client, login):
+    carol, dave = add_users(app, 'carol', 'dave')
+    admin = login('admin')
+    body = {'user_ids': [carol, 2, 1, dave, carol, 999]}
+
+    response = client.post('/users/follow/bulk', headers=admin, json=body)
+    assert response.status_code == 200
+    assert response.json['followed'] == [carol, dave]
+    assert response.json['skipped'] == [2, 1]
+    assert response.json['not_found'] == [999]
+    assert follows_of(app, 1) == ([2, carol, dave], 2)
+
+    # Following the same users again changes nothing
+    response = client.post('/users/follow/bulk', headers=admin, json=body)
+    assert response.json['followed'] == []
+    assert response.json['skipped'] == [carol, 2, 1, dave]
+    assert follows_of(app, 1) == ([2, carol, dave], 2)
+
+    response = client.delete('/users/follow/bulk', headers=admin,
+                             json={'user_ids': [carol, dave, carol]})
+    assert response.json['unfollowed'] == [carol, dave]
+    response = client.delete('/users/follow/bulk', headers=admin,
+                             json={'user_ids': [carol]})
+    assert response.json['unfollowed'] == []
+    assert follows_of(app, 1) == ([2], 2)
+
+
+def test_invalid_user_ids(client, login):
+    headers = login('admin')
+    for user_ids in ([], ['2'], [True], 2, None):
+        response = client.post('/users/follow/bulk', headers=headers,
+                               json={'user_ids': user_ids})
+        assert response.status_code == 400
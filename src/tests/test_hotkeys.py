@@ -0,0 +1,43 @@
+"""
+Tests of the detection and caching of hot posts and users.
+"""
+from services import hotkeys
+
+
+def test_heavy_hitters_keep_the_most_requested_keys():
+    hitters = hotkeys.HeavyHitters(capacity=2, window=60)
+    for key, requests in (('post:1', 3), ('post:2', 1), ('post:3', 2)):
+        for _ in range(requests):
+            hitters.record(key)
+
+    # The third key overtook the coldest one
+    assert hitters.hottest() == [('post:1', 3), ('post:3', 2)]
+    assert hitters.count('post:2') == 0
+
+    # Every count is halved once the window has passed
+    hitters.decayed -= 60
+    assert hitters.hottest() == [('post:1', 1), ('post:3', 1)]
+
+
+def test_hot_posts_are_served_from_the_hot_cache(app, client, login):
+    app.config.update(HOT_KEY_THRESHOLD=2, RESPONSE_CACHE_TIMEOUT=0)
+    admin = login('admin')
+
+    first = client.get('/posts/1', headers=admin)
+    assert not hotkeys.hot_cache.entries
+    hot = client.get('/posts/1', headers=admin)
+    assert len(hotkeys.hot_cache.entries) == 1
+    cached = client.get('/posts/1', headers=admin)
+    assert cached.json == hot.json
+    assert cached.headers['ETag'] == hot.headers['ETag']
+
+    # An unlike changes the ETag, so the stale entry is never served
+    client.delete('/posts/1/like', headers=login('user'))
+    response = client.get('/posts/1', headers=admin)
+    assert response.json['data']['likes_count'] \
+        == first.json['data']['likes_count'] - 1
+    assert len(hotkeys.hot_cache.entries) == 2
+
+    response = client.get('/admin/hot_keys', headers=admin)
+    assert response.json['data'][0] == {
+        'kind': 'post', 'id': '1', 'count': 5, 'hot': True}
@@ -0,0 +1,29 @@
+"""
+Tests of the background job queue.
+"""
+from datetime import datetime, timedelta
+
+from init import db
+from models.job import Job
+from services import jobs
+
+
+def test_stale_jobs_out_of_attempts_fail(app):
+    locked_at = datetime.now() - timedelta(hours=1)
+    with app.app_context():
+        retried, exhausted = (
+            Job(name='task', status='running', attempts=attempts,
+                max_attempts=3, run_at=locked_at, locked_by='dead:0',
+                locked_at=locked_at, created_at=locked_at)
+            for attempts in (2, 3))
+        db.session.add_all([retried, exhausted])
+        db.session.commit()
+
+        assert jobs.requeue_stale(lock_timeout=60) == (1, 1)
+
+        db.session.expire_all()
+        assert retried.status == 'queued'
+        assert retried.locked_by is None
+        assert exhausted.status == 'failed'
+        assert exhausted.finished_at is not None
+        assert exhausted.last_error == jobs.STALE_ERROR
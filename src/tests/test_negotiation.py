@@ -0,0 +1,35 @@
+"""
+Tests of the negotiation of MessagePack bodies.
+"""
+import pytest
+
+from services import negotiation
+
+msgpack = pytest.importorskip('msgpack')
+
+
+def test_msgpack_round_trip(client, login):
+    headers = {**login('admin'), 'Accept': negotiation.MSGPACK_MIMETYPE}
+    response = client.post(
+        '/posts/', headers=headers,
+        data=negotiation.packb({'title': 'Packed', 'content': 'Binary'}),
+        content_type=negotiation.MSGPACK_MIMETYPE)
+
+    assert response.status_code == 200
+    assert response.mimetype == negotiation.MSGPACK_MIMETYPE
+    assert 'Accept' in response.vary
+    post = negotiation.unpackb(response.data)
+    assert (post['title'], post['content']) == ('Packed', 'Binary')
+
+
+def test_cached_responses_vary_with_accept(client, login):
+    headers = login('admin')
+    as_json = client.get('/feed/', headers=headers)
+    as_msgpack = client.get('/feed/', headers={
+        **headers, 'Accept': negotiation.MSGPACK_MIMETYPE})
+
+    assert as_json.mimetype == 'application/json'
+    assert as_msgpack.mimetype == negotiation.MSGPACK_MIMETYPE
+    assert 'Accept' in as_json.vary and 'Accept' in as_msgpack.vary
+    assert [post['id'] for post in negotiation.unpackb(as_msgpack.data)] \
+        == [post['id'] for post in as_json.json]
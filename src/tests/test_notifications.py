@@ -0,0 +1,42 @@
+"""
+Tests of the notification inbox.
+"""
+from datetime import datetime
+
+from init import db
+from models.notification import Notification
+
+
+def test_pages_include_notifications_of_the_same_event(app, client, login):
+    # A comment replying to the post's author notifies them twice
+    with app.app_context():
+        db.session.add_all([
+            Notification(user_id=1, type='comment', target_id=1, actor_id=2,
+                         actor_count=1, read=False, event_id=7,
+                         updated_at=datetime.now()),
+            Notification(user_id=1, type='reply', target_id=1, actor_id=2,
+                         actor_count=1, read=False, event_id=7,
+                         updated_at=datetime.now()),
+            Notification(user_id=1, type='follow', target_id=1, actor_id=2,
+                         actor_count=1, read=False, event_id=5,
+                         updated_at=datetime.now()),
+        ])
+        db.session.commit()
+    headers = login('admin')
+
+    types = []
+    url = '/notifications/?limit=1'
+    while url is not None:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        types += [notification['type'] for notification in response.json['data']]
+        after = response.json['next']
+        url = f'/notifications/?limit=1&after={after}' if after else None
+
+    assert types == ['reply', 'comment', 'follow']
+
+
+def test_invalid_cursor(client, login):
+    response = client.get('/notifications/?after=7:x', headers=login('admin'))
+
+    assert response.status_code == 400
@@ -0,0 +1,49 @@
+"""
+Tests of the bulk import of users.
+"""
+from init import db
+from models.user import User
+
+CSV = """username,email,password,bio,is_admin
+carol,carol@localhost,carol,Hello,yes
+admin,someone@localhost,admin,,
+dave,dave@localhost,dave,,no
+dave,other@localhost,dave,,
+erin,erin@localhost,,,
+frank,frank.localhost,frank,,
+"""
+
+
+def test_csv_import_reports_the_rows_it_skips(app, client, tmp_path):
+    app.config['BCRYPT_LOG_ROUNDS'] = 4
+    path = tmp_path / 'users.csv'
+    path.write_text(CSV, encoding='utf-8')
+
+    result = app.test_cli_runner().invoke(args=[
+        'cli', 'import_users', str(path), '--batch-size', '2',
+        '--processes', '1'])
+
+    assert result.exception is None
+    lines = result.output.splitlines()
+    assert "6 rows read, 2 users created." in lines
+    # Lines count from the header
+    assert "Line 6 skipped: username, email and password are required." in lines
+    assert "Line 7 skipped: email is invalid." in lines
+    assert lines[-1] == \
+        "Imported 2 users, skipped 2 already taken and 2 invalid."
+
+    with app.app_context():
+        carol = db.session.execute(
+            db.select(User).where(User.username == 'carol')).scalar_one()
+        assert (carol.bio, carol.is_admin, carol.is_confirmed) \
+            == ('Hello', True, True)
+        assert User.query.filter_by(username='dave').one().email \
+            == 'dave@localhost'
+    response = client.post('/auth/login', json={
+        'username': 'dave', 'password': 'dave'})
+    assert response.status_code == 200
+
+    # Importing the file again creates no one
+    result = app.test_cli_runner().invoke(args=[
+        'cli', 'import_users', str(path), '--processes', '1'])
+    assert "6 rows read, 0 users created." in result.output.splitlines()
@@ -0,0 +1,48 @@
+"""
+Tests of the full-text search of posts.
+"""
+from services import events
+
+
+def search(app, client, headers, query):
+    """
+    Delivers the recorded events to the index, and returns the IDs of
+    the posts matching a query.
+    """
+    with app.app_context():
+        events.dispatch('search')
+    response = client.get('/search/posts', headers=headers,
+                          query_string={'q': query})
+    assert response.status_code == 200
+    return [post['id'] for post in response.json['data']]
+
+
+def test_titles_rank_above_content_and_comments(app, client, login):
+    admin = login('admin')
+    in_comment = client.post('/posts/', headers=admin, json={
+        'title': 'Plain', 'content': 'Nothing to see'}).json['id']
+    client.post(f'/posts/{in_comment}/comments/', headers=admin,
+                json={'content': 'Talking about walruses'})
+    in_content = client.post('/posts/', headers=admin, json={
+        'title': 'Animals', 'content': 'Walruses are large'}).json['id']
+    in_title = client.post('/posts/', headers=admin, json={
+        'title': 'Walruses', 'content': 'Tusks'}).json['id']
+
+    assert search(app, client, admin, 'walruses') \
+        == [in_title, in_content, in_comment]
+
+
+def test_deleted_posts_leave_the_index(app, client, login):
+    admin = login('admin')
+    post_id = client.post('/posts/', headers=admin, json={
+        'title': 'Ephemeral', 'content': 'Soon gone'}).json['id']
+    assert search(app, client, admin, 'ephemeral') == [post_id]
+
+    client.delete(f'/posts/{post_id}', headers=admin)
+    assert search(app, client, admin, 'ephemeral') == []
+
+
+def test_missing_query(client, login):
+    response = client.get('/search/posts', headers=login('admin'))
+
+    assert response.status_code == 400
@@ -0,0 +1,91 @@
+"""
+Tests of the compiled serializers against the marshmallow schemas.
+"""
+from datetime import datetime
+
+import pytest
+from marshmallow import Schema, fields
+
+from models.comment import comments_schema
+from models.like import likes_schema
+from models.post import (Post, post_previews_schema, post_schema,
+                         posts_schema)
+from models.user import User, profile_schema, users_schema
+from services import previews, serializers, sharding
+
+
+@pytest.fixture
+def activity(client, login):
+    """
+    Gives the posts of the database likes, comments and replies, and
+    the users followers.
+    """
+    admin, user = login('admin'), login('user')
+    for post_id, headers in ((1, user), (2, admin)):
+        client.post(f'/posts/{post_id}/like', headers=headers)
+        comment = client.post(f'/posts/{post_id}/comments/', headers=headers,
+                              json={'content': 'A comment'}).json
+        client.post(f'/posts/{post_id}/comments/', headers=admin,
+                    json={'content': 'A reply', 'parent_id': comment['id']})
+    client.post('/users/2/follow', headers=admin)
+
+
+def assert_same_dump(schema, data):
+    expected = schema.dump(data)
+    actual = serializers.dump(schema, data)
+    assert actual == expected
+    # The keys must be in the same order too
+    assert list(actual) == list(expected)
+
+
+@pytest.mark.usefixtures('activity')
+def test_compiled_serializers_match_marshmallow(app):
+    with app.app_context():
+        posts = sharding.gather_all(lambda: Post.query.order_by(Post.id))
+        users = User.query.order_by(User.id).all()
+        for user in users:
+            sharding.load_collections(user, 'posts', 'likes', 'comments')
+        cases = [
+            (posts_schema, posts),
+            (likes_schema, [like for post in posts for like in post.likes]),
+            (comments_schema,
+             [comment for post in posts for comment in post.comments]),
+            (users_schema, users),
+            (post_previews_schema, previews.attach_previews(posts, 2)),
+        ]
+        cases += [(post_schema, post) for post in posts]
+        cases += [(profile_schema, user) for user in users]
+
+        assert all(data for _, data in cases)
+        for schema, data in cases:
+            assert_same_dump(schema, data)
+
+
+class AuthorSchema(Schema):
+    id = fields.Integer()
+    username = fields.String()
+
+
+class EntrySchema(Schema):
+    id = fields.Integer()
+    title = fields.String()
+    published = fields.Boolean()
+    created_at = fields.DateTime()
+    author = fields.Nested(AuthorSchema)
+    replies = fields.List(fields.Nested(AuthorSchema))
+
+
+def test_compiled_serializers_read_dicts_by_key(app):
+    schema = EntrySchema(many=True)
+    entries = [
+        {'id': 1, 'title': 'An entry', 'published': True,
+         'created_at': datetime(2024, 1, 2, 3, 4, 5),
+         'author': {'id': 2, 'username': 'user'},
+         'replies': [{'id': 3, 'username': 'admin'}]},
+        # Missing keys are left out, as marshmallow leaves them out
+        {'id': 4, 'author': {'id': 5}},
+    ]
+
+    with app.test_request_context():
+        assert_same_dump(schema, entries)
+        assert_same_dump(EntrySchema(), entries[0])
@@ -0,0 +1,78 @@
+"""
+Tests of the sharding of posts, likes and comments.
+"""
+import sqlite3
+
+import pytest
+
+from main import create_app
+from services import sharding
+
+SHARDS = 3
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    Returns an application with a new database and shard databases.
+    """
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv('SHARD_DATABASE_URLS', ','.join(
+        f"sqlite:///{tmp_path / f'shard{shard}.db'}" for shard in range(SHARDS)))
+    monkeypatch.setenv('JWT_SECRET_KEY', 'test-secret-key-' * 4)
+    monkeypatch.delenv('REPLICA_DATABASE_URL', raising=False)
+    app = create_app()
+    app.config['TESTING'] = True
+    app.test_cli_runner().invoke(args=['cli', 'db_create'])
+    yield app
+    sharding.forget_executor()
+
+
+def shard_rows(tmp_path, shard, query):
+    """
+    Returns the rows of a query run on a shard database directly.
+    """
+    with sqlite3.connect(tmp_path / f'shard{shard}.db') as connection:
+        return connection.execute(query).fetchall()
+
+
+def test_rows_live_on_their_authors_shard(app, client, login, tmp_path):
+    admin, user = login('admin'), login('user')
+    post_id = client.post('/posts/', headers=user, json={
+        'title': 'Sharded', 'content': 'Somewhere'}).json['id']
+    client.post(f'/posts/{post_id}/like', headers=admin)
+    client.post(f'/posts/{post_id}/comments/', headers=admin,
+                json={'content': 'Next to it'})
+
+    # The user's posts, and their likes and comments, are on shard 2
+    with app.app_context():
+        assert sharding.shard_for_author(2) == 2
+        assert sharding.shard_for_id(post_id) == 2
+    assert (post_id,) in shard_rows(tmp_path, 2, 'SELECT id FROM posts')
+    assert shard_rows(tmp_path, 2, 'SELECT post_id FROM likes') \
+        .count((post_id,)) == 1
+    assert shard_rows(tmp_path, 2, 'SELECT post_id FROM comments') \
+        .count((post_id,)) == 1
+    for shard in (0, 1):
+        assert (post_id,) not in shard_rows(tmp_path, shard,
+                                            'SELECT id FROM posts')
+
+    response = client.get(f'/posts/{post_id}', headers=admin)
+    assert response.json['data']['likes_count'] == 1
+
+
+def test_feed_pages_merge_the_shards(client, login):
+    admin, user = login('admin'), login('user')
+    created = [client.post('/posts/', headers=(admin, user)[index % 2], json={
+        'title': f'Post {index}', 'content': 'Merged'}).json['id']
+        for index in range(5)]
+
+    ids = []
+    for page in (1, 2, 3, 4):
+        response = client.get(f'/feed/?page={page}&per_page=2', headers=admin)
+        assert response.status_code == 200
+        ids += [post['id'] for post in response.json]
+
+    # Newest first across both shards, with no post twice
+    assert ids[:5] == created[::-1]
+    assert len(ids) == len(set(ids)) == 7
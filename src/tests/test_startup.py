@@ -0,0 +1,27 @@
+"""
+Tests of the deferred setup of the application.
+"""
+import pytest
+
+from services import startup
+
+
+def test_failed_step_is_run_again_by_the_next_request(app):
+    calls = []
+
+    def step(app):
+        calls.append(app)
+        if len(calls) == 1:
+            raise RuntimeError("Setup failed")
+
+    startup.defer(app, step)
+    client = app.test_client()
+
+    with pytest.raises(RuntimeError):
+        client.post('/auth/login', json={'username': 'admin',
+                                         'password': 'admin'})
+
+    response = client.post('/auth/login', json={'username': 'admin',
+                                                'password': 'admin'})
+    assert response.status_code == 200
+    assert len(calls) == 2
@@ -0,0 +1,54 @@
+"""
+Tests of the feed's stream of server-sent events.
+"""
+import json
+
+
+def read_stream(client, headers, query_string=None):
+    """
+    Returns the events of a stream, which ends after a short timeout.
+    """
+    response = client.get('/feed/stream', headers=headers,
+                          query_string=query_string)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    return response.get_data(as_text=True).split('\n\n')
+
+
+def test_reconnecting_clients_are_sent_the_posts_they_missed(
+        app, client, login):
+    app.config.update(STREAM_TIMEOUT=0.2, STREAM_HEARTBEAT=0.05)
+    admin, user = login('admin'), login('user')
+    client.post('/posts/', headers=admin, json={'title': 'Own', 'content': ''})
+    post_id = client.post('/posts/', headers=user, json={
+        'title': 'Followed', 'content': ''}).json['id']
+
+    retry, missed, *rest = read_stream(client, admin, {'last_event_id': 0})
+
+    assert retry == 'retry: 3000'
+    event_id, event, data = missed.split('\n')
+    assert event_id.startswith('id: ') and int(event_id[4:]) > 0
+    assert event == 'event: post'
+    assert json.loads(data[len('data: '):]) == {
+        'post_id': post_id, 'author_id': 2}
+    # Only heartbeats follow, then the stream ends
+    assert set(rest) <= {': heartbeat', ''}
+    assert ': heartbeat' in rest
+
+
+def test_clients_too_far_behind_are_reset(app, client, login):
+    app.config.update(STREAM_TIMEOUT=0, STREAM_REPLAY_LIMIT=1)
+    user = login('user')
+    for title in ('First', 'Second'):
+        client.post('/posts/', headers=user, json={'title': title, 'content': ''})
+
+    events = read_stream(client, login('admin'), {'last_event_id': 0})
+
+    assert events[1].split('\n')[1:] == ['event: reset', 'data: {}']
+
+
+def test_invalid_last_event_id(client, login):
+    response = client.get('/feed/stream', headers={
+        **login('admin'), 'Last-Event-ID': 'latest'})
+
+    assert response.status_code == 400
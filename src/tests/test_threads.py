@@ -0,0 +1,75 @@
+"""
+Tests of the threading of comments.
+"""
+import pytest
+
+
+@pytest.fixture
+def thread(client, login):
+    """
+    Returns a function commenting on a new post, and the post's ID.
+    """
+    headers = login('user')
+    post_id = client.post('/posts/', headers=headers, json={
+        'title': 'Threaded', 'content': 'Discuss'}).json['id']
+
+    def comment(content, parent_id=None):
+        body = {'content': content}
+        if parent_id is not None:
+            body['parent_id'] = parent_id
+        return client.post(f'/posts/{post_id}/comments/', headers=headers,
+                           json=body).json['id']
+    return comment, post_id
+
+
+def test_replies_are_listed_depth_first(client, login, thread):
+    comment, post_id = thread
+    root = comment('Root')
+    first = comment('First', root)
+    comment('Other thread')
+    second = comment('Second', root)
+    nested = comment('Nested', first)
+    headers = login('admin')
+
+    url = f'/posts/{post_id}/comments/{root}/replies?limit=2'
+    response = client.get(url, headers=headers)
+    assert [reply['id'] for reply in response.json['data']] == [first, nested]
+    assert [reply['depth'] for reply in response.json['data']] == [1, 2]
+
+    response = client.get(f"{url}&after={response.json['next']}",
+                          headers=headers)
+    assert [reply['id'] for reply in response.json['data']] == [second]
+    assert response.json['next'] is None
+
+
+def test_threads_come_newest_first_with_their_first_replies(
+        client, login, thread):
+    comment, post_id = thread
+    older = comment('Older')
+    older_replies = [comment(f'Reply {index}', older) for index in range(3)]
+    newer = comment('Newer')
+    headers = login('admin')
+
+    response = client.get(f'/posts/{post_id}/comments/threads?limit=1&replies=2',
+                          headers=headers)
+    [thread_data] = response.json['data']
+    assert thread_data['id'] == newer and thread_data['replies'] == []
+    assert thread_data['next'] is None
+
+    response = client.get(f'/posts/{post_id}/comments/threads?limit=1&replies=2'
+                          f"&before={response.json['next']}", headers=headers)
+    [thread_data] = response.json['data']
+    assert thread_data['id'] == older
+    assert [reply['id'] for reply in thread_data['replies']] \
+        == older_replies[:2]
+    assert thread_data['next'] is not None
+
+
+def test_invalid_reply_cursor(client, login, thread):
+    comment, post_id = thread
+    root = comment('Root')
+
+    response = client.get(f'/posts/{post_id}/comments/{root}/replies?after=zz',
+                          headers=login('admin'))
+
+    assert response.status_code == 400
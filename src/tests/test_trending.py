@@ -0,0 +1,48 @@
+"""
+Tests of the ranking of trending posts.
+"""
+from services import events, trending
+
+
+def ranked(app):
+    """
+    Delivers the recorded events, and returns the trending posts.
+    """
+    with app.app_context():
+        events.dispatch('trending')
+        return trending.get_trending(10, app.config['TRENDING_HOURS'])
+
+
+def test_unlikes_are_withdrawn(app, client, login):
+    admin, user = login('admin'), login('user')
+    post = client.post('/posts/', headers=admin,
+                       json={'title': 'Liked', 'content': 'Then not'}).json
+    path = f"/posts/{post['id']}/like"
+    client.post(path, headers=user)
+    assert ranked(app) == [post['id']]
+
+    client.delete(path, headers=user)
+    assert ranked(app) == []
+
+    # Liking and unliking in the same batch of events cancels out
+    client.post(path, headers=user)
+    client.delete(path, headers=user)
+    assert ranked(app) == []
+
+
+def test_deleted_comments_are_withdrawn(app, client, login):
+    user = login('user')
+    comment = client.post('/posts/1/comments/', headers=user,
+                          json={'content': 'A comment'}).json
+    client.post('/posts/1/comments/', headers=user,
+                json={'content': 'A reply', 'parent_id': comment['id']})
+    post = client.post('/posts/', headers=user,
+                       json={'title': 'Liked', 'content': 'Once'}).json
+    client.post(f"/posts/{post['id']}/like", headers=login('admin'))
+    assert ranked(app) == [1, post['id']]
+
+    # The replies are purged with the comment
+    response = client.delete(f'/posts/1/comments/{comment["id"]}',
+                             headers=user)
+    assert response.status_code == 200
+    assert ranked(app) == [post['id']]
@@ -0,0 +1,58 @@
+"""
+Tests of ETags and conditional GETs.
+"""
+
+
+def test_matching_etag_is_answered_with_not_modified(client, login):
+    headers = login('admin')
+    response = client.get('/posts/1/likes', headers=headers)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('W/"')
+
+    response = client.get('/posts/1/likes',
+                          headers={**headers, 'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert not response.data
+
+
+def test_changes_give_a_new_etag(client, login):
+    admin, user = login('admin'), login('user')
+    etag = client.get('/posts/1/likes', headers=admin).headers['ETag']
+
+    # The user liked the post when the database was created
+    assert client.delete('/posts/1/like', headers=user).status_code == 200
+
+    response = client.get('/posts/1/likes',
+                          headers={**admin, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.json['data'] == []
+
+
+def test_following_feed_changes_with_followed_users(client, login):
+    admin, user = login('admin'), login('user')
+    client.post('/users/2/follow', headers=admin)
+    etag = client.get('/feed/following', headers=admin).headers['ETag']
+
+    client.post('/posts/', headers=user,
+                json={'title': 'New', 'content': 'A new post'})
+
+    response = client.get('/feed/following',
+                          headers={**admin, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'New' in {post['title'] for post in response.json}
+
+
+def test_each_representation_has_its_own_etag(client, login):
+    headers = login('admin')
+    json_etag = client.get('/posts/1/likes', headers=headers).headers['ETag']
+    page_etag = client.get('/posts/1/likes?page=2',
+                           headers=headers).headers['ETag']
+    msgpack_etag = client.get(
+        '/posts/1/likes',
+        headers={**headers, 'Accept': 'application/msgpack'}).headers['ETag']
+
+    assert len({json_etag, page_etag, msgpack_etag}) == 3
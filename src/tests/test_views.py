@@ -0,0 +1,49 @@
+"""
+Tests of the counting of post impressions.
+"""
+from services import views
+
+
+def test_not_modified_feed_counts_impressions(client, login, monkeypatch):
+    recorded = []
+    monkeypatch.setattr(views, 'record', lambda post_ids, viewer:
+                        recorded.append((list(post_ids), viewer)))
+    admin = login('admin')
+    user = login('user')
+
+    # Both users get the same page of the admin's timeline
+    response = client.get('/users/1/timeline', headers=admin)
+    assert response.status_code == 200
+    post_ids, viewer = recorded.pop()
+    assert post_ids and viewer == 1
+
+    response = client.get('/users/1/timeline', headers={
+        **user, 'If-None-Match': response.headers['ETag']})
+
+    assert response.status_code == 304
+    assert recorded == [(post_ids, 2)]
+
+
+def test_flushed_views_change_the_etag_of_the_post(app, client, login):
+    admin = login('admin')
+    client.get('/posts/1', headers=admin)
+    views.flush(app)
+    response = client.get('/posts/1', headers=admin)
+    etag = response.headers['ETag']
+    count = response.json['data']['views_count']
+
+    # Another viewer is counted once the views are flushed
+    with app.test_request_context():
+        views.record([1], 'another viewer')
+    views.flush(app)
+
+    response = client.get('/posts/1', headers={**admin, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.json['data']['views_count'] == count + 1
+
+    # Viewers already counted change nothing
+    etag = response.headers['ETag']
+    views.flush(app)
+    response = client.get('/posts/1', headers={**admin, 'If-None-Match': etag})
+    assert response.status_code == 304
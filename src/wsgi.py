@@ -0,0 +1,27 @@
+"""Production WSGI application initialization.
+
+Contains the code that creates the WSGI application for a pre-fork
+server, which imports it once in its master process and forks its
+workers from it.
+
+The application is set up completely before the workers are forked, so
+that its endpoints, mappers and compiled serializers are shared by every
+worker, in copy-on-write memory, instead of being built again by each.
+See `services.startup` for what is shared.
+
+Run it with gunicorn, whose configuration in `gunicorn.conf.py` preloads
+the application and gives each worker its own database connections:
+
+    pip install -r requirements-wsgi.txt
+    gunicorn wsgi:app
+
+The number of workers is read from `WEB_CONCURRENCY`, and the address
+they listen on from `BIND`. If `WARM_UP_CONNECTIONS` is set, each worker
+opens that many connections to each database before accepting traffic.
+"""
+
+from main import create_app
+from services import startup
+
+
+app = startup.before_fork(create_app())